@@ -0,0 +1,164 @@
+#!/usr/bin/python
+import collections
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when load_artwork() changes how images are scaled.
+ARTWORK_STYLE_VERSION = 1
+
+# Images kept decoded in memory.
+MEMORY_ARTWORK_COUNT = 16
+
+# An artwork file on disk: magic, width, height, then the RGB pixels.
+MAGIC = b'UHFA'
+HEADER_FORMAT = '<4sII'
+
+
+# --------------------------------------------------------------------
+# Returns the image at path scaled down (keeping its shape) to fit
+# max_size, in RGB. May return None in case of error.
+
+def load_artwork(path, max_size):
+    try:
+        artwork = Image.open(path)
+        artwork.thumbnail(max_size)
+        return artwork.convert('RGB')
+    except IOError:
+        logger.error('load_artwork(); error: IOError for file: ' + path)
+        return None
+
+
+# --------------------------------------------------------------------
+# Series logos and card artwork, decoded and scaled for the cards, so the
+# original (on a slow USB disk) is opened and scaled once rather than for
+# every card. Keyed by the file's path, size and modification time and the
+# size it is scaled to. The most recently used are kept in memory, all of
+# them on disk (cache_dir/<hash>.rgb).
+
+class artwork_cache:
+    def __init__ (self, cache_dir):
+        self.cache_dir = cache_dir
+        self.images = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError:
+            logger.error('artwork_cache(); error: unable to create directory: ' + cache_dir)
+
+
+    # --------------------------------------------------------------------
+    # May return None if the file is missing.
+
+    def _artwork_key(self, path, max_size):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key_fields = [ARTWORK_STYLE_VERSION, path, stat.st_size, stat.st_mtime_ns, list(max_size)]
+        return hashlib.sha1(json.dumps(key_fields).encode('utf-8')).hexdigest()
+
+
+    # --------------------------------------------------------------------
+
+    def _artwork_path(self, key):
+        return os.path.join(self.cache_dir, key + '.rgb')
+
+
+    # --------------------------------------------------------------------
+
+    def _remember(self, key, artwork):
+        with self.lock:
+            self.images[key] = artwork
+            self.images.move_to_end(key)
+            while len(self.images) > MEMORY_ARTWORK_COUNT:
+                self.images.popitem(last=False)
+
+
+    # --------------------------------------------------------------------
+    # May return None if the image is not on disk (or is damaged).
+
+    def _read(self, key):
+        header_size = struct.calcsize(HEADER_FORMAT)
+        try:
+            with open(self._artwork_path(key), 'rb') as artwork_file:
+                data = artwork_file.read()
+        except IOError:
+            return None
+        if len(data) < header_size:
+            return None
+        magic, wide, tall = struct.unpack_from(HEADER_FORMAT, data)
+        if (magic != MAGIC) or (len(data) != header_size + (wide * tall * 3)):
+            logger.error('_read(); error: damaged file: ' + self._artwork_path(key))
+            return None
+        return Image.frombytes('RGB', (wide, tall), data[header_size:])
+
+
+    # --------------------------------------------------------------------
+    # Writes to a temporary file and renames it into place, so a partly
+    # written image is never read.
+
+    def _write(self, key, artwork):
+        path = self._artwork_path(key)
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as artwork_file:
+                artwork_file.write(struct.pack(HEADER_FORMAT, MAGIC, artwork.size[0], artwork.size[1]))
+                artwork_file.write(artwork.tobytes())
+            os.replace(temp_path, path)
+        except OSError:
+            logger.error('_write(); error: unable to write file: ' + path)
+
+
+    # --------------------------------------------------------------------
+    # Returns the image at path scaled to fit max_size, in RGB, see
+    # load_artwork(). May return None in case of error.
+
+    def artwork(self, path, max_size):
+        key = self._artwork_key(path, max_size)
+        if key == None:
+            logger.error('artwork(); error: IOError for file: ' + path)
+            return None
+        with self.lock:
+            artwork = self.images.get(key, None)
+            if artwork != None:
+                self.images.move_to_end(key)
+                return artwork
+
+        artwork = self._read(key)
+        if artwork == None:
+            artwork = load_artwork(path, max_size)
+            if artwork == None:
+                return None
+            self._write(key, artwork)
+        self._remember(key, artwork)
+        return artwork
+
+
+    # --------------------------------------------------------------------
+    # Scales every image in paths (that is not already) on a background
+    # thread, so the first card to use each finds it ready.
+
+    def warm(self, paths, max_size):
+        def run():
+            for path in paths:
+                key = self._artwork_key(path, max_size)
+                if (key == None) or os.path.exists(self._artwork_path(key)):
+                    continue
+                artwork = load_artwork(path, max_size)
+                if artwork != None:
+                    self._write(key, artwork)
+            logger.info('warm(); ' + str(len(paths)) + ' images ready.')
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+import datetime
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# Longest single sleep. Deadlines are wall-clock times (when a program
+# starts or ends) but are slept on with the monotonic clock, so a sleep is
+# cut short now and then to notice the wall clock being set (NTP on a Pi
+# without a real-time clock).
+MAX_SLEEP = 5 * 60
+
+
+# --------------------------------------------------------------------
+# What the broadcast loops sleep on: until the next deadline, or until
+# another thread calls wake() (the player finishing a film, the channel
+# being reloaded).
+
+class broadcast_timer:
+    def __init__ (self):
+        self.condition = threading.Condition()
+        self.reasons = set()
+
+
+    # --------------------------------------------------------------------
+    # The time the deadlines are measured against (see simulated_timer in
+    # simulation.py for a virtual one).
+
+    def now(self):
+        return datetime.datetime.now()
+
+
+    # --------------------------------------------------------------------
+    # Safe to call from any thread. reason is a short string the sleeper is
+    # handed when it wakes.
+
+    def wake(self, reason):
+        with self.condition:
+            self.reasons.add(reason)
+            self.condition.notify_all()
+
+
+    # --------------------------------------------------------------------
+    # Sleeps for up to seconds (at most MAX_SLEEP). Returns the set of wake()
+    # reasons, empty if the time ran out.
+
+    def wait(self, seconds):
+        deadline = time.monotonic() + min(max(seconds, 0), MAX_SLEEP)
+        with self.condition:
+            while len(self.reasons) == 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            reasons = self.reasons
+            self.reasons = set()
+        return reasons
+
+
+    # --------------------------------------------------------------------
+    # Sleeps until date, a (naive, local) datetime. See wait().
+
+    def wait_until(self, date):
+        return self.wait((date - self.now()).total_seconds())
+
+
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+import json
+import logging
+import os
+import threading
+from compiled_channel import *
+
+
+logger = logging.getLogger(__name__)
+
+
+# Polls the channel file (manifest or compiled channel) and every schedule
+# and list file the schedule provider uses. Changed files are re-parsed on
+# the watcher's thread and handed to the provider, which swaps them in the
+# next time it is asked for a program. on_reload, if given, is called (on
+# the watcher's thread) after a reload has been handed over.
+
+class channel_watcher:
+    def __init__ (self, provider, channel_file_path, poll_interval, on_reload=None):
+        self.provider = provider
+        self.on_reload = on_reload
+        self.channel_file_path = channel_file_path
+        self.poll_interval = poll_interval
+        self.signatures = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Note the current state of the files, changes are relative to this.
+        for path in self._watched_paths():
+            self.signatures[path] = self._file_signature(path)
+
+
+    # --------------------------------------------------------------------
+    # Returns (modification time, size) for the file at path. May return None
+    # if the file is missing.
+
+    def _file_signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+
+    # --------------------------------------------------------------------
+
+    def _watched_paths(self):
+        return [self.channel_file_path] + self.provider.watched_paths()
+
+
+    # --------------------------------------------------------------------
+    # May return None in case of error (possibly the file is only partly written).
+
+    def _load_manifest(self, path):
+        try:
+            with open(path, 'r') as manifest_data:
+                return json.load(manifest_data)
+        except (IOError, ValueError):
+            logger.error('_load_manifest(); error: unable to load file: ' + path)
+            return None
+
+
+    # --------------------------------------------------------------------
+    # Checks every watched file once, returns the list of paths that changed.
+
+    def poll(self):
+        changed = []
+        for path in self._watched_paths():
+            signature = self._file_signature(path)
+            if path not in self.signatures:
+                # Newly referenced (by an edited manifest), the provider loads it as needed.
+                self.signatures[path] = signature
+            elif signature != self.signatures[path]:
+                self.signatures[path] = signature
+                changed.append(path)
+
+        if len(changed) == 0:
+            return changed
+        logger.info('poll(); changed files: ' + ', '.join(changed))
+
+        manifest = None
+        compiled = None
+        if self.channel_file_path in changed:
+            if self.channel_file_path.endswith('.uhfc'):
+                compiled = compiled_channel(self.channel_file_path)
+                if compiled.is_valid():
+                    manifest = compiled.manifest()
+                else:
+                    compiled = None
+            else:
+                manifest = self._load_manifest(self.channel_file_path)
+            if manifest == None:
+                # Try again on the next poll.
+                self.signatures[self.channel_file_path] = None
+                changed.remove(self.channel_file_path)
+
+        if (len(changed) > 0) or (manifest != None):
+            self.provider.prepare_reload(changed, manifest, compiled)
+            if self.on_reload != None:
+                self.on_reload()
+        return changed
+
+
+    # --------------------------------------------------------------------
+
+    def _run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as err:
+                logger.error('_run(); exception polling channel files: ' + str(err))
+
+
+    # --------------------------------------------------------------------
+
+    def start(self):
+        if self.thread != None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+
+    # --------------------------------------------------------------------
+
+    def stop(self):
+        if self.thread == None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+
@@ -0,0 +1,662 @@
+#!/usr/bin/python
+import bisect
+import collections.abc
+import datetime
+import json
+import logging
+import mmap
+import array
+import os
+import struct
+from day_timeline import *
+from resource_record import *
+
+
+logger = logging.getLogger(__name__)
+
+
+# A compiled channel is a single little-endian binary file. It begins with a
+# header, followed by a table of (offset, count) pairs, one per section.
+#
+#   STRING_OFFSETS  u32[count + 1] byte offsets into STRING_BLOB.
+#   STRING_BLOB     UTF-8 bytes of every (interned) string.
+#   RESOURCES       fixed-width resource records, deduplicated.
+#   SERIES          series records.
+#   SCHEDULES       one record per manifest schedule descriptor, sorted by start.
+#   DAYS            one record per scheduled day, index into SLOTS.
+#   SLOTS           (start seconds, resource index), sorted within each day.
+#   BRACKETS        day-of-the-week filler list brackets.
+#   LIST_REFS       list indices referenced by BRACKETS.
+#   LISTS           list records, index into LIST_RESOURCES.
+#   LIST_RESOURCES  resource indices referenced by LISTS.
+#
+# String references of NO_VALUE indicate a missing (None) value, as does a
+# year of NO_YEAR and a duration or start offset of NaN. A year that is not
+# a whole number (say "1960s") is kept with the extras.
+
+MAGIC = b'UHFC'
+FORMAT_VERSION = 2
+NO_VALUE = 0xFFFFFFFF
+NO_YEAR = -0x80000000
+MAX_YEAR = 0x7FFFFFFF
+NO_SECONDS = float('nan')
+
+HEADER_FORMAT = '<4sHHIIII'
+SECTION_FORMAT = '<II'
+RESOURCE_FORMAT = '<IIIIIIidd'
+# The duration and start offset, read straight from a resource record.
+RESOURCE_SECONDS_FORMAT = '<dd'
+RESOURCE_SECONDS_OFFSET = struct.calcsize('<IIIIIIi')
+SERIES_FORMAT = '<IIII'
+SCHEDULE_FORMAT = '<IIII'
+DAY_FORMAT = '<II'
+SLOT_FORMAT = '<II'
+BRACKET_FORMAT = '<IIIII'
+REF_FORMAT = '<I'
+LIST_FORMAT = '<IIII'
+
+STRING_OFFSETS_SECTION = 0
+STRING_BLOB_SECTION = 1
+RESOURCES_SECTION = 2
+SERIES_SECTION = 3
+SCHEDULES_SECTION = 4
+DAYS_SECTION = 5
+SLOTS_SECTION = 6
+BRACKETS_SECTION = 7
+LIST_REFS_SECTION = 8
+LISTS_SECTION = 9
+LIST_RESOURCES_SECTION = 10
+SECTION_COUNT = 11
+
+RESOURCE_KEYS = ('path', 'title', 'description', 'series_id', 'year', 'duration', 'start_offset')
+SERIES_KEYS = ('title', 'logo_path')
+
+
+# --------------------------------------------------------------------
+# Returns seconds (a duration or offset) as a float, NO_SECONDS for None.
+# Raises ValueError naming the resource if it is not a number.
+
+def _seconds(resource_id, key, value):
+    if value == None:
+        return NO_SECONDS
+    if isinstance(value, bool) or (not isinstance(value, (int, float))):
+        raise ValueError('resource ' + str(resource_id) + ' has a ' + key + ' that is not a number: ' + repr(value))
+    return float(value)
+
+
+# --------------------------------------------------------------------
+# Returns None for NO_SECONDS.
+
+def _seconds_value(seconds):
+    if seconds != seconds:
+        return None
+    return seconds
+
+
+# --------------------------------------------------------------------
+# May return None in case of error.
+
+def _load_json(path):
+    try:
+        with open(path, 'r') as json_data:
+            return json.load(json_data)
+    except IOError:
+        logger.error('_load_json(); error: IOError for file: ' + path)
+        return None
+
+
+# --------------------------------------------------------------------
+
+class _channel_writer:
+    def __init__ (self):
+        self.strings = []
+        self.string_indices = {}
+        self.resources = []
+        self.resource_indices = {}
+        self.series = []
+        self.schedules = []
+        self.days = []
+        self.slots = []
+        self.brackets = []
+        self.list_refs = []
+        self.lists = []
+        self.list_resources = []
+
+
+    # --------------------------------------------------------------------
+    # Interns string, returns its index in the string table.
+
+    def string(self, value):
+        if value == None:
+            return NO_VALUE
+        index = self.string_indices.get(value, None)
+        if index == None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.string_indices[value] = index
+        return index
+
+
+    # --------------------------------------------------------------------
+    # Any keys we do not have a fixed-width field for are kept as JSON.
+
+    def extras(self, dictionary, known_keys):
+        extras = {key: value for key, value in dictionary.items() if key not in known_keys}
+        if len(extras) == 0:
+            return NO_VALUE
+        return self.string(json.dumps(extras, sort_keys=True))
+
+
+    # --------------------------------------------------------------------
+    # Identical resources (even from different schedule files) share one
+    # record. Raises ValueError for a resource that can not be stored.
+
+    def resource(self, resource_id, resource):
+        year = resource.get('year', None)
+        known_keys = RESOURCE_KEYS
+        if year == None:
+            year = NO_YEAR
+        elif isinstance(year, bool) or (not isinstance(year, int)) or (abs(year) > MAX_YEAR):
+            # Kept as it is, with the extras.
+            year = NO_YEAR
+            known_keys = tuple(key for key in RESOURCE_KEYS if key != 'year')
+        record = (self.string(resource_id),
+                self.string(resource.get('path', None)),
+                self.string(resource.get('title', None)),
+                self.string(resource.get('description', None)),
+                self.string(resource.get('series_id', None)),
+                self.extras(resource, known_keys),
+                year,
+                _seconds(resource_id, 'duration', resource.get('duration', None)),
+                _seconds(resource_id, 'start_offset', resource.get('start_offset', None)))
+        index = self.resource_indices.get(record, None)
+        if index == None:
+            index = len(self.resources)
+            self.resources.append(record)
+            self.resource_indices[record] = index
+        return index
+
+
+    # --------------------------------------------------------------------
+
+    def add_schedule(self, start_ordinal, path, schedule):
+        resource_table = schedule.get('resources', {})
+        days = schedule.get('days', [])
+        self.schedules.append((start_ordinal, len(days), len(self.days), self.string(path)))
+        for one_day in days:
+            slots = []
+            for one_slot in one_day:
+                resource_id = one_slot.get('resource_id', None)
+                resource = resource_table.get(resource_id, None)
+                if resource == None:
+                    logger.error('add_schedule(); missing resource: ' + str(resource_id) + ' in: ' + path)
+                    continue
+                slots.append((time_string_to_seconds(one_slot['start_time']), self.resource(resource_id, resource)))
+            slots.sort(key=lambda slot: slot[0])
+            self.days.append((len(self.slots), len(slots)))
+            self.slots.extend(slots)
+
+
+    # --------------------------------------------------------------------
+
+    def add_list(self, list_id, path, resource_table):
+        first = len(self.list_resources)
+        for resource_id, resource in resource_table.items():
+            self.list_resources.append(self.resource(resource_id, resource))
+        self.lists.append((self.string(list_id), self.string(path), first, len(self.list_resources) - first))
+
+
+    # --------------------------------------------------------------------
+
+    def list_index(self, list_id):
+        for index, one_list in enumerate(self.lists):
+            if self.strings[one_list[0]] == list_id:
+                return index
+        self.lists.append((self.string(list_id), NO_VALUE, len(self.list_resources), 0))
+        return len(self.lists) - 1
+
+
+    # --------------------------------------------------------------------
+
+    def add_list_schedule(self, list_schedule):
+        for dotw, one_day in enumerate(list_schedule):
+            for one_bracket in one_day.get('schedule', []):
+                end_time = one_bracket.get('end_time', None)
+                list_ids = one_bracket.get('list_ids', [])
+                self.brackets.append((dotw,
+                        time_string_to_seconds(one_bracket['start_time']),
+                        NO_VALUE if end_time == None else time_string_to_seconds(end_time),
+                        len(self.list_refs), len(list_ids)))
+                for one_id in list_ids:
+                    self.list_refs.append(self.list_index(one_id))
+
+
+    # --------------------------------------------------------------------
+
+    def add_series(self, series_table):
+        for series_id, series in series_table.items():
+            self.series.append((self.string(series_id),
+                    self.string(series.get('title', None)),
+                    self.string(series.get('logo_path', None)),
+                    self.extras(series, SERIES_KEYS)))
+
+
+    # --------------------------------------------------------------------
+
+    def write(self, path, version, bobd, info):
+        header = struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, 0,
+                self.string(version), self.string(bobd),
+                self.string(info.get('title', None)), self.string(info.get('description', None)))
+        encoded = [one_string.encode('utf-8') for one_string in self.strings]
+        string_offsets = [0]
+        for one_string in encoded:
+            string_offsets.append(string_offsets[-1] + len(one_string))
+
+        sections = [
+            (struct.pack('<' + str(len(string_offsets)) + 'I', *string_offsets), len(self.strings)),
+            (b''.join(encoded), string_offsets[-1]),
+            (b''.join(struct.pack(RESOURCE_FORMAT, *one) for one in self.resources), len(self.resources)),
+            (b''.join(struct.pack(SERIES_FORMAT, *one) for one in self.series), len(self.series)),
+            (b''.join(struct.pack(SCHEDULE_FORMAT, *one) for one in self.schedules), len(self.schedules)),
+            (b''.join(struct.pack(DAY_FORMAT, *one) for one in self.days), len(self.days)),
+            (b''.join(struct.pack(SLOT_FORMAT, *one) for one in self.slots), len(self.slots)),
+            (b''.join(struct.pack(BRACKET_FORMAT, *one) for one in self.brackets), len(self.brackets)),
+            (b''.join(struct.pack(REF_FORMAT, one) for one in self.list_refs), len(self.list_refs)),
+            (b''.join(struct.pack(LIST_FORMAT, *one) for one in self.lists), len(self.lists)),
+            (b''.join(struct.pack(REF_FORMAT, one) for one in self.list_resources), len(self.list_resources))]
+
+        offset = struct.calcsize(HEADER_FORMAT) + (struct.calcsize(SECTION_FORMAT) * SECTION_COUNT)
+        section_table = b''
+        for data, count in sections:
+            section_table = section_table + struct.pack(SECTION_FORMAT, offset, count)
+            offset = offset + len(data)
+
+        # Write to a temporary file and rename so a running channel never sees a partial file.
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as output:
+            output.write(header)
+            output.write(section_table)
+            for data, count in sections:
+                output.write(data)
+        os.replace(temp_path, path)
+
+
+
+# --------------------------------------------------------------------
+# Compiles the channel (or list) file at manifest_path, along with every
+# schedule and list file it refers to, into a single binary file at
+# output_path. Returns True on success.
+
+def compile_channel(manifest_path, output_path):
+    manifest = _load_json(manifest_path)
+    if manifest == None:
+        logger.error('compile_channel(); unable to open the channel manifest.')
+        return False
+    channel_dir = os.path.dirname(manifest_path)
+    version = manifest.get('version', None)
+    writer = _channel_writer()
+
+    try:
+        if version == 'UHF List - v1':
+            writer.add_list(os.path.basename(manifest_path), os.path.basename(manifest_path), manifest.get('resources', {}))
+        elif version == 'UHF Channel - v1':
+            for list_id, list_descriptor in manifest.get('lists', {}).items():
+                path = list_descriptor.get('list_path', None)
+                list_data = None
+                if path != None:
+                    list_data = _load_json(os.path.join(channel_dir, path))
+                if list_data == None:
+                    logger.error('compile_channel(); unable to load list: ' + list_id + '.')
+                    continue
+                writer.add_list(list_id, path, list_data.get('resources', {}))
+
+            writer.add_list_schedule(manifest.get('dotw_list_schedule', None) or [])
+            writer.add_series(manifest.get('series', None) or {})
+
+            descriptors = []
+            for one_descriptor in manifest.get('schedules', None) or []:
+                start_date = datetime.datetime.strptime (one_descriptor['start_date'], '%Y-%m-%d')
+                descriptors.append((start_date.toordinal(), one_descriptor['schedule_path']))
+            descriptors.sort(key=lambda descriptor: descriptor[0])
+            for start_ordinal, path in descriptors:
+                schedule = _load_json(os.path.join(channel_dir, path))
+                if schedule == None:
+                    logger.error('compile_channel(); unable to load schedule: ' + path + '.')
+                    return False
+                writer.add_schedule(start_ordinal, path, schedule)
+        else:
+            logger.error('compile_channel(); unsupported channel file.')
+            return False
+    except ValueError as err:
+        logger.error('compile_channel(); error: ' + str(err))
+        return False
+
+    writer.write(output_path, version, manifest.get('beginning_of_broadcast_day', None), manifest.get('info', None) or {})
+    logger.info('compile_channel(); wrote ' + output_path + ', ' + str(len(writer.resources)) + ' resources, ' + str(len(writer.days)) + ' days.')
+    return True
+
+
+# --------------------------------------------------------------------
+# Read-only view of a compiled channel file. The file is memory-mapped and
+# records are decoded only when they are asked for.
+
+class compiled_channel:
+    def __init__ (self, path):
+        self.path = path
+        self.data = None
+        self.sections = None
+        self.schedule_ordinals = []
+
+        try:
+            with open(path, 'rb') as channel_file:
+                self.data = mmap.mmap(channel_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError):
+            logger.error('compiled_channel(); error: unable to map file: ' + path)
+            self.data = None
+            return
+
+        magic, format_version, reserved, self.version_ref, self.bobd_ref, self.title_ref, self.description_ref = struct.unpack_from(HEADER_FORMAT, self.data, 0)
+        if (magic != MAGIC) or (format_version != FORMAT_VERSION):
+            logger.error('compiled_channel(); error: unsupported file: ' + path)
+            self.data = None
+            return
+
+        offset = struct.calcsize(HEADER_FORMAT)
+        self.sections = []
+        for index in range(SECTION_COUNT):
+            self.sections.append(struct.unpack_from(SECTION_FORMAT, self.data, offset))
+            offset = offset + struct.calcsize(SECTION_FORMAT)
+
+        for index in range(self.sections[SCHEDULES_SECTION][1]):
+            self.schedule_ordinals.append(self._record(SCHEDULES_SECTION, SCHEDULE_FORMAT, index)[0])
+
+
+    # --------------------------------------------------------------------
+
+    def _record(self, section, record_format, index):
+        offset = self.sections[section][0] + (index * struct.calcsize(record_format))
+        return struct.unpack_from(record_format, self.data, offset)
+
+
+    # --------------------------------------------------------------------
+
+    def _count(self, section):
+        return self.sections[section][1]
+
+
+    # --------------------------------------------------------------------
+
+    def string(self, index):
+        if index == NO_VALUE:
+            return None
+        start, end = struct.unpack_from('<II', self.data, self.sections[STRING_OFFSETS_SECTION][0] + (index * 4))
+        blob_offset = self.sections[STRING_BLOB_SECTION][0]
+        return self.data[blob_offset + start:blob_offset + end].decode('utf-8')
+
+
+    # --------------------------------------------------------------------
+
+    def is_valid(self):
+        return self.data != None
+
+
+    # --------------------------------------------------------------------
+
+    def version(self):
+        return self.string(self.version_ref)
+
+
+    # --------------------------------------------------------------------
+    # May return None if the channel did not specify it.
+
+    def beginning_of_broadcast_day(self):
+        return self.string(self.bobd_ref)
+
+
+    # --------------------------------------------------------------------
+
+    def info(self):
+        return {'title': self.string(self.title_ref), 'description': self.string(self.description_ref)}
+
+
+    # --------------------------------------------------------------------
+
+    def resource_id(self, index):
+        return self.string(self._record(RESOURCES_SECTION, RESOURCE_FORMAT, index)[0])
+
+
+    # --------------------------------------------------------------------
+    # Returns the resource ID at index as it is stored (UTF-8 bytes), read
+    # straight from the string table.
+
+    def resource_id_bytes(self, index):
+        id_ref = struct.unpack_from('<I', self.data, self.sections[RESOURCES_SECTION][0] + (index * struct.calcsize(RESOURCE_FORMAT)))[0]
+        start, end = struct.unpack_from('<II', self.data, self.sections[STRING_OFFSETS_SECTION][0] + (id_ref * 4))
+        blob_offset = self.sections[STRING_BLOB_SECTION][0]
+        return self.data[blob_offset + start:blob_offset + end]
+
+
+    # --------------------------------------------------------------------
+    # Returns an array of the durations (allowing for start offsets, see
+    # resource_record.adjusted_duration()) of the resources at handles, read
+    # straight from the records without decoding them.
+
+    def adjusted_durations(self, handles):
+        durations = array.array('d')
+        base = self.sections[RESOURCES_SECTION][0] + RESOURCE_SECONDS_OFFSET
+        size = struct.calcsize(RESOURCE_FORMAT)
+        for handle in handles:
+            duration, start_offset = struct.unpack_from(RESOURCE_SECONDS_FORMAT, self.data, base + (handle * size))
+            durations.append(adjusted_duration(_seconds_value(duration), _seconds_value(start_offset)))
+        return durations
+
+
+    # --------------------------------------------------------------------
+    # Returns a resource_record for the resource at index.
+
+    def resource(self, index):
+        record = self._record(RESOURCES_SECTION, RESOURCE_FORMAT, index)
+        extras = self.string(record[5])
+        if extras != None:
+            extras = json.loads(extras)
+        year = None
+        if record[6] != NO_YEAR:
+            year = record[6]
+        elif (extras != None) and ('year' in extras):
+            year = extras.pop('year')
+            if len(extras) == 0:
+                extras = None
+        return resource_record(self.string(record[0]), self.string(record[1]), self.string(record[2]),
+                self.string(record[3]), self.string(record[4]), year, _seconds_value(record[7]), _seconds_value(record[8]), extras)
+
+
+    # --------------------------------------------------------------------
+    # Resources in a compiled channel are already stored once each, their
+    # index is their handle. Lets the channel stand in for a resource_catalog.
+
+    def record(self, handle):
+        return self.resource(handle)
+
+
+    # --------------------------------------------------------------------
+
+    def schedule_descriptors(self):
+        descriptors = []
+        for index in range(self._count(SCHEDULES_SECTION)):
+            start_ordinal, day_count, first_day, path_ref = self._record(SCHEDULES_SECTION, SCHEDULE_FORMAT, index)
+            descriptors.append({'schedule_path': self.string(path_ref),
+                    'start_date': datetime.date.fromordinal(start_ordinal).strftime('%Y-%m-%d')})
+        return descriptors
+
+
+    # --------------------------------------------------------------------
+    # Returns the day number (index into DAYS) for date, May return None if
+    # no schedule covers date.
+
+    def day_number(self, date):
+        ordinal = date.toordinal()
+        index = bisect.bisect_right(self.schedule_ordinals, ordinal) - 1
+        if index < 0:
+            return None
+        start_ordinal, day_count, first_day, path_ref = self._record(SCHEDULES_SECTION, SCHEDULE_FORMAT, index)
+        if ordinal - start_ordinal >= day_count:
+            return None
+        return first_day + ordinal - start_ordinal
+
+
+    # --------------------------------------------------------------------
+    # Returns a list of (start date ordinal, day count) for every schedule,
+    # in schedule order.
+
+    def schedule_day_counts(self):
+        counts = []
+        for index in range(self._count(SCHEDULES_SECTION)):
+            start_ordinal, day_count, first_day, path_ref = self._record(SCHEDULES_SECTION, SCHEDULE_FORMAT, index)
+            counts.append((start_ordinal, day_count))
+        return counts
+
+
+    # --------------------------------------------------------------------
+    # Returns the slots for a day as a list of (start seconds, resource index).
+
+    def day_slots(self, day_number):
+        first_slot, slot_count = self._record(DAYS_SECTION, DAY_FORMAT, day_number)
+        offset = self.sections[SLOTS_SECTION][0] + (first_slot * struct.calcsize(SLOT_FORMAT))
+        return list(struct.iter_unpack(SLOT_FORMAT, self.data[offset:offset + (slot_count * struct.calcsize(SLOT_FORMAT))]))
+
+
+    # --------------------------------------------------------------------
+    # Returns the slots for the day covering date, a list of (start seconds,
+    # resource index) sorted by start. May return None if no schedule covers
+    # date.
+
+    def day_slots_for_date(self, date):
+        day_number = self.day_number(date)
+        if day_number == None:
+            return None
+        return self.day_slots(day_number)
+
+
+    # --------------------------------------------------------------------
+    # Returns the 'dotw_list_schedule' in the same form as the manifest.
+
+    def list_schedule(self):
+        list_schedule = []
+        for index in range(self._count(BRACKETS_SECTION)):
+            dotw, start_seconds, end_seconds, first_ref, ref_count = self._record(BRACKETS_SECTION, BRACKET_FORMAT, index)
+            while len(list_schedule) <= dotw:
+                list_schedule.append({'schedule': []})
+            bracket = {'start_time': '%02d:%02d' % (start_seconds // 3600, (start_seconds % 3600) // 60)}
+            if end_seconds != NO_VALUE:
+                bracket['end_time'] = '%02d:%02d' % (end_seconds // 3600, (end_seconds % 3600) // 60)
+            list_ids = []
+            for ref_index in range(first_ref, first_ref + ref_count):
+                list_index = self._record(LIST_REFS_SECTION, REF_FORMAT, ref_index)[0]
+                list_ids.append(self.string(self._record(LISTS_SECTION, LIST_FORMAT, list_index)[0]))
+            bracket['list_ids'] = list_ids
+            list_schedule[dotw]['schedule'].append(bracket)
+        return list_schedule
+
+
+    # --------------------------------------------------------------------
+    # Returns the 'lists' table in the same form as the manifest.
+
+    def list_table(self):
+        list_table = {}
+        for index in range(self._count(LISTS_SECTION)):
+            id_ref, path_ref, first_resource, resource_count = self._record(LISTS_SECTION, LIST_FORMAT, index)
+            if path_ref != NO_VALUE:
+                list_table[self.string(id_ref)] = {'list_path': self.string(path_ref)}
+        return list_table
+
+
+    # --------------------------------------------------------------------
+    # Returns an array of the handles (resource indices) of the list's
+    # resources, in list order. May return None if there is no such list.
+
+    def list_resource_handles(self, list_id):
+        for index in range(self._count(LISTS_SECTION)):
+            id_ref, path_ref, first_resource, resource_count = self._record(LISTS_SECTION, LIST_FORMAT, index)
+            if self.string(id_ref) == list_id:
+                offset = self.sections[LIST_RESOURCES_SECTION][0] + (first_resource * struct.calcsize(REF_FORMAT))
+                return array.array('I', struct.unpack_from('<' + str(resource_count) + 'I', self.data, offset))
+        return None
+
+
+    # --------------------------------------------------------------------
+    # Returns the ID of the first list, useful for a compiled 'UHF List'.
+
+    def first_list_id(self):
+        if self._count(LISTS_SECTION) == 0:
+            return None
+        return self.string(self._record(LISTS_SECTION, LIST_FORMAT, 0)[0])
+
+
+    # --------------------------------------------------------------------
+    # Returns a dictionary in the same form as a channel manifest.
+
+    def manifest(self):
+        return {
+            'version': self.version(),
+            'info': self.info(),
+            'beginning_of_broadcast_day': self.beginning_of_broadcast_day(),
+            'schedules': self.schedule_descriptors(),
+            'dotw_list_schedule': self.list_schedule(),
+            'series': self.series_table(),
+            'lists': self.list_table()}
+
+
+    # --------------------------------------------------------------------
+
+    def series_table(self):
+        series_table = compiled_series_table(self)
+        return series_table
+
+
+
+# --------------------------------------------------------------------
+# Mapping of series ID to series in a compiled channel.
+
+class compiled_series_table(collections.abc.Mapping):
+    def __init__ (self, channel):
+        self.channel = channel
+        self.indices = {}
+        for index in range(channel._count(SERIES_SECTION)):
+            self.indices[channel.string(channel._record(SERIES_SECTION, SERIES_FORMAT, index)[0])] = index
+
+
+    def __getitem__(self, key):
+        id_ref, title_ref, logo_ref, extras_ref = self.channel._record(SERIES_SECTION, SERIES_FORMAT, self.indices[key])
+        series = {}
+        extras = self.channel.string(extras_ref)
+        if extras != None:
+            series.update(json.loads(extras))
+        if title_ref != NO_VALUE:
+            series['title'] = self.channel.string(title_ref)
+        if logo_ref != NO_VALUE:
+            series['logo_path'] = self.channel.string(logo_ref)
+        return series
+
+
+    def __iter__(self):
+        return iter(self.indices)
+
+
+    def __len__(self):
+        return len(self.indices)
+
+
+
+# --------------------------------------------------------------------
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print('usage: compiled_channel.py manifest.json [output.uhfc]')
+        sys.exit(1)
+    manifest_path = sys.argv[1]
+    output_path = os.path.splitext(manifest_path)[0] + '.uhfc'
+    if len(sys.argv) > 2:
+        output_path = sys.argv[2]
+    sys.exit(0 if compile_channel(manifest_path, output_path) else 1)
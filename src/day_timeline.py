@@ -0,0 +1,148 @@
+#!/usr/bin/python
+import bisect
+import datetime
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------------------------
+# Returns the number of seconds since midnight for a datetime (or time),
+# including the fractional part.
+
+def seconds_since_midnight(date):
+    return (date.hour * 3600) + (date.minute * 60) + date.second + (date.microsecond / 1000000)
+
+
+# --------------------------------------------------------------------
+# Returns seconds since midnight for a time string of the form 'HH:MM'.
+
+def time_string_to_seconds(time_string):
+    time = datetime.datetime.strptime (time_string, '%H:%M').time()
+    return (time.hour * 3600) + (time.minute * 60)
+
+
+# --------------------------------------------------------------------
+# A day of scheduled programs, parsed once when the day is loaded. Slots are
+# kept as parallel arrays sorted by start time (seconds since midnight) with
+# their end times and resources already resolved. Resources are given as
+# handles into catalog (a resource_catalog or compiled_channel), a handle
+# of None is a missing resource.
+
+class day_timeline:
+    def __init__ (self, start_seconds, handles, catalog):
+        self.start_seconds = []
+        self.end_seconds = []
+        self.handles = []
+        self.resources = []
+
+        slots = sorted(zip(start_seconds, handles), key=lambda slot: slot[0])
+        for start, handle in slots:
+            resource = None
+            if handle != None:
+                resource = catalog.record(handle)
+            if resource == None:
+                end = start
+            else:
+                end = start + resource.adjusted_duration()
+            self.start_seconds.append(start)
+            self.end_seconds.append(end)
+            self.handles.append(handle)
+            self.resources.append(resource)
+
+
+    # --------------------------------------------------------------------
+    # Returns the index of the last slot starting at or before seconds, -1
+    # if the first slot starts after seconds.
+
+    def index_at(self, seconds):
+        return bisect.bisect_right(self.start_seconds, seconds) - 1
+
+
+    # --------------------------------------------------------------------
+    # Returns the index of the first slot starting after seconds. Will be
+    # equal to slot_count() if there is none.
+
+    def index_after(self, seconds):
+        return bisect.bisect_right(self.start_seconds, seconds)
+
+
+    # --------------------------------------------------------------------
+
+    def slot_count(self):
+        return len(self.start_seconds)
+
+
+
+# --------------------------------------------------------------------
+# Returns a day_timeline for a day's schedule as found in a schedule file,
+# a list of {'start_time': 'HH:MM', 'resource_id': ...}. handle_table maps
+# the schedule's resource IDs to handles in catalog.
+
+def day_timeline_from_schedule(day_schedule, handle_table, catalog):
+    start_seconds = []
+    handles = []
+    for one_slot in day_schedule:
+        resource_id = one_slot.get('resource_id', None)
+        handle = None
+        if (resource_id != None) and (handle_table != None):
+            handle = handle_table.get(resource_id, None)
+        if handle == None:
+            logger.error('day_timeline_from_schedule(); missing resource: ' + str(resource_id) + '.')
+        start_seconds.append(time_string_to_seconds(one_slot['start_time']))
+        handles.append(handle)
+    return day_timeline(start_seconds, handles, catalog)
+
+
+
+# --------------------------------------------------------------------
+# A day of filler list brackets (a 'schedule' of the 'dotw_list_schedule').
+# The brackets are flattened into disjoint segments, each with the list IDs
+# in effect, so a lookup is a single binary search.
+
+class bracket_timeline:
+    def __init__ (self, brackets):
+        parsed = []
+        for one_bracket in brackets:
+            end_time = one_bracket.get('end_time', None)
+            end_seconds = None
+            if end_time != None:
+                end_seconds = time_string_to_seconds(end_time)
+            parsed.append((time_string_to_seconds(one_bracket['start_time']), end_seconds, one_bracket.get('list_ids', [])))
+
+        # The list IDs can only change at a bracket's start or end time.
+        boundaries = {0}
+        for start, end, list_ids in parsed:
+            boundaries.add(start)
+            if end != None:
+                boundaries.add(end)
+
+        self.start_seconds = sorted(boundaries)
+        self.list_ids = [self._list_ids_at(parsed, seconds) for seconds in self.start_seconds]
+
+
+    # --------------------------------------------------------------------
+    # Walks the brackets in order, the last one to have begun and not yet
+    # ended wins.
+
+    def _list_ids_at(self, parsed, seconds):
+        list_ids = []
+        for start, end, bracket_list_ids in parsed:
+            if start > seconds:
+                break
+            if (end == None) or (end > seconds):
+                list_ids = bracket_list_ids
+        return list_ids
+
+
+    # --------------------------------------------------------------------
+    # May return an empty list.
+
+    def list_ids_at(self, seconds):
+        index = bisect.bisect_right(self.start_seconds, seconds) - 1
+        if index < 0:
+            return []
+        return self.list_ids[index]
+
+
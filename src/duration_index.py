@@ -0,0 +1,95 @@
+#!/usr/bin/python
+import array
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+_REMOVED = float('inf')
+
+
+# --------------------------------------------------------------------
+# Durations of a list's programs in (shuffled) play order, for finding the
+# first program not yet removed (shown) that is no longer than a given
+# duration. A segment tree of minimum durations: a lookup or a removal is
+# O(log n) however many programs are shown or too long. removed, if given,
+# flags the positions that start out removed.
+
+class duration_index:
+    def __init__ (self, durations, removed=None):
+        self.size = 1
+        while self.size < len(durations):
+            self.size = self.size * 2
+        self.remaining = len(durations)
+
+        # Leaves are at [size, 2 * size), the minimum of a node's children is
+        # at the node. Unused leaves count as removed.
+        self.tree = array.array('d', [_REMOVED]) * (2 * self.size)
+        for position, duration in enumerate(durations):
+            if (removed != None) and removed[position]:
+                self.remaining = self.remaining - 1
+            else:
+                self.tree[self.size + position] = duration
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = min(self.tree[2 * node], self.tree[(2 * node) + 1])
+
+
+    # --------------------------------------------------------------------
+    # Returns the first position (in play order) at or after start whose
+    # duration is no more than max_duration, -1 if there is none.
+
+    def first_at_most(self, max_duration, start=0):
+        if self.tree[1] > max_duration:
+            return -1
+        if start <= 0:
+            node = 1
+            while node < self.size:
+                node = 2 * node
+                if self.tree[node] > max_duration:
+                    node = node + 1
+            return node - self.size
+        return self._first_at_most(1, 0, self.size, start, max_duration)
+
+
+    # --------------------------------------------------------------------
+    # Search of the subtree at node, covering positions [low, high).
+
+    def _first_at_most(self, node, low, high, start, max_duration):
+        if (high <= start) or (self.tree[node] > max_duration):
+            return -1
+        if node >= self.size:
+            return low
+        middle = (low + high) // 2
+        position = self._first_at_most(2 * node, low, middle, start, max_duration)
+        if position < 0:
+            position = self._first_at_most((2 * node) + 1, middle, high, start, max_duration)
+        return position
+
+
+    # --------------------------------------------------------------------
+
+    def is_removed(self, position):
+        return self.tree[self.size + position] == _REMOVED
+
+
+    # --------------------------------------------------------------------
+
+    def remove(self, position):
+        node = self.size + position
+        if self.tree[node] == _REMOVED:
+            return
+        self.tree[node] = _REMOVED
+        self.remaining = self.remaining - 1
+        node = node // 2
+        while node >= 1:
+            self.tree[node] = min(self.tree[2 * node], self.tree[(2 * node) + 1])
+            node = node // 2
+
+
+    # --------------------------------------------------------------------
+
+    def remaining_count(self):
+        return self.remaining
+
+
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+from xml.sax.saxutils import escape, quoteattr
+from compiled_channel import *
+from schedule_program_provider import *
+
+
+logger = logging.getLogger(__name__)
+
+
+# Exports a channel's program guide (EPG) as XMLTV or JSON. Programs are
+# read one day at a time through the schedule provider and written as they
+# are read, so memory use does not grow with the length of the range.
+#
+#   epg_export.py manifest.json --start 2022-09-04 --days 7 --format xmltv --output guide.xml
+
+
+# --------------------------------------------------------------------
+# May return None in case of error.
+
+def load_channel(channel_file_path):
+    compiled = None
+    if channel_file_path.endswith('.uhfc'):
+        compiled = compiled_channel(channel_file_path)
+        if not compiled.is_valid():
+            return None
+        manifest = compiled.manifest()
+    else:
+        try:
+            with open(channel_file_path, 'r') as manifest_data:
+                manifest = json.load(manifest_data)
+        except IOError:
+            logger.error('load_channel(); IOError for file: ' + channel_file_path)
+            return None
+    if manifest.get('version', None) != 'UHF Channel - v1':
+        logger.error('load_channel(); not a schedule channel file: ' + channel_file_path)
+        return None
+
+    bobd = manifest.get('beginning_of_broadcast_day', None) or '05:50'
+    bobd_time = datetime.datetime.strptime (bobd, '%H:%M').time()
+    provider = schedule_program_provider(os.path.dirname(channel_file_path),
+            manifest.get('schedules', None), manifest.get('dotw_list_schedule', None),
+            manifest.get('series', None), manifest.get('lists', None), bobd_time, 0, 0, compiled)
+    return provider, manifest
+
+
+# --------------------------------------------------------------------
+# Yields the programs on the air from start_date up to end_date, in order.
+# The day before start_date is read too, for a program running past midnight.
+# Days without a schedule are skipped.
+
+def programs_in_range(provider, start_date, end_date):
+    schedules = {}
+    day = datetime.datetime.combine(start_date.date(), datetime.time()) - datetime.timedelta(days=1)
+    while day < end_date:
+        programs = provider.scheduled_programs_for_day(day, schedules)
+        if programs != None:
+            for program in programs:
+                if (program['end_date'] > start_date) and (program['start_date'] < end_date):
+                    yield program
+        day = day + datetime.timedelta(days=1)
+
+
+# --------------------------------------------------------------------
+
+def _xmltv_time(date):
+    return date.astimezone().strftime('%Y%m%d%H%M%S %z')
+
+
+# --------------------------------------------------------------------
+
+def export_xmltv(provider, channel_id, channel_title, channel_dir, start_date, end_date, output):
+    output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    output.write('<!DOCTYPE tv SYSTEM "xmltv.dtd">\n')
+    output.write('<tv generator-info-name="UHF">\n')
+    output.write('  <channel id=' + quoteattr(channel_id) + '>\n')
+    output.write('    <display-name>' + escape(channel_title) + '</display-name>\n')
+    output.write('  </channel>\n')
+
+    count = 0
+    for program in programs_in_range(provider, start_date, end_date):
+        output.write('  <programme start=' + quoteattr(_xmltv_time(program['start_date'])) +
+                ' stop=' + quoteattr(_xmltv_time(program['end_date'])) +
+                ' channel=' + quoteattr(channel_id) + '>\n')
+        title = program.get('title', 'No Title')
+        series_title = program.get('series_title', None)
+        if series_title != None:
+            output.write('    <title>' + escape(series_title) + '</title>\n')
+            output.write('    <sub-title>' + escape(title) + '</sub-title>\n')
+        else:
+            output.write('    <title>' + escape(title) + '</title>\n')
+        description = program.get('description', None)
+        if description != None:
+            output.write('    <desc>' + escape(description) + '</desc>\n')
+        year = program.get('year', None)
+        if year != None:
+            output.write('    <date>' + escape(str(year)) + '</date>\n')
+        artwork_path = program.get('artwork_path', None)
+        if artwork_path != None:
+            output.write('    <icon src=' + quoteattr(os.path.normpath(os.path.join(channel_dir, artwork_path))) + ' />\n')
+        output.write('  </programme>\n')
+        count = count + 1
+
+    output.write('</tv>\n')
+    return count
+
+
+# --------------------------------------------------------------------
+
+def export_json(provider, channel_id, channel_title, channel_dir, start_date, end_date, output):
+    output.write('{"channel": ' + json.dumps({'id': channel_id, 'title': channel_title}) + ',\n')
+    output.write(' "programs": [')
+
+    count = 0
+    for program in programs_in_range(provider, start_date, end_date):
+        entry = {
+            'start': program['start_date'].isoformat(),
+            'stop': program['end_date'].isoformat(),
+            'title': program.get('title', 'No Title'),
+            'series_title': program.get('series_title', None),
+            'description': program.get('description', None),
+            'year': program.get('year', None),
+            'duration': program.get('duration', 0)}
+        artwork_path = program.get('artwork_path', None)
+        if artwork_path != None:
+            entry['artwork_path'] = os.path.normpath(os.path.join(channel_dir, artwork_path))
+        if count > 0:
+            output.write(',')
+        output.write('\n  ' + json.dumps(entry))
+        count = count + 1
+
+    output.write('\n]}\n')
+    return count
+
+
+# --------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a UHF channel\'s program guide.')
+    parser.add_argument('channel', help='channel manifest (.json) or compiled channel (.uhfc)')
+    parser.add_argument('--start', help='first day to export, YYYY-MM-DD (default today)')
+    parser.add_argument('--days', type=int, default=7, help='number of days to export')
+    parser.add_argument('--format', choices=['xmltv', 'json'], default='xmltv')
+    parser.add_argument('--channel-id', default=None, help='XMLTV channel id')
+    parser.add_argument('--output', default=None, help='output file (default stdout)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    loaded = load_channel(args.channel)
+    if loaded == None:
+        return 1
+    provider, manifest = loaded
+
+    if args.start != None:
+        start_date = datetime.datetime.strptime (args.start, '%Y-%m-%d')
+    else:
+        start_date = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    end_date = start_date + datetime.timedelta(days=args.days)
+
+    info = manifest.get('info', None) or {}
+    channel_title = info.get('title', None) or 'UHF'
+    channel_id = args.channel_id
+    if channel_id == None:
+        channel_id = 'uhf.' + ''.join(character for character in channel_title.lower() if character.isalnum())
+    channel_dir = os.path.dirname(os.path.abspath(args.channel))
+
+    exporter = export_xmltv if args.format == 'xmltv' else export_json
+    if args.output != None:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            count = exporter(provider, channel_id, channel_title, channel_dir, start_date, end_date, output)
+    else:
+        count = exporter(provider, channel_id, channel_title, channel_dir, start_date, end_date, sys.stdout)
+    logger.info('main(); exported ' + str(count) + ' programs.')
+    return 0
+
+
+# --------------------------------------------------------------------
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+import bisect
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------------------------
+# Picks which filler list to draw from for one bracket of the
+# 'dotw_list_schedule'. Lists are weighted by their number of programs. They
+# are kept sorted by their shortest program so the lists able to fill a gap
+# are always a prefix, and a pick is a single random draw over the
+# cumulative weights of that prefix, no retries.
+
+class filler_sampler:
+    def __init__ (self, list_ids, providers):
+        lists = []
+        for list_id, provider in zip(list_ids, providers):
+            if provider == None:
+                continue
+            shortest = provider.shortest_program_duration()
+            if (shortest == None) or (provider.program_count() == 0):
+                continue
+            lists.append((shortest, list_id, provider))
+        lists.sort(key=lambda one_list: one_list[0])
+
+        self.shortest_durations = []
+        self.cumulative_counts = []
+        self.list_ids = []
+        self.providers = []
+        total_count = 0
+        for shortest, list_id, provider in lists:
+            total_count = total_count + provider.program_count()
+            self.shortest_durations.append(shortest)
+            self.cumulative_counts.append(total_count)
+            self.list_ids.append(list_id)
+            self.providers.append(provider)
+
+
+    # --------------------------------------------------------------------
+
+    def total_count(self):
+        if len(self.cumulative_counts) == 0:
+            return 0
+        return self.cumulative_counts[-1]
+
+
+    # --------------------------------------------------------------------
+    # Returns the provider of a list, chosen at random in proportion to its
+    # number of programs, from the lists that have a program no longer than
+    # max_duration. May return None if no list does. rng is the caller's
+    # random.Random, so its draws are its own.
+
+    def provider_for_duration(self, max_duration, rng):
+        eligible_count = bisect.bisect_right(self.shortest_durations, max_duration)
+        if eligible_count == 0:
+            return None
+        draw = rng.randrange(self.cumulative_counts[eligible_count - 1])
+        return self.providers[bisect.bisect_right(self.cumulative_counts, draw)]
+
+
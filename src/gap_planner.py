@@ -0,0 +1,44 @@
+#!/usr/bin/python
+import logging
+import math
+
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------------------------
+# Chooses which of the candidate filler durations to play in a gap of
+# budget seconds, each one preceded by a title card of card_time seconds,
+# so that as little of the gap as possible is left on a title card. Solved
+# exactly as a 0/1 knapsack: the set of reachable totals is kept as the
+# bits of an integer, one shift-and-or per candidate, so even hours-long
+# gaps with dozens of candidates take a few milliseconds.
+# Returns the indices of the chosen candidates, in candidate order.
+
+def plan_gap(durations, card_time, budget):
+    capacity = math.floor(budget)
+    if capacity <= 0:
+        return []
+    mask = (1 << (capacity + 1)) - 1
+    weights = [math.ceil(duration + card_time) for duration in durations]
+
+    # reachable[i] holds the totals that can be made from the first i candidates.
+    reachable = [1]
+    for weight in weights:
+        totals = reachable[-1]
+        if (weight > 0) and (weight <= capacity):
+            totals = (totals | (totals << weight)) & mask
+        reachable.append(totals)
+
+    total = reachable[-1].bit_length() - 1
+    chosen = []
+    for index in range(len(weights) - 1, -1, -1):
+        if (reachable[index] >> total) & 1:
+            # This total was reachable without the candidate.
+            continue
+        chosen.append(index)
+        total = total - weights[index]
+    chosen.reverse()
+    return chosen
+
+
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+import bisect
+import datetime
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------------------------
+# The days the channel has a schedule for, as sorted, disjoint ranges of
+# day ordinals. Built from the schedules' start dates and day counts alone,
+# no day is parsed to build it. Queries over a span of dates then read only
+# the days that are covered (and only those).
+
+class interval_index:
+    def __init__ (self):
+        self.ranges = []
+        self.first_ordinals = []
+        self.end_ordinals = []
+
+
+    # --------------------------------------------------------------------
+    # Adds day_count days from first_ordinal on.
+
+    def add_days(self, first_ordinal, day_count):
+        if day_count > 0:
+            self.ranges.append((first_ordinal, first_ordinal + day_count))
+
+
+    # --------------------------------------------------------------------
+    # Sorts and merges the ranges added.
+
+    def finish(self):
+        self.first_ordinals = []
+        self.end_ordinals = []
+        for first, end in sorted(self.ranges):
+            if (len(self.end_ordinals) > 0) and (first <= self.end_ordinals[-1]):
+                self.end_ordinals[-1] = max(self.end_ordinals[-1], end)
+            else:
+                self.first_ordinals.append(first)
+                self.end_ordinals.append(end)
+        self.ranges = []
+
+
+    # --------------------------------------------------------------------
+    # date is a date (or datetime).
+
+    def covers(self, date):
+        ordinal = date.toordinal()
+        index = bisect.bisect_right(self.first_ordinals, ordinal) - 1
+        return (index >= 0) and (ordinal < self.end_ordinals[index])
+
+
+    # --------------------------------------------------------------------
+    # Returns the covered dates from first_date through last_date, in order.
+
+    def covered_dates(self, first_date, last_date):
+        dates = []
+        first = first_date.toordinal()
+        last = last_date.toordinal()
+        index = max(bisect.bisect_right(self.first_ordinals, first) - 1, 0)
+        while (index < len(self.first_ordinals)) and (self.first_ordinals[index] <= last):
+            for ordinal in range(max(first, self.first_ordinals[index]), min(last + 1, self.end_ordinals[index])):
+                dates.append(datetime.date.fromordinal(ordinal))
+            index = index + 1
+        return dates
+
+
+    # --------------------------------------------------------------------
+
+    def day_count(self):
+        count = 0
+        for first, end in zip(self.first_ordinals, self.end_ordinals):
+            count = count + (end - first)
+        return count
+
+
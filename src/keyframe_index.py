@@ -0,0 +1,188 @@
+#!/usr/bin/python
+import array
+import bisect
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_VERSION = 'UHF Keyframe Index - v1'
+
+# Lists the video packets of a file with their flags (K for a keyframe).
+# Only demuxes the file, nothing is decoded.
+FFPROBE_ARGUMENTS = ['-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0']
+
+# The probe reads through the whole file, usually from the disk the film
+# that is playing is read from. Where nice and ionice are there it runs
+# niced and in the idle I/O class (only reading when the disk is otherwise
+# idle) so as not to starve the film.
+PROBE_NICENESS = 10
+NICE_ARGUMENTS = ['-n', str(PROBE_NICENESS)]
+IONICE_ARGUMENTS = ['-c', '3']
+
+
+# --------------------------------------------------------------------
+# Returns the keyframe times (seconds, sorted) of the video file at path, an
+# array. May return None if ffprobe is missing or fails.
+
+def probe_keyframes(path):
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe == None:
+        logger.error('probe_keyframes(); error: ffprobe not found.')
+        return None
+    command = [ffprobe] + FFPROBE_ARGUMENTS + [path]
+    ionice = shutil.which('ionice')
+    if ionice != None:
+        command = [ionice] + IONICE_ARGUMENTS + command
+    nice = shutil.which('nice')
+    if nice != None:
+        command = [nice] + NICE_ARGUMENTS + command
+    try:
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.error('probe_keyframes(); error: unable to probe file: ' + path + ', ' + str(err))
+        return None
+
+    keyframes = array.array('d')
+    for line in output.decode('utf-8', 'replace').splitlines():
+        fields = line.split(',')
+        if (len(fields) < 2) or ('K' not in fields[1]):
+            continue
+        try:
+            keyframes.append(float(fields[0]))
+        except ValueError:
+            continue
+    return array.array('d', sorted(keyframes))
+
+
+# --------------------------------------------------------------------
+# Keyframe times of the films joined mid-program, keyed by path and checked
+# against the file's size and modification time. Kept in one file (in the
+# channel directory) so a join can open a film right on a keyframe without
+# the player having to hunt for one. Files not yet indexed are probed on a
+# background thread, the join that asked goes ahead without.
+
+class keyframe_cache:
+    def __init__ (self, cache_path):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.requested = set()
+        self.thread = None
+        self._load()
+
+
+    # --------------------------------------------------------------------
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r') as cache_data:
+                cache = json.load(cache_data)
+        except (IOError, ValueError):
+            return
+        if cache.get('version', None) != INDEX_VERSION:
+            logger.info('_load(); ignoring keyframe cache of another version: ' + self.cache_path)
+            return
+        for path, entry in cache.get('files', {}).items():
+            try:
+                self.entries[path] = (entry['size'], entry['mtime_ns'], array.array('d', entry['keyframes']))
+            except (KeyError, TypeError):
+                continue
+
+
+    # --------------------------------------------------------------------
+    # Write to a temporary file and rename so a reader never sees a partial cache.
+
+    def save(self):
+        with self.lock:
+            files = {}
+            for path, (size, mtime_ns, keyframes) in self.entries.items():
+                files[path] = {'size': size, 'mtime_ns': mtime_ns, 'keyframes': keyframes.tolist()}
+        temp_path = self.cache_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as cache_data:
+                json.dump({'version': INDEX_VERSION, 'files': files}, cache_data)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            logger.info('save(); unable to save keyframe cache: ' + self.cache_path)
+
+
+    # --------------------------------------------------------------------
+    # Returns (size, mtime_ns) for the file at path. May return None.
+
+    def _file_signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+
+    # --------------------------------------------------------------------
+    # Returns the keyframe times for the file at path. May return None if the
+    # file has not been indexed (or has changed since).
+
+    def keyframes(self, path):
+        with self.lock:
+            entry = self.entries.get(path, None)
+        if entry == None:
+            return None
+        if self._file_signature(path) != (entry[0], entry[1]):
+            return None
+        return entry[2]
+
+
+    # --------------------------------------------------------------------
+    # Returns the time of the last keyframe at or before position in the file
+    # at path. May return None if the file is not indexed.
+
+    def keyframe_at_or_before(self, path, position):
+        keyframes = self.keyframes(path)
+        if (keyframes == None) or (len(keyframes) == 0):
+            return None
+        index = bisect.bisect_right(keyframes, position)
+        if index == 0:
+            return keyframes[0]
+        return keyframes[index - 1]
+
+
+    # --------------------------------------------------------------------
+    # Has the file at path indexed in the background, if it is not already.
+
+    def request(self, path):
+        with self.lock:
+            if path in self.requested:
+                return
+            self.requested.add(path)
+            if (self.thread == None) or (not self.thread.is_alive()):
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.requests.put(path)
+
+
+    # --------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            path = self.requests.get()
+            signature = self._file_signature(path)
+            keyframes = None
+            if signature != None:
+                keyframes = probe_keyframes(path)
+            with self.lock:
+                self.requested.discard(path)
+                if keyframes != None:
+                    self.entries[path] = (signature[0], signature[1], keyframes)
+            if keyframes != None:
+                logger.info('_run(); indexed ' + str(len(keyframes)) + ' keyframes: ' + path)
+                self.save()
+
+
@@ -1,29 +1,70 @@
 #!/usr/bin/python
 import json
 import logging
+import array
 import os
 import random
+import time
+from duration_index import *
+from resource_columns import *
+from resource_record import *
+from rotation_state import *
 
 
 logger = logging.getLogger(__name__)
 
 
+# Rotation state is saved after this many picks, or at the first pick this
+# many seconds after the last save, to spare the SD card.
+ROTATION_SAVE_BATCH = 8
+ROTATION_SAVE_INTERVAL = 15 * 60
+
+
+# Plays a list's programs in shuffled rotation. A list file's resources are
+# kept column by column (see resource_columns.py), handles and catalog
+# instead supply resources already loaded (by a compiled channel), as an
+# array of the list's handles in catalog. With a state_path the
+# rotation is saved there (see rotation_state.py) and picked up again by the
+# next provider for the same list.
+
 class list_program_provider:
-    def __init__ (self, list_path):
-        self.resource_table = None
-        self.id_array = None
-        self.too_long_count = 0
+    def __init__ (self, list_path, handles=None, catalog=None, state_path=None):
+        self.catalog = catalog
+        self.handles = None
+        self.durations = None
+        self.order = None
+        self.positions = None
+        self.duration_index = None
+        self.shortest_duration = None
         self.program_index = 0
+        self.state_path = state_path
+        self.fingerprint = None
+        self.unsaved_count = 0
+        self.save_time = time.monotonic()
         
-        # Load JSON file for list.
-        list_data = self._load_list(list_path)
-        if list_data == None:
-            logger.error ('list_program_provider(); error: unable to load list file.')
-            return
-        self.resource_table = list_data.get('resources', {})
+        if handles != None:
+            # Resources were supplied (from a compiled channel), nothing to load
+            # or decode: durations and IDs are read straight from the file.
+            self.handles = handles
+            self.durations = self.catalog.adjusted_durations(handles)
+            self.fingerprint = rotation_fingerprint_of_bytes(self.catalog.resource_id_bytes(handle) for handle in handles)
+        else:
+            # Load JSON file for list.
+            list_data = self._load_list(list_path)
+            if list_data == None:
+                logger.error ('list_program_provider(); error: unable to load list file.')
+                return
+            self.catalog = resource_columns()
+            for resource_id, resource in list_data.get('resources', {}).items():
+                self.catalog.add(resource_id, resource)
+            list_data = None
+            self.handles = range(self.catalog.count())
+            self.durations = self.catalog.adjusted_durations()
+            self.fingerprint = rotation_fingerprint(self.catalog.resource_id(handle) for handle in self.handles)
         
-        # Shuffle the list of programs.
-        self._reset_list()
+        # Carry on with the saved rotation, otherwise shuffle the list of programs.
+        if not self._restore_rotation():
+            self._reset_list()
         
     
     # --------------------------------------------------------------------
@@ -42,137 +83,162 @@ class list_program_provider:
     # --------------------------------------------------------------------
     
     def _reset_list(self):
-        # Shuffle the resource IDs.
-        self.id_array = list(self.resource_table.keys())
-        random.shuffle(self.id_array)
-        
-        # Clear the 'shown' flags.
-        for key, value in self.resource_table.items():
-            value['shown'] = False
+        # Shuffle the resource handles.
+        self.order = array.array('I', range(len(self.handles)))
+        random.shuffle(self.order)
         
-        # Reset 'too_long_count'
-        self.too_long_count = 0
+        # Nothing is shown yet.
+        self._index_rotation(None)
         self.program_index = 0
+        self.save_rotation()
         
     
     # --------------------------------------------------------------------
-    # Returns duration for resource allowing for optional start_offset that
-    # will (naturally) shorten the normal duration of the movie.
+    # Indexes the durations in play order, shown flags the positions that
+    # have been shown (None for none). Also keeps the position in play order
+    # of each program, the inverse of order.
     
-    def _resource_adjusted_duration(self, resource):
-        duration = resource.get('duration', 0)
-        if duration > 0:
-            duration = duration - resource.get('start_offset', 0)
-        else:
-            logger.error('_resource_adjusted_duration(); resource with 0 duration.')
-        return duration
+    def _index_rotation(self, shown):
+        durations = self.durations
+        self.duration_index = duration_index([durations[index] for index in self.order], shown)
+        self.positions = array.array('I', bytes(self.order.itemsize * len(self.order)))
+        for position, index in enumerate(self.order):
+            self.positions[index] = position
+        self.shortest_duration = None
+        if len(durations) > 0:
+            self.shortest_duration = min(durations)
         
-     
+    
     # --------------------------------------------------------------------
-    # May return None.
+    # Returns the handle of the program at position in play order.
     
-    def _get_random_program_from_list(self, list_id, max_duration):
-        if max_duration <= 0:
-            logger.error('_get_random_program_from_list(); param error, max_duration less than zero (' + str(max_duration) + ').')
-            return None
+    def _handle_at(self, position):
+        return self.handles[self.order[position]]
         
-        id_array = self._shuffled_ids_for_list(list_id)
-        if id_array == None:
-            return None
-        resource_table = self.list_dict.get('resources', None)
-        if resource_table == None:
-            return None
+    
+    # --------------------------------------------------------------------
+    # Returns False if there is no saved rotation for the list.
+    
+    def _restore_rotation(self):
+        if self.state_path == None:
+            return False
+        state = load_rotation_state(self.state_path, len(self.handles), self.fingerprint)
+        if state == None:
+            return False
+        self.order, shown, self.program_index = state
+        self._index_rotation(shown)
+        if self.duration_index.remaining_count() == 0:
+            return False
+        logger.info('_restore_rotation(); ' + str(self.duration_index.remaining_count()) + ' of ' + str(len(self.handles)) + ' programs left to show.')
+        return True
         
-        # Walk resources, skipping one we have already shown.
-        resource_id = None
-        shown_count = 0
-        long_count = 0
-        for one_id in id_array:
-            resource = resource_table[one_id]
-            if resource['shown']:
-                shown_count = shown_count + 1
-                continue
-            duration = resource.get('duration', None)
-            if duration == None:
-                logger.error('_get_random_program_from_list(); missing duration for resource: ' + one_id)
-                continue
-            if duration < max_duration:
-                resource_id = one_id
-                resource['shown'] = True
-                shown_count = shown_count + 1
-                logger.info ('Filler from list: ' + list_id + ' that has a total of ' + str(len(id_array)) + ' programs.')
-                logger.info (str(shown_count) + ' shown, ' + str(long_count) + ' too long.')
-                break
-            else:
-                long_count = long_count + 1
-        
-        # If we have shown every program in the list, shuffle, clear 'shown' flags.
-        if shown_count == len(id_array):
-            self._reset_list(list_id)
-        
-        if resource_id == None:
-            # Bump 'too_long_count' for this list.
-            list_dict = self.list_table.get(list_id, None)
-            if list_dict != None:
-                too_long_count = list_dict.get('too_long_count', 0)
-                if too_long_count > long_count:
-                    # Lets shuffle/reset the list.
-                    self._reset_list(list_id)
-                else:
-                    list_dict['too_long_count'] = too_long_count + 1
-            logger.info('_get_random_program_from_list(); failed to find resource with duration < ' + str(max_duration) + '.')
-            logger.info('_get_random_program_from_list(); shown=' + str(shown_count) + ', too long=' + str(long_count) + ', total=' + str(len(id_array)) + '.')
-            
-        return resource_id
+    
+    # --------------------------------------------------------------------
+    # Saves the rotation once enough picks have gone unsaved.
+    
+    def _rotation_changed(self):
+        self.unsaved_count = self.unsaved_count + 1
+        if (self.unsaved_count >= ROTATION_SAVE_BATCH) or (time.monotonic() - self.save_time >= ROTATION_SAVE_INTERVAL):
+            self.save_rotation()
+        
+    
+    # --------------------------------------------------------------------
+    # Writes the rotation state now (if the list has somewhere to save it).
+    
+    def save_rotation(self):
+        self.unsaved_count = 0
+        self.save_time = time.monotonic()
+        if (self.state_path == None) or (self.order == None):
+            return
+        shown = [self.duration_index.is_removed(position) for position in range(len(self.order))]
+        save_rotation_state(self.state_path, self.order, shown, self.program_index, self.fingerprint)
         
     
     # --------------------------------------------------------------------
         
     def _get_next_program(self):
         resource_id = None
-        if self.program_index >= len(self.id_array):
+        if self.program_index >= len(self.order):
             # We've gone past the end of the list, re-shuffle.
             self._reset_list()
             self.program_index = 0
         
-        resource_id = self.id_array[self.program_index]
+        resource_id = self._handle_at(self.program_index)
         self.program_index = self.program_index + 1
+        self._rotation_changed()
         
         return resource_id
         
     
     # --------------------------------------------------------------------
     
-    # May return None.
+    # Returns the first program in play order not yet shown that is no
+    # longer than max_duration. May return None.
     
     def _get_next_program_with_max_duration(self, max_duration):
-        resource_id = None
-        shown_count = 0
-        long_count = 0
-        index = 0
-        for one_id in self.id_array:
-            resource = self.resource_table.get(one_id, None)
-            if resource.get('shown', True) == True:
-                # Already shown, move on to the next.
-                shown_count = shown_count + 1
-            elif self._resource_adjusted_duration(resource) > max_duration:
-                # Too long, move on to the next.
-                long_count = long_count + 1
-            else:
-                resource_id = one_id
-                resource['shown'] = True
-                break
-            
-        if resource_id == None:
-            if self.too_long_count > long_count:
-                # Lets shuffle/reset the list.
-                self._reset_list()
-            else:
-                self.too_long_count = self.too_long_count + 1
-            logger.info('_get_next_program_with_max_duration(); failed to find resource with duration < ' + str(max_duration) + '.')
-            logger.info('_get_next_program_with_max_duration(); shown=' + str(shown_count) + ', too long=' + str(long_count) + ', total=' + str(len(self.id_array)) + '.')
+        position = self.duration_index.first_at_most(max_duration)
+        if (position < 0) and (self.shortest_duration != None) and (self.shortest_duration <= max_duration):
+            # Every program short enough has been shown, shuffle/reset the list.
+            self._reset_list()
+            position = self.duration_index.first_at_most(max_duration)
         
-        return resource_id
+        if position < 0:
+            logger.info('_get_next_program_with_max_duration(); failed to find resource with duration <= ' + str(max_duration) + '.')
+            logger.info('_get_next_program_with_max_duration(); unshown=' + str(self.duration_index.remaining_count()) + ', total=' + str(len(self.order)) + '.')
+            return None
+        
+        handle = self._handle_at(position)
+        self.duration_index.remove(position)
+        if self.duration_index.remaining_count() == 0:
+            # Everything has been shown.
+            self._reset_list()
+        else:
+            self._rotation_changed()
+        return handle
+        
+    
+    # --------------------------------------------------------------------
+    # Returns the position in play order of the first program not yet shown,
+    # at or after start, that is no longer than max_duration. -1 if there is
+    # none. With candidate_program() and take_program(), lets a caller choose
+    # several programs and mark each shown only once it is actually shown.
+    
+    def next_candidate(self, max_duration, start=0):
+        return self.duration_index.first_at_most(max_duration, start)
+        
+    
+    # --------------------------------------------------------------------
+    
+    def candidate_duration(self, position):
+        return self.durations[self.order[position]]
+        
+    
+    # --------------------------------------------------------------------
+    # Returns the program at position (from next_candidate()) and the index
+    # to pass to take_program() for it, which still holds if the list is
+    # shuffled again in the meantime. Nothing is marked as shown.
+    
+    def candidate_program(self, position):
+        resource = self.catalog.record(self._handle_at(position))
+        program = program_view(resource)
+        program['duration'] = resource.adjusted_duration()
+        return program, self.order[position]
+        
+    
+    # --------------------------------------------------------------------
+    # Marks the program at index (from candidate_program()) as shown, if it
+    # is not already.
+    
+    def take_program(self, index):
+        position = self.positions[index]
+        if self.duration_index.is_removed(position):
+            return
+        self.duration_index.remove(position)
+        if self.duration_index.remaining_count() == 0:
+            # Everything has been shown.
+            self._reset_list()
+        else:
+            self._rotation_changed()
         
     
     # --------------------------------------------------------------------
@@ -181,18 +247,15 @@ class list_program_provider:
     
     def program_to_show(self, max_duration):
         if max_duration == None:
-            resource_id = self._get_next_program()
+            handle = self._get_next_program()
         else:
-            resource_id = self._get_next_program_with_max_duration(max_duration)
+            handle = self._get_next_program_with_max_duration(max_duration)
         
-        if resource_id != None:
-            resource = self.resource_table.get(resource_id, None)
-            if resource == None:
-                logger.error ('program_to_show(); missing resource with ID: ' + resource_id + '.')
-            else:
-                program = resource.copy()
-                program['duration'] = self._resource_adjusted_duration(resource)
-                return program
+        if handle != None:
+            resource = self.catalog.record(handle)
+            program = program_view(resource)
+            program['duration'] = resource.adjusted_duration()
+            return program
         
         return None
         
@@ -200,8 +263,17 @@ class list_program_provider:
     # --------------------------------------------------------------------
     
     def program_count(self):
-        if self.id_array == None:
+        if self.order == None:
             return 0
-        return len(self.id_array)
+        return len(self.order)
+        
+    
+    # --------------------------------------------------------------------
+    # Duration of the list's shortest program. program_to_show() will find a
+    # program for any max_duration at least this long (the list reshuffles if
+    # it has to). May return None if the list is empty.
+    
+    def shortest_program_duration(self):
+        return self.shortest_duration
         
     
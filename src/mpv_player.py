@@ -1,41 +1,281 @@
 #!/usr/bin/python3
+import ctypes
 import logging
 import mpv
+import threading
+import time
+from keyframe_index import *
 
 
 logger = logging.getLogger(__name__)
 
 
+# Seconds a film is given to open and show its first frame before it is
+# taken to be unplayable, from the start and when joined part way through
+# (a precise seek deep into a long film on a USB disk can take a while).
+# Defaults, see film_player. Each load logs its time to first frame, to
+# tune them by.
+LOAD_TIMEOUT = 20
+JOIN_TIMEOUT = 60
+
+# Seconds past its own limit that a pre-roll is waited on before the
+# standby player is taken to be stuck.
+PREROLL_GRACE = 5
+
+# A join opens a film on the keyframe before the position wanted, if there
+# is one this many seconds before, so no frames are decoded only to be thrown
+# away. Otherwise the player seeks precisely to the position.
+MAX_KEYFRAME_LEAD = 5
+
+# mpv overlay the cards are drawn in.
+CARD_OVERLAY_ID = 0
+
+
+# Two video players are kept, one showing the current film and one standing
+# by. While a title card is up the next film is opened, seeked and paused on
+# the standby player (pre-roll) so that at the scheduled instant show_film()
+# only has to raise and un-pause it. Cards are drawn straight from memory as
+# an overlay on the standby player, over the paused film. screen, if given,
+# is the display (mpv's screen number) the players are put on. load_timeout
+# and join_timeout are the seconds a film is given to show its first frame
+# (see LOAD_TIMEOUT, JOIN_TIMEOUT).
+
 class film_player:
-    def __init__ (self):
-        self.player_video = mpv.MPV(fullscreen = True);
-        self.player_images = mpv.MPV(fullscreen = True, keep_open=True);
+    def __init__ (self, keyframes=None, screen=None, load_timeout=LOAD_TIMEOUT, join_timeout=JOIN_TIMEOUT):
+        self.keyframes = keyframes
+        self.load_timeout = load_timeout
+        self.join_timeout = join_timeout
+        if screen == None:
+            self.players_video = [mpv.MPV(fullscreen = True, force_window = True), mpv.MPV(fullscreen = True, force_window = True)]
+        else:
+            self.players_video = [mpv.MPV(fullscreen = True, force_window = True, screen = str(screen), fs_screen = str(screen)) for index in range(2)]
+        self.active_index = 0
+        self.player_video = self.players_video[self.active_index]
+        self.film_end_callback = None
+        
+        # The pixels of the card up, mpv reads them for as long as it is shown.
+        self.card_buffer = None
+        self.card_player = None
+        for index, player in enumerate(self.players_video):
+            player.observe_property('idle-active', self._video_idle_observer(index))
+        
+        # The film (path, position) being pre-rolled on the standby player.
+        self.preroll = None
+        self.preroll_thread = None
+        self.preroll_ready = threading.Event()
+        self.preroll_error = None
     
     # --------------------------------------------------------------------
+    # Returns the mpv observer for the video player at index. Only the active
+    # player going idle counts as a film ending, not the standby being stopped.
     
-    def show_image(self, path):
-        logger.info('show_image(); path=' + path + '.')
+    def _video_idle_observer(self, index):
+        def observer(name, value):
+            if index == self.active_index:
+                self._video_idle_changed(name, value)
+        return observer
+    
+    # --------------------------------------------------------------------
+    # Called by mpv (on its event thread) when the video player goes idle,
+    # that is a film has finished or stopped.
+    
+    def _video_idle_changed(self, name, value):
+        if value and (self.film_end_callback != None):
+            self.film_end_callback()
+    
+    # --------------------------------------------------------------------
+    # callback is called, on mpv's event thread, whenever a film stops.
+    
+    def on_film_end(self, callback):
+        self.film_end_callback = callback
+    
+    # --------------------------------------------------------------------
+    
+    def _standby_player(self):
+        return self.players_video[1 - self.active_index]
+    
+    # --------------------------------------------------------------------
+    
+    # card is a rendered_card (see title_card_cache.py). It is put up on the
+    # standby player, which is raised above the active one.
+    
+    def show_card(self, card):
+        logger.info('show_card(); size=' + str(card.wide) + 'x' + str(card.tall) + '.')
         
         try:
-            self.player_images.play(path)
+            player = self._standby_player()
+            card_buffer = (ctypes.c_char * len(card.pixels)).from_buffer(card.pixels)
+            player.overlay_add(CARD_OVERLAY_ID, 0, 0, '&' + str(ctypes.addressof(card_buffer)), 0, 'bgra', card.wide, card.tall, card.wide * 4)
+            self.card_buffer = card_buffer
+            self.card_player = player
+            player.ontop = True
+            self.player_video.ontop = False
             return True
         except Exception as err: 
-            logger.error('show_image(); path=' + path + '; MPV exception: ' + str(err))
+            logger.error('show_card(); MPV exception: ' + str(err))
             return False
+    
+    
+    # --------------------------------------------------------------------
+    # Has player load path (with mpv options) and waits for the first frame.
+    # Raises TimeoutError if it is not ready within timeout seconds and
+    # RuntimeError if mpv ends the file with an error (missing, unplayable),
+    # rather than waiting on a frame that will never come.
+    
+    def _load_and_wait(self, player, path, timeout, **options):
+        ready = threading.Event()
+        errors = []
+        
+        def time_observer(name, value):
+            if value is not None:
+                ready.set()
+        
+        def end_file_handler(event):
+            if (event.event_id == mpv.MpvEventID.END_FILE) and (event.data.reason == mpv.MpvEventEndFile.ERROR):
+                errors.append(event.data.error)
+                ready.set()
+        
+        player.observe_property('time-pos', time_observer)
+        player.register_event_callback(end_file_handler)
+        try:
+            player.loadfile(path, **options)
+            if not ready.wait(timeout):
+                raise TimeoutError('no frame after ' + str(timeout) + ' seconds, path=' + path)
+            if len(errors) > 0:
+                raise RuntimeError('unable to play (error ' + str(errors[0]) + '), path=' + path)
+        except (TimeoutError, RuntimeError):
+            # Leave the player idle rather than still trying to open the film.
+            player.stop()
+            raise
+        finally:
+            player.unregister_event_callback(end_file_handler)
+            player.unobserve_property('time-pos', time_observer)
+    
+    # --------------------------------------------------------------------
+    # Opens path on player, paused, directly at position (rather than playing
+    # from the start and seeking). Returns when the first frame is ready to be
+    # shown, raises an exception if it does not come (see _load_and_wait()).
+    
+    def _load_paused(self, player, path, position):
+        started = time.monotonic()
+        player.pause = True
+        if (position is None) or (position <= 0):
+            self._load_and_wait(player, path, self.load_timeout)
+            logger.info('_load_paused(); time to first frame=' + str(round((time.monotonic() - started) * 1000)) + 'ms (limit ' +
+                    str(self.load_timeout) + 's), path=' + path + '.')
+            return
         
+        keyframe = None
+        if self.keyframes != None:
+            keyframe = self.keyframes.keyframe_at_or_before(path, position)
+            if keyframe == None:
+                # Index it for the next join.
+                self.keyframes.request(path)
+        if (keyframe != None) and (position - keyframe <= MAX_KEYFRAME_LEAD):
+            self._load_and_wait(player, path, self.join_timeout, start=str(keyframe), hr_seek='no')
+        else:
+            keyframe = None
+            self._load_and_wait(player, path, self.join_timeout, start=str(position), hr_seek='yes')
+        logger.info('_load_paused(); join time to first frame=' + str(round((time.monotonic() - started) * 1000)) + 'ms (limit ' +
+                str(self.join_timeout) + 's), position=' + str(position) + ', keyframe=' + str(keyframe) + ', path=' + path + '.')
+    
+    # --------------------------------------------------------------------
+    
+    def _run_preroll(self, player, path, position):
+        try:
+            self._load_paused(player, path, position)
+            self.preroll_ready.set()
+        except Exception as err: 
+            self.preroll_error = err
+            logger.error('_run_preroll(); path=' + path + '; MPV exception: ' + str(err))
+    
+    # --------------------------------------------------------------------
+    # Starts opening the film at path (at position seconds) on the standby
+    # player, in the background. Call while the title card for it is up.
+    
+    def preroll_film(self, path, position):
+        logger.info('preroll_film(); path=' + path + ', position=' + str(position) + '.')
+        self.preroll = None
+        if self._standby_busy():
+            logger.error('preroll_film(); standby player still loading, no pre-roll for path=' + path + '.')
+            return
+        self.preroll = (path, position)
+        self.preroll_ready.clear()
+        self.preroll_error = None
+        self.preroll_thread = threading.Thread(target=self._run_preroll, args=(self._standby_player(), path, position), daemon=True)
+        self.preroll_thread.start()
+    
+    # --------------------------------------------------------------------
+    # Seconds a pre-roll is waited on, it has finished (one way or the
+    # other) by then unless the player is stuck.
+    
+    def _preroll_wait(self):
+        return max(self.load_timeout, self.join_timeout) + PREROLL_GRACE
+    
+    # --------------------------------------------------------------------
+    # Returns True if a pre-roll is still running on the standby player after
+    # waiting _preroll_wait() seconds for it, the player must not be used.
+    
+    def _standby_busy(self):
+        if self.preroll_thread == None:
+            return False
+        self.preroll_thread.join(self._preroll_wait())
+        return self.preroll_thread.is_alive()
+    
+    # --------------------------------------------------------------------
+    # Returns True if the film at path (at position) is pre-rolled and ready.
+    # Raises the pre-roll's exception if the film failed to open, so it is
+    # not tried (and waited on) a second time.
+    
+    def _take_preroll(self, path, position):
+        preroll = self.preroll
+        self.preroll = None
+        if preroll == None:
+            return False
+        # Let the standby player settle, wanted or not, before it is used.
+        self.preroll_thread.join(self._preroll_wait())
+        if preroll != (path, position):
+            logger.info('_take_preroll(); pre-rolled film not wanted, path=' + preroll[0] + '.')
+            return False
+        if self.preroll_error != None:
+            raise self.preroll_error
+        if not self.preroll_ready.is_set():
+            logger.error('_take_preroll(); pre-roll not ready, path=' + path + '.')
+            return False
+        return True
+    
+    # --------------------------------------------------------------------
+    # Makes the standby player (holding the next film) the active one:
+    # raises it, un-pauses it and stops the old one.
+    
+    def _flip(self):
+        old_player = self.player_video
+        self.active_index = 1 - self.active_index
+        self.player_video = self.players_video[self.active_index]
+        self.player_video.ontop = True
+        if self.card_player is self.player_video:
+            self.player_video.overlay_remove(CARD_OVERLAY_ID)
+            self.card_player = None
+            self.card_buffer = None
+        self.player_video.pause = False
+        old_player.ontop = False
+        old_player.stop()
     
     # --------------------------------------------------------------------
     
     def show_film(self, path, position, screen_x, screen_y, screen_wide, screen_tall):
         logger.info('show_film(); path=' + path + ', position=' + str(position) + '.')
+        started = time.monotonic()
         
         try:
-            logger.info('show_film(); play')
-            self.player_video.play(path)
-            
-            if (position is not None) and (position > 0):
-                self.player_video.wait_until_playing()
-                self.player_video.seek(position)
+            if not self._take_preroll(path, position):
+                if self._standby_busy():
+                    logger.error('show_film(); standby player still loading, path=' + path + '.')
+                    return False
+                logger.info('show_film(); play')
+                self._load_paused(self._standby_player(), path, position)
+            self._flip()
+            logger.info('show_film(); time to first frame=' + str(round((time.monotonic() - started) * 1000)) + 'ms.')
             return True
         except Exception as err: 
             logger.error('show_film(); MPV exception: ' + str(err))
@@ -44,7 +284,7 @@ class film_player:
             else:
                 logger.error('show_film(); path=' + path + '.')
             return False
-        
+    
     
     # --------------------------------------------------------------------
     
@@ -52,6 +292,6 @@ class film_player:
         logger.info('stop_film().')
         # NOP
         return True
-    
 
-    
\ No newline at end of file
+
+
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+import logging
+import sys
+import threading
+import weakref
+from resource_record import *
+
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------------------------
+# Returns True if the two records hold the same values.
+
+def _same_resource(one, other):
+    for field in RESOURCE_FIELDS:
+        if getattr(one, field) != getattr(other, field):
+            return False
+    return one.extras == other.extras
+
+
+# --------------------------------------------------------------------
+# One channel-wide table of resources shared by every schedule file and list.
+# Each distinct resource is stored once, as a resource_record with interned
+# strings. The record is its own handle (record() returns it as it is), so
+# the same episode appearing in many weekly schedules costs one record. The
+# catalog only remembers records (weakly) while something else (a schedule's
+# offset index, a day's timeline) still holds them, it does not grow with
+# every resource ever read.
+
+class resource_catalog:
+    def __init__ (self):
+        self.records = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+
+
+    # --------------------------------------------------------------------
+
+    def _intern(self, value):
+        if isinstance(value, str):
+            return sys.intern(value)
+        return value
+
+
+    # --------------------------------------------------------------------
+    # Adds the resource (a dictionary from a schedule or list file) if an
+    # identical one is not already in the catalog. Returns its handle, which
+    # the caller holds on to for as long as it uses the resource.
+
+    def add(self, resource_id, resource):
+        record = resource_record_from_dict(self._intern(resource_id), resource)
+        key = (record.resource_id, record.path)
+
+        with self.lock:
+            existing = self.records.get(key, None)
+            if (existing != None) and _same_resource(existing, record):
+                return existing
+            record = resource_record(record.resource_id, self._intern(record.path),
+                    self._intern(record.title), self._intern(record.description),
+                    self._intern(record.series_id), record.year, record.duration,
+                    record.start_offset, record.extras)
+            # A resource changed under the same ID and path replaces the old
+            # one here, the old record lives on with whoever holds it.
+            self.records[key] = record
+        return record
+
+
+    # --------------------------------------------------------------------
+
+    def record(self, handle):
+        return handle
+
+
+    # --------------------------------------------------------------------
+    # Number of resources currently held.
+
+    def count(self):
+        return len(self.records)
+
+
@@ -0,0 +1,193 @@
+#!/usr/bin/python
+import array
+import json
+import logging
+from resource_record import *
+
+
+logger = logging.getLogger(__name__)
+
+
+NO_VALUE = 0xFFFFFFFF
+
+
+# --------------------------------------------------------------------
+# A column of optional strings kept in one UTF-8 blob with a start offset
+# and length per row, a length of NO_VALUE for None.
+
+class _string_column:
+    def __init__ (self):
+        self.blob = bytearray()
+        self.starts = array.array('I')
+        self.lengths = array.array('I')
+
+
+    def append(self, value):
+        self.starts.append(len(self.blob))
+        if value == None:
+            self.lengths.append(NO_VALUE)
+            return
+        encoded = value.encode('utf-8')
+        self.blob.extend(encoded)
+        self.lengths.append(len(encoded))
+
+
+    def get(self, row):
+        length = self.lengths[row]
+        if length == NO_VALUE:
+            return None
+        start = self.starts[row]
+        return self.blob[start:start + length].decode('utf-8')
+
+
+
+# --------------------------------------------------------------------
+# A column of optional numbers, integers until the first float is added.
+# Rows that are None are few, they are kept in a set.
+
+class _number_column:
+    def __init__ (self):
+        self.values = array.array('q')
+        self.missing = set()
+
+
+    def append(self, value):
+        if value == None:
+            self.missing.add(len(self.values))
+            value = 0
+        elif isinstance(value, float) and (self.values.typecode == 'q'):
+            self.values = array.array('d', self.values)
+        self.values.append(value)
+
+
+    def get(self, row):
+        if row in self.missing:
+            return None
+        return self.values[row]
+
+
+
+# --------------------------------------------------------------------
+# The resources of a (possibly very large) list, stored column by column
+# rather than as an object per resource: numbers in arrays, strings in one
+# blob per column. Handles are row numbers. Like a resource_catalog it
+# returns a resource_record for a handle, built only when asked for.
+
+class resource_columns:
+    def __init__ (self):
+        self.resource_ids = _string_column()
+        self.paths = _string_column()
+        self.titles = _string_column()
+        self.descriptions = _string_column()
+        self.series_ids = _string_column()
+        self.extras = _string_column()
+        self.years = _number_column()
+        self.durations = _number_column()
+        self.start_offsets = _number_column()
+
+        # Values the columns can not hold (a year given as a string, say),
+        # keyed by (handle, field).
+        self.odd_values = {}
+
+
+    # --------------------------------------------------------------------
+
+    def _append_number(self, column, handle, field, value):
+        if (value != None) and ((not isinstance(value, (int, float))) or isinstance(value, bool)):
+            self.odd_values[(handle, field)] = value
+            value = None
+        column.append(value)
+
+
+    # --------------------------------------------------------------------
+
+    def _append_string(self, column, handle, field, value):
+        if (value != None) and (not isinstance(value, str)):
+            self.odd_values[(handle, field)] = value
+            value = None
+        column.append(value)
+
+
+    # --------------------------------------------------------------------
+    # Adds the resource (a dictionary from a list file), returns its handle.
+
+    def add(self, resource_id, resource):
+        handle = len(self.durations.values)
+        self.resource_ids.append(resource_id)
+        self._append_string(self.paths, handle, 'path', resource.get('path', None))
+        self._append_string(self.titles, handle, 'title', resource.get('title', None))
+        self._append_string(self.descriptions, handle, 'description', resource.get('description', None))
+        self._append_string(self.series_ids, handle, 'series_id', resource.get('series_id', None))
+        self._append_number(self.years, handle, 'year', resource.get('year', None))
+        self._append_number(self.durations, handle, 'duration', resource.get('duration', None))
+        self._append_number(self.start_offsets, handle, 'start_offset', resource.get('start_offset', None))
+
+        extras = None
+        for key, value in resource.items():
+            if (key not in RESOURCE_FIELDS) and (key != 'shown'):
+                if extras == None:
+                    extras = {}
+                extras[key] = value
+        if extras != None:
+            extras = json.dumps(extras)
+        self.extras.append(extras)
+        return handle
+
+
+    # --------------------------------------------------------------------
+
+    def count(self):
+        return len(self.durations.values)
+
+
+    # --------------------------------------------------------------------
+
+    def resource_id(self, handle):
+        return self.resource_ids.get(handle)
+
+
+    # --------------------------------------------------------------------
+
+    def _value(self, column, handle, field):
+        value = column.get(handle)
+        if value == None:
+            value = self.odd_values.get((handle, field), None)
+        return value
+
+
+    # --------------------------------------------------------------------
+
+    def record(self, handle):
+        extras = self.extras.get(handle)
+        if extras != None:
+            extras = json.loads(extras)
+        return resource_record(self.resource_ids.get(handle),
+                self._value(self.paths, handle, 'path'),
+                self._value(self.titles, handle, 'title'),
+                self._value(self.descriptions, handle, 'description'),
+                self._value(self.series_ids, handle, 'series_id'),
+                self._value(self.years, handle, 'year'),
+                self._value(self.durations, handle, 'duration'),
+                self._value(self.start_offsets, handle, 'start_offset'),
+                extras)
+
+
+    # --------------------------------------------------------------------
+    # Returns the adjusted duration (see resource_record) of every resource,
+    # in handle order, without building any records.
+
+    def adjusted_durations(self):
+        durations = array.array('d')
+        for handle in range(self.count()):
+            if ((handle, 'duration') in self.odd_values) or ((handle, 'start_offset') in self.odd_values):
+                durations.append(self.record(handle).adjusted_duration())
+                continue
+            duration = self.durations.get(handle) or 0
+            if duration > 0:
+                duration = duration - (self.start_offsets.get(handle) or 0)
+            else:
+                logger.error('adjusted_durations(); resource with 0 duration.')
+            durations.append(duration)
+        return durations
+
+
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+RESOURCE_FIELDS = ('resource_id', 'path', 'title', 'description', 'series_id', 'year', 'duration', 'start_offset')
+PROGRAM_FIELDS = ('start_date', 'end_date', 'start_offset', 'duration', 'eobd', 'filler', 'no_program', 'series_title', 'artwork_path')
+
+_MISSING = object()
+
+
+# --------------------------------------------------------------------
+# Returns duration allowing for optional start_offset that will
+# (naturally) shorten the normal duration of the movie. Either may be None.
+
+def adjusted_duration(duration, start_offset):
+    duration = duration or 0
+    if duration > 0:
+        duration = duration - (start_offset or 0)
+    else:
+        logger.error('adjusted_duration(); resource with 0 duration.')
+    return duration
+
+
+# --------------------------------------------------------------------
+# A resource (a video file and what we know about it) as loaded from a
+# schedule or list. Records are shared by every program that refers to them
+# and can not be modified once created. A missing value is stored as None.
+# Keys a resource has beyond the fixed fields are kept in 'extras'.
+
+class resource_record:
+    __slots__ = RESOURCE_FIELDS + ('extras', '__weakref__')
+
+    def __init__ (self, resource_id, path, title, description, series_id, year, duration, start_offset, extras):
+        object.__setattr__(self, 'resource_id', resource_id)
+        object.__setattr__(self, 'path', path)
+        object.__setattr__(self, 'title', title)
+        object.__setattr__(self, 'description', description)
+        object.__setattr__(self, 'series_id', series_id)
+        object.__setattr__(self, 'year', year)
+        object.__setattr__(self, 'duration', duration)
+        object.__setattr__(self, 'start_offset', start_offset)
+        object.__setattr__(self, 'extras', extras)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError('resource_record is immutable')
+
+
+    def __delattr__(self, name):
+        raise AttributeError('resource_record is immutable')
+
+
+    # --------------------------------------------------------------------
+    # Dictionary-style access, as resources were once plain dictionaries.
+
+    def get(self, key, default=None):
+        if key in RESOURCE_FIELDS:
+            value = getattr(self, key)
+        elif self.extras != None:
+            value = self.extras.get(key, None)
+        else:
+            value = None
+        if value == None:
+            return default
+        return value
+
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+
+    # --------------------------------------------------------------------
+    # See adjusted_duration() above.
+
+    def adjusted_duration(self):
+        return adjusted_duration(self.duration, self.start_offset)
+
+
+    def __repr__(self):
+        return 'resource_record(' + repr(self.resource_id) + ', ' + repr(self.title) + ')'
+
+
+
+# --------------------------------------------------------------------
+# Returns a resource_record for a resource dictionary from a schedule or
+# list file.
+
+def resource_record_from_dict(resource_id, resource):
+    extras = None
+    for key, value in resource.items():
+        if (key not in RESOURCE_FIELDS) and (key != 'shown'):
+            if extras == None:
+                extras = {}
+            extras[key] = value
+    return resource_record(resource_id,
+            resource.get('path', None),
+            resource.get('title', None),
+            resource.get('description', None),
+            resource.get('series_id', None),
+            resource.get('year', None),
+            resource.get('duration', None),
+            resource.get('start_offset', None),
+            extras)
+
+
+
+# --------------------------------------------------------------------
+# What the providers return for a program: a lightweight view of a shared
+# (immutable) resource_record along with the values particular to this
+# showing of it - start and end dates, offset and so on. Reads fall through
+# to the resource for anything not set on the view.
+
+class program_view:
+    __slots__ = ('resource',) + PROGRAM_FIELDS
+
+    def __init__ (self, resource):
+        self.resource = resource
+
+
+    def get(self, key, default=None):
+        if key in PROGRAM_FIELDS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                return value
+        return self.resource.get(key, default)
+
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+
+    def __setitem__(self, key, value):
+        if key not in PROGRAM_FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+
+    def __repr__(self):
+        values = {'title': self.resource.get('title', None)}
+        for key in PROGRAM_FIELDS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                values[key] = value
+        return 'program_view(' + str(values) + ')'
+
+
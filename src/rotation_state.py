@@ -0,0 +1,131 @@
+#!/usr/bin/python
+import array
+import logging
+import os
+import struct
+import sys
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+
+# A list's rotation (its shuffle, which programs have been shown and where
+# sequential play is up to) saved in a small binary file next to the list
+# (list_name.uhfr) so a restart carries on rather than starting over.
+#
+#   header      '<4sHHIII': magic, version, reserved, program count,
+#               program index, fingerprint (CRC-32 of the list's resource IDs)
+#   order       program count x uint32, the shuffle as indices into the list
+#   shown       program count bits, one per position in play order
+
+MAGIC = b'UHFR'
+FORMAT_VERSION = 1
+HEADER_FORMAT = '<4sHHIII'
+
+
+# --------------------------------------------------------------------
+# Returns the path of the rotation state file for the list file at path.
+
+def rotation_state_path(path):
+    return os.path.splitext(path)[0] + '.uhfr'
+
+
+# --------------------------------------------------------------------
+# Identifies the list's contents, a saved rotation is only used for the
+# same resource IDs in the same order.
+
+def rotation_fingerprint(resource_ids):
+    return rotation_fingerprint_of_bytes(resource_id.encode('utf-8') for resource_id in resource_ids)
+
+
+# --------------------------------------------------------------------
+# As rotation_fingerprint(), for resource IDs already encoded as UTF-8.
+
+def rotation_fingerprint_of_bytes(resource_ids):
+    fingerprint = 0
+    for index, resource_id in enumerate(resource_ids):
+        if index > 0:
+            fingerprint = zlib.crc32(b'\n', fingerprint)
+        fingerprint = zlib.crc32(resource_id, fingerprint)
+    return fingerprint
+
+
+# --------------------------------------------------------------------
+
+def _pack_bits(flags):
+    bits = bytearray((len(flags) + 7) // 8)
+    for position, flag in enumerate(flags):
+        if flag:
+            bits[position >> 3] = bits[position >> 3] | (1 << (position & 7))
+    return bytes(bits)
+
+
+# --------------------------------------------------------------------
+
+def _unpack_bits(bits, count):
+    return [((bits[position >> 3] >> (position & 7)) & 1) == 1 for position in range(count)]
+
+
+# --------------------------------------------------------------------
+# Returns (order, shown, program_index), order an array, as saved for a list of count
+# programs with fingerprint. May return None if there is no saved state or
+# it does not match the list.
+
+def load_rotation_state(path, count, fingerprint):
+    try:
+        with open(path, 'rb') as state_file:
+            data = state_file.read()
+    except IOError:
+        return None
+
+    header_size = struct.calcsize(HEADER_FORMAT)
+    if len(data) < header_size:
+        logger.error('load_rotation_state(); error: truncated file: ' + path)
+        return None
+    magic, version, reserved, saved_count, program_index, saved_fingerprint = struct.unpack_from(HEADER_FORMAT, data)
+    if (magic != MAGIC) or (version != FORMAT_VERSION):
+        logger.error('load_rotation_state(); error: not a rotation state file: ' + path)
+        return None
+    if (saved_count != count) or (saved_fingerprint != fingerprint):
+        logger.info('load_rotation_state(); list has changed, ignoring: ' + path)
+        return None
+    if len(data) != header_size + (count * 4) + ((count + 7) // 8):
+        logger.error('load_rotation_state(); error: truncated file: ' + path)
+        return None
+
+    order = array.array('I')
+    order.frombytes(data[header_size:header_size + (count * 4)])
+    if sys.byteorder != 'little':
+        order.byteswap()
+    if sorted(order) != list(range(count)):
+        logger.error('load_rotation_state(); error: bad shuffle order: ' + path)
+        return None
+    shown = _unpack_bits(data[header_size + (count * 4):], count)
+    return order, shown, program_index
+
+
+# --------------------------------------------------------------------
+# Writes to a temporary file, flushed to the disk, and renames it over the
+# old state so a crash leaves one or the other. Returns False in case of
+# error.
+
+def save_rotation_state(path, order, shown, program_index, fingerprint):
+    order = array.array('I', order)
+    if sys.byteorder != 'little':
+        order.byteswap()
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as state_file:
+            state_file.write(struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, 0, len(order), program_index, fingerprint))
+            state_file.write(order.tobytes())
+            state_file.write(_pack_bits(shown))
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temp_path, path)
+    except OSError:
+        logger.error('save_rotation_state(); error: unable to write file: ' + path)
+        return False
+    return True
+
+
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+import collections
+import logging
+import os
+import threading
+from schedule_offsets import *
+
+
+logger = logging.getLogger(__name__)
+
+
+# A bounded, least-recently-used cache of schedule files keyed by path and
+# modification time, an edited file is loaded again. Safe to use from more
+# than one thread. What is cached is each file's offset index, days are read
+# from the file one at a time as they are needed (see schedule_offsets.py),
+# their resources added to the catalog passed to schedule_offsets.day().
+
+class schedule_cache:
+    def __init__ (self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+
+    # --------------------------------------------------------------------
+    # Returns the offset index (a schedule_offsets) for the schedule file at
+    # path, loading it only if it is not cached or has changed on disk.
+    # May return None in case of error.
+
+    def schedule(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            logger.error('schedule(); error: unable to stat file: ' + path)
+            return None
+
+        key = (path, mtime)
+        with self.lock:
+            schedule = self.entries.get(key, None)
+            if schedule != None:
+                self.entries.move_to_end(key)
+                return schedule
+
+        # Load outside the lock so a slow disk does not block other lookups.
+        schedule = load_schedule_offsets(path)
+        if schedule == None:
+            return None
+
+        with self.lock:
+            # Drop any stale version of the file, then the least recently used.
+            for one_key in [one_key for one_key in self.entries if one_key[0] == path]:
+                del self.entries[one_key]
+            self.entries[key] = schedule
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return schedule
+
+
+    # --------------------------------------------------------------------
+    # Returns the offset index for the schedule file at path, from the cache
+    # if it is there, otherwise loaded without adding it to the cache (or
+    # evicting anything from it). Useful for one-off passes over schedule
+    # files. May return None in case of error.
+
+    def peek(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            logger.error('peek(); error: unable to stat file: ' + path)
+            return None
+        with self.lock:
+            schedule = self.entries.get((path, mtime), None)
+        if schedule != None:
+            return schedule
+        return load_schedule_offsets(path)
+
+
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+import bisect
+import datetime
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class schedule_index:
+    def __init__ (self, schedule_descriptors):
+        self.start_ordinals = []
+        self.paths = []
+        self.day_counts = {}
+
+        # Sort the descriptors by start date so a date can be located by binary search.
+        # The sort is stable, manifests that are already in order are left as-is.
+        entries = []
+        if schedule_descriptors != None:
+            for one_descriptor in schedule_descriptors:
+                descriptor_start = one_descriptor.get('start_date', None)
+                path = one_descriptor.get('schedule_path', None)
+                if (descriptor_start == None) or (path == None):
+                    logger.error('schedule_index(); error: descriptor missing start_date or schedule_path.')
+                    continue
+                start_date = datetime.datetime.strptime (descriptor_start, '%Y-%m-%d')
+                entries.append((start_date.toordinal(), path))
+        entries.sort(key=lambda entry: entry[0])
+
+        for start_ordinal, path in entries:
+            self.start_ordinals.append(start_ordinal)
+            self.paths.append(path)
+
+
+    # --------------------------------------------------------------------
+    # Records the number of days a schedule file covers so that the file
+    # need never be loaded again just to learn its length.
+
+    def set_day_count(self, path, day_count):
+        self.day_counts[path] = day_count
+
+
+    # --------------------------------------------------------------------
+    # May return None if the day count for path is not yet known.
+
+    def day_count(self, path):
+        return self.day_counts.get(path, None)
+
+
+    # --------------------------------------------------------------------
+    # Returns a tuple (schedule_path, day_index) for the schedule covering
+    # date. May return None if no schedule covers date.
+    # Note: if the day count for the schedule is not yet known the caller
+    # must check day_index against the loaded schedule.
+
+    def locate(self, date):
+        ordinal = date.toordinal()
+        index = bisect.bisect_right(self.start_ordinals, ordinal) - 1
+        if index < 0:
+            return None
+
+        path = self.paths[index]
+        day_index = ordinal - self.start_ordinals[index]
+        day_count = self.day_counts.get(path, None)
+        if (day_count != None) and (day_index >= day_count):
+            return None
+
+        return (path, day_index)
+
+
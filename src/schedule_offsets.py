@@ -0,0 +1,203 @@
+#!/usr/bin/python
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_VERSION = 'UHF Schedule Index - v1'
+
+# JSON strings (with escapes) and the structural characters, enough to follow
+# the nesting of a schedule file without decoding any values.
+_TOKEN_PATTERN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]:,]', re.DOTALL)
+
+
+# Byte offsets of each day and each resource within a schedule file so one
+# day, and only the resources it refers to, can be read and parsed without
+# loading the whole file. The index is written next to the schedule file
+# (scheduleN.uhfi) and rebuilt when the schedule file changes.
+
+class schedule_offsets:
+    def __init__ (self, path, size, mtime_ns, day_offsets, resource_offsets):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.day_offsets = day_offsets
+        self.resource_offsets = resource_offsets
+        self.handles = {}
+        self.lock = threading.Lock()
+
+
+    # --------------------------------------------------------------------
+
+    def day_count(self):
+        return len(self.day_offsets)
+
+
+    # --------------------------------------------------------------------
+
+    def _read_value(self, schedule_file, offsets):
+        schedule_file.seek(offsets[0])
+        return json.loads(schedule_file.read(offsets[1] - offsets[0]))
+
+
+    # --------------------------------------------------------------------
+    # Returns the day's schedule (a list of slots) along with a dictionary of
+    # resource ID to handle in catalog for the resources it refers to. Only
+    # those resources are read, each just once for the life of the index.
+    # May return None in case of error.
+
+    def day(self, day_index, catalog):
+        if (day_index < 0) or (day_index >= len(self.day_offsets)):
+            logger.error('day(); error: day index out of range.')
+            return None
+        try:
+            with open(self.path, 'rb') as schedule_file:
+                day_schedule = self._read_value(schedule_file, self.day_offsets[day_index])
+                handle_table = {}
+                for one_slot in day_schedule:
+                    resource_id = one_slot.get('resource_id', None)
+                    if (resource_id == None) or (resource_id in handle_table):
+                        continue
+                    with self.lock:
+                        handle = self.handles.get(resource_id, None)
+                    if handle == None:
+                        offsets = self.resource_offsets.get(resource_id, None)
+                        if offsets == None:
+                            continue
+                        handle = catalog.add(resource_id, self._read_value(schedule_file, offsets))
+                        with self.lock:
+                            self.handles[resource_id] = handle
+                    handle_table[resource_id] = handle
+        except (IOError, ValueError):
+            logger.error('day(); error: unable to read day from file: ' + self.path)
+            return None
+        return day_schedule, handle_table
+
+
+    # --------------------------------------------------------------------
+
+    def to_dict(self):
+        return {
+            'version': INDEX_VERSION,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'days': self.day_offsets,
+            'resources': self.resource_offsets}
+
+
+
+# --------------------------------------------------------------------
+# Returns the path of the offset index for the schedule file at path.
+
+def schedule_offsets_path(path):
+    return os.path.splitext(path)[0] + '.uhfi'
+
+
+# --------------------------------------------------------------------
+# Scans the schedule file for the offsets of the values in its 'days' array
+# and 'resources' object. The file is memory-mapped and only tokenized, no
+# values are built. May return None in case of error.
+
+def build_schedule_offsets(path):
+    try:
+        stat = os.stat(path)
+        with open(path, 'rb') as schedule_file:
+            if stat.st_size == 0:
+                logger.error('build_schedule_offsets(); error: empty file: ' + path)
+                return None
+            data = mmap.mmap(schedule_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                day_offsets, resource_offsets = _scan_schedule(data)
+            finally:
+                data.close()
+    except (OSError, ValueError):
+        logger.error('build_schedule_offsets(); error: unable to index file: ' + path)
+        return None
+    return schedule_offsets(path, stat.st_size, stat.st_mtime_ns, day_offsets, resource_offsets)
+
+
+# --------------------------------------------------------------------
+
+def _scan_schedule(data):
+    day_offsets = []
+    resource_offsets = {}
+    depth = 0
+    top_key = None
+    expecting_key = False
+    last_string = None
+    value_start = None
+    for match in _TOKEN_PATTERN.finditer(data):
+        token = match.group()
+        first = token[0:1]
+        if first == b'"':
+            if depth == 1 and expecting_key:
+                top_key = json.loads(token)
+                expecting_key = False
+            last_string = token
+        elif (first == b'{') or (first == b'['):
+            depth = depth + 1
+            if depth == 1:
+                expecting_key = True
+            elif (depth == 3) and (top_key == 'resources') and (first == b'{'):
+                value_start = (json.loads(last_string), match.start())
+            elif (depth == 3) and (top_key == 'days') and (first == b'['):
+                value_start = (None, match.start())
+        elif (first == b'}') or (first == b']'):
+            if (depth == 3) and (value_start != None):
+                if top_key == 'resources':
+                    resource_offsets[value_start[0]] = [value_start[1], match.end()]
+                else:
+                    day_offsets.append([value_start[1], match.end()])
+                value_start = None
+            depth = depth - 1
+            if depth < 0:
+                raise ValueError('unbalanced schedule file')
+        elif (first == b',') and (depth == 1):
+            expecting_key = True
+    if depth != 0:
+        raise ValueError('unbalanced schedule file')
+    return day_offsets, resource_offsets
+
+
+# --------------------------------------------------------------------
+# Returns the offset index for the schedule file at path, read from its
+# .uhfi file if that is up to date, otherwise built and (if the directory is
+# writable) saved for next time. May return None in case of error.
+
+def load_schedule_offsets(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        logger.error('load_schedule_offsets(); error: unable to stat file: ' + path)
+        return None
+
+    index_path = schedule_offsets_path(path)
+    try:
+        with open(index_path, 'r') as index_data:
+            index = json.load(index_data)
+        if (index.get('version', None) == INDEX_VERSION) and (index.get('size', None) == stat.st_size) and (index.get('mtime_ns', None) == stat.st_mtime_ns):
+            return schedule_offsets(path, stat.st_size, stat.st_mtime_ns, index['days'], index['resources'])
+    except (IOError, ValueError, KeyError):
+        pass
+
+    offsets = build_schedule_offsets(path)
+    if offsets == None:
+        return None
+    # Write to a temporary file and rename so a reader never sees a partial index.
+    temp_path = index_path + '.tmp'
+    try:
+        with open(temp_path, 'w') as index_data:
+            json.dump(offsets.to_dict(), index_data)
+        os.replace(temp_path, index_path)
+    except OSError:
+        # Read-only media, the index is rebuilt each time the file is loaded.
+        logger.info('load_schedule_offsets(); unable to save index: ' + index_path)
+    return offsets
+
+
@@ -1,155 +1,227 @@
 #!/usr/bin/python
 import os
 import datetime
-import json
 import logging
 import random
+import threading
+from day_timeline import *
+from filler_sampler import *
+from gap_planner import *
+from interval_index import *
 from list_program_provider import *
+from resource_catalog import *
+from resource_record import *
+from schedule_cache import *
+from schedule_index import *
 
 
 logger = logging.getLogger(__name__)
 
 
+# Most filler programs considered when planning how to fill a gap.
+FILLER_PLAN_CANDIDATES = 32
+
+# Days kept parsed, today and tomorrow: looking ahead past midnight in the
+# evening flips between the two without reloading either.
+DAY_TIMELINE_COUNT = 2
+
+
 class schedule_program_provider:
-    def __init__ (self, channel_dir, schedule_descriptors, list_schedule, series_table, list_table, bobd_time, title_card_time, min_dead_time):
+    def __init__ (self, channel_dir, schedule_descriptors, list_schedule, series_table, list_table, bobd_time, title_card_time, min_dead_time, compiled=None, cache_size=4, catalog=None, save_rotation=False, random_seed=None):
         self.channel_dir = channel_dir
+        self.compiled = compiled
+        self.catalog = catalog
+        self.save_rotation = save_rotation
+        if self.catalog == None:
+            self.catalog = resource_catalog()
         self.schedule_descriptors = schedule_descriptors
+        self.schedule_index = schedule_index(schedule_descriptors)
         self.list_schedule = list_schedule
         self.series_table = series_table
         self.list_table = list_table
         self.list_program_providers = {}
+        self.filler_samplers = {}
+        # The filler draws have their own generator, so they can be replayed
+        # (random_seed) apart from the lists' shuffles.
+        self.filler_random = random.Random(random_seed)
+        self.planned_fillers = []
+        self.planned_fillers_before = None
         self.bobd_time = bobd_time
         self.minimum_title_card_time = title_card_time
         self.minimum_dead_time_to_fill = min_dead_time
         self.current_day = None
-        self.day_schedule = None
-        self.resource_table = None        
+        self.day_timeline = None
+        self.day_timelines = {}
+        self.list_timelines = {}
+        self.schedule_cache = schedule_cache(cache_size)
+        self.prefetch_lock = threading.Lock()
+        self.prefetch_stop = threading.Event()
+        self.prefetch_wanted = threading.Event()
+        self.prefetch_thread = None
+        self.prefetch_date = None
+        self.prefetched_date = None
+        self.prefetched_timeline = None
+        self.interval_index = None
+        self.reload_lock = threading.Lock()
+        self.pending_reload = None
         
     
     # --------------------------------------------------------------------
-    # May return None in case of error.
-    # BOGUS - not reviewed.
+    # Returns the offset index for the schedule file at path, only loading it
+    # if it is not in the schedule cache, and notes its day count in index (a
+    # schedule_index). May return None in case of error.
     
-    def _load_schedule(self, path):
-        try:
-            with open(path, 'r') as schedule_data:
-                return json.load(schedule_data)
-        except IOError:
-            logger.error('_load_schedule(); error: IOError for file: ' + path)
+    def _schedule_for_path(self, path, index):
+        schedule = self.schedule_cache.schedule(os.path.join(self.channel_dir, path))
+        if schedule == None:
+            logger.error ('_schedule_for_path(); error: unable to load schedule file.')
             return None
+        if schedule.day_count() == 0:
+            logger.error('_schedule_for_path(); error: malformed schedule missing days.')
+            return None
+        
+        # Remember how many days the schedule covers.
+        index.set_day_count(path, schedule.day_count())
+        return schedule
         
     
     # --------------------------------------------------------------------
-    # May return None in case of error.
-    # BOGUS - not reviewed.
+    # Locates the schedule covering date with the schedule index (a binary
+    # search) and reads just that day, and the resources it refers to, from
+    # the schedule file. Returns the day parsed into a timeline. May return None in case of error.
+    # Called from the prefetch thread as well, must not modify the provider.
+    # With schedules (a dictionary of path to offset index) the schedule file
+    # is looked up there, and added to it, rather than in the schedule cache.
+    
+    def _load_day_timeline(self, date, schedules=None):
+        return self._read_day_timeline(date, self.compiled, self.schedule_index, schedules)
+        
     
-    def _load_list(self, path):
-        try:
-            with open(path, 'r') as list_data:
-                return json.load(list_data)
-        except IOError:
-            logger.error('_load_list(); error: IOError for file: ' + path)
+    # --------------------------------------------------------------------
+    # As _load_day_timeline(), but reads the day from the given compiled
+    # channel (None if there is none) or with the given schedule index, so
+    # prepare_reload() can read days from what it is about to swap in.
+    
+    def _read_day_timeline(self, date, compiled, index, schedules=None):
+        if compiled != None:
+            return self._load_compiled_day_timeline(date, compiled)
+        
+        location = index.locate(date)
+        if location == None:
+            logger.error('_load_day_timeline(); error: no schedule covers date: ' + str(date.date()) + '.')
             return None
+        path, day_index = location
+        
+        if schedules == None:
+            schedule = self._schedule_for_path(path, index)
+        else:
+            schedule = schedules.get(path, None)
+            if schedule == None:
+                schedule = self.schedule_cache.peek(os.path.join(self.channel_dir, path))
+                schedules[path] = schedule
+        if schedule == None:
+            return None
+        if day_index >= schedule.day_count():
+            logger.error('_load_day_timeline(); error: no schedule covers date: ' + str(date.date()) + '.')
+            return None
+        
+        day = schedule.day(day_index, self.catalog)
+        if day == None:
+            logger.error('_load_day_timeline(); failed to get the schedule for today.')
+            return None
+        day_schedule, handle_table = day
+        
+        # Parse the day once into a timeline.
+        return day_timeline_from_schedule(day_schedule, handle_table, self.catalog)
         
     
     # --------------------------------------------------------------------
+    # Reads the day from the (memory-mapped) compiled channel, no parsing.
     # May return None in case of error.
-    # BOGUS - not reviewed.
     
-    def _day_schedule_at_index(self, schedule, day_index):
-        days_array = schedule.get('days', None)
-        if days_array == None:
-            logger.error('_day_schedule_at_index(); missing days from schedule.')
+    def _load_compiled_day_timeline(self, date, compiled):
+        slots = compiled.day_slots_for_date(date)
+        if slots == None:
+            logger.error('_load_compiled_day_timeline(); error: no schedule covers date: ' + str(date.date()) + '.')
             return None
-        if day_index >= len(days_array):
-            logger.error('_day_schedule_at_index(); day index out of range.')
-            return None        
-        return days_array[day_index]
+        start_seconds = [slot[0] for slot in slots]
+        resource_indices = [slot[1] for slot in slots]
+        return day_timeline(start_seconds, resource_indices, compiled)
         
     
     # --------------------------------------------------------------------
-    # BOGUS - not reviewed.
+    # Returns the timeline the prefetch thread loaded for date. May return
+    # None if nothing was prefetched for date.
     
-    def _fetch_day_schedule(self, date):
-        success = False
-        
-        # Iterate over the descriptors to find the one corresponding with date.
-        for one_descriptor in self.schedule_descriptors:
-            # Get start date for this descriptor.
-            descriptor_start = one_descriptor.get('start_date', None)
-            if descriptor_start == None:
-                logger.error('_fetch_day_schedule(); error: failed to get start_date.')
-                return False
-            start_date = datetime.datetime.strptime (descriptor_start, '%Y-%m-%d')
-            
-            # Open the schedule to see how many days it covers.
-            path = one_descriptor.get('schedule_path', None)
-            if path == None:
-                logger.error('_fetch_day_schedule(); error: failed to get schedule_path.')
-                return False
-            schedule = self._load_schedule(os.path.join(self.channel_dir, path))
-            if schedule == None:
-                logger.error ('_fetch_day_schedule(); error: unable to load schedule file.')
-                return False
-            
-            day_count = len(schedule['days'])
-            end_date = start_date + datetime.timedelta(days=day_count)
-            
-            # If the end date is past date, we have the schedule containing programs for date.
-            if end_date > date:
-                index = date.toordinal() - start_date.toordinal()
-                scheduled_days = schedule.get('days', None)
-                if scheduled_days == None:
-                    logger.error('_fetch_day_schedule(); error: malformed schedule missing days.')
-                    return False
-                if index >= len(scheduled_days):
-                    logger.error('_fetch_day_schedule(); error: malformed schedule day index out of range.')
-                    return False
-                
-                self.day_schedule = self._day_schedule_at_index(schedule, index)
-                if self.day_schedule == None:
-                    logger.error('_fetch_day_schedule(); failed to get the schedule for today.')
-                    return False
-                
-                # Get the resource array.
-                self.resource_table = schedule.get('resources', None)
-                success = True
+    def _take_prefetched_timeline(self, date):
+        with self.prefetch_lock:
+            if self.prefetched_date != date.date():
+                return None
+            timeline = self.prefetched_timeline
+        if timeline != None:
+            logger.info('_take_prefetched_timeline(); using prefetched schedule for: ' + str(date.date()) + '.')
+        return timeline
+        
+    
+    # --------------------------------------------------------------------
+    # Runs on the prefetch thread. Waits for _request_prefetch(), then loads
+    # (and parses) the day asked for.
+    
+    def _prefetch_worker(self):
+        while not self.prefetch_stop.is_set():
+            self.prefetch_wanted.wait()
+            self.prefetch_wanted.clear()
+            if self.prefetch_stop.is_set():
                 break
             
-        return success
+            with self.prefetch_lock:
+                date = self.prefetch_date
+                prefetched = self.prefetched_date == date
+            if (date != None) and (not prefetched):
+                logger.info('_prefetch_worker(); prefetching schedule for: ' + str(date) + '.')
+                timeline = self._load_day_timeline(datetime.datetime.combine(date, datetime.time()))
+                with self.prefetch_lock:
+                    self.prefetched_date = date
+                    self.prefetched_timeline = timeline
+        
+    
+    # --------------------------------------------------------------------
+    # Asks the prefetch thread (if it is running) to load the day of date.
+    
+    def _request_prefetch(self, date):
+        if self.prefetch_thread == None:
+            return
+        with self.prefetch_lock:
+            self.prefetch_date = date.date()
+        self.prefetch_wanted.set()
         
     
     # --------------------------------------------------------------------
     # Assigns 'current_day' to 'date', loads schedule from disk if needed.
+    # Up to DAY_TIMELINE_COUNT days are kept, the day furthest from date is
+    # let go to make room. The first time a day is taken on the day after it
+    # is prefetched, so it is ready when the evening looks past midnight.
     
     def _validate_day_schedule(self, date):
-        success = True
-        fetch_schedule = False
-        if self.current_day == None:
-            self.current_day = date
-            fetch_schedule = True
-        elif date.date() != self.current_day.date():
-            self.current_day = date
-            fetch_schedule = True
-        
-        if fetch_schedule:
-            self.day_schedule = None
-            self.resource_table = None
-            success = self._fetch_day_schedule(self.current_day)
-        return success
-        
-    
-    # --------------------------------------------------------------------
-    # Returns duration for resource allowing for optional start_offset that
-    # will (naturally) shorten the normal duration of the movie.
-    
-    def _resource_adjusted_duration(self, resource):
-        duration = resource.get('duration', 0)
-        if duration > 0:
-            duration = duration - resource.get('start_offset', 0)
+        if (self.current_day != None) and (date.date() == self.current_day.date()):
+            return self.day_timeline != None
+        
+        self.current_day = date
+        if date.date() in self.day_timelines:
+            self.day_timeline = self.day_timelines[date.date()]
         else:
-            logger.error('_resource_adjusted_duration(); resource with 0 duration.')
-        return duration
+            # Swap in the prefetched day if there is one, otherwise load it now.
+            self.day_timeline = self._take_prefetched_timeline(date)
+            if self.day_timeline == None:
+                self.day_timeline = self._load_day_timeline(date)
+            while len(self.day_timelines) >= DAY_TIMELINE_COUNT:
+                del self.day_timelines[max(self.day_timelines, key=lambda day: abs(day - date.date()))]
+            self.day_timelines[date.date()] = self.day_timeline
+            
+            tomorrow = date + datetime.timedelta(days=1)
+            if tomorrow.date() not in self.day_timelines:
+                self._request_prefetch(tomorrow)
+        return self.day_timeline != None
         
     
     # --------------------------------------------------------------------
@@ -165,34 +237,13 @@ class schedule_program_provider:
         
     
     # --------------------------------------------------------------------
-    # Returns a datetime representing when a program will end.
-    
-    def _resource_end_datetime(self, resource, start_time, date):
-        start_date = datetime.datetime.combine(date, start_time)
-        duration = self._resource_adjusted_duration(resource)
-        end_date = start_date + datetime.timedelta(seconds=duration)
-        return end_date
-        
-    
-    # --------------------------------------------------------------------
-    # Returns a datetime representing when a swcheduled program will end.
-    # May return None in case of error.
+    # Returns a program (a program_view) for a resource in the day's
+    # timeline. The resource_record itself is shared and never modified.
     
-    def _scheduled_program_end_datetime(self, scheduled_program, date):
-        resource_id = scheduled_program.get('resource_id', None)
-        if resource_id == None:
-            logger.error('_scheduled_program_end_datetime(); missing resource_id.')
-            return None
-        
-        resource = self.resource_table.get(resource_id, None)
-        if resource == None:
-            logger.error('_scheduled_program_end_datetime(); missing resource.')
-            return None            
-        
-        start_time = datetime.datetime.strptime (scheduled_program['start_time'], '%H:%M').time()
-        end_date = self._resource_end_datetime(resource, start_time, date)
-        
-        return end_date
+    def _program_for_resource(self, resource):
+        program = program_view(resource)
+        program['duration'] = resource.adjusted_duration()
+        return program
         
     
     # --------------------------------------------------------------------
@@ -211,43 +262,26 @@ class schedule_program_provider:
     # May return None if there is an error.
     
     def _scheduled_program_for_datetime(self, date):
-        # Loop over today's program schedule. If the program is scheduled *before* date,
-        # keep a pointer to it, continue to loop. When a program is found to be
-        # scheduled *after* date, break from the loop. We will be left with either a
-        # pointer to the last program to be scheduled before date, or None - indicating
-        # that the very first program in the schedule does not begin until after date.
-        
-        program_descriptor = None        
-        time = date.time()
-        for one_program_descriptor in self.day_schedule:
-            scheduled_time = datetime.datetime.strptime (one_program_descriptor['start_time'], '%H:%M').time()
-            if scheduled_time > time:
-                break
-            else:
-                program_descriptor = one_program_descriptor
-        
-        # We determine if the last program to be scheduled *before* date would still be
-        # in progress, still be being broadcast. We check against what time it will end.
-        
-        if program_descriptor == None:
+        # Find the last program to be scheduled at or before date. An index of -1
+        # indicates that the very first program in the schedule does not begin
+        # until after date.
+        index = self.day_timeline.index_at(seconds_since_midnight(date))
+        if index < 0:
             return self._no_program()
         
-        resource_id = program_descriptor.get('resource_id', None)
-        if resource_id == None:
-            logger.error('_scheduled_program_for_datetime(); missing resource_id.')
-            return None
-        
-        resource = self._get_resource_with_id(resource_id)
+        resource = self.day_timeline.resources[index]
         if resource == None:
             logger.error('_scheduled_program_for_datetime(); failed to get resource.')
             return None
         
-        start_time = datetime.datetime.strptime (program_descriptor['start_time'], '%H:%M').time()
-        start_date = datetime.datetime.combine(date, start_time)
-        end_date = self._resource_end_datetime(resource, start_time, date)
+        # We determine if the last program to be scheduled *before* date would still be
+        # in progress, still be being broadcast. We check against what time it will end.
+        midnight = datetime.datetime.combine(date, datetime.time())
+        start_date = midnight + datetime.timedelta(seconds=self.day_timeline.start_seconds[index])
+        end_date = midnight + datetime.timedelta(seconds=self.day_timeline.end_seconds[index])
         if end_date > date:
             # Program is in progress, return it.
-            program = resource.copy()
+            program = self._program_for_resource(resource)
             program['start_date'] = start_date
             program['end_date'] = end_date
         else:
@@ -261,48 +295,37 @@ class schedule_program_provider:
     
     def _next_scheduled_program_for_datetime(self, date):        
         # The 'beginning of broadcast day'.
-        bobd_date = datetime.datetime.combine(date, self.bobd_time)
-        
-        # Loop over today's program schedule. The first program scheduled to be broadcast
-        # after 'date' will be the next one. Note: it is possible that there are *no*
-        # programs scheduled to run after date, we'll return "no program".
+        bobd_seconds = seconds_since_midnight(self.bobd_time)
+        seconds = seconds_since_midnight(date)
         
+        # The first program scheduled to be broadcast after 'date' will be the next one.
+        # Note: it is possible that there are *no* programs scheduled to run after date,
+        # we'll return "no program".
         eobd = False
-        scheduled_program = None
-        for one_scheduled_program in self.day_schedule:
-            scheduled_time = datetime.datetime.strptime (one_scheduled_program['start_time'], '%H:%M').time()
-            if scheduled_time > date.time():
-                # If the next schedule program is after bobd and date is before bobd, we
-                # will indicate to the caller 'this is the end of the broadcast schedule'.
-                if (scheduled_time > bobd_date.time()) and (date.time() < bobd_date.time()):
-                    eobd = True
-                else:
-                    scheduled_program = one_scheduled_program
-                break
+        index = self.day_timeline.index_after(seconds)
+        if index < self.day_timeline.slot_count():
+            # If the next schedule program is after bobd and date is before bobd, we
+            # will indicate to the caller 'this is the end of the broadcast schedule'.
+            if (self.day_timeline.start_seconds[index] > bobd_seconds) and (seconds < bobd_seconds):
+                eobd = True
+                index = self.day_timeline.slot_count()
         
         # We have no "next" program for the date, return "no program".
-        if scheduled_program == None:
+        if index >= self.day_timeline.slot_count():
             program = self._no_program().copy()
             program['eobd'] = eobd
             return program
         
         # We do have a "next" program for the date, return it.
-        resource_id = scheduled_program['resource_id']
-        if resource_id == None:
-            logger.error('_next_scheduled_program_for_datetime(); missing resource_id.')
-            return None
-        
-        resource = self._get_resource_with_id(resource_id)
+        resource = self.day_timeline.resources[index]
         if resource == None:
             logger.error('_next_scheduled_program_for_datetime(); failed to get resource.')
             return None
         
-        program = resource.copy()
-        start_time = datetime.datetime.strptime (scheduled_program['start_time'], '%H:%M').time()
-        start_date = datetime.datetime.combine(date, start_time)
-        end_date = self._scheduled_program_end_datetime(scheduled_program, date)
-        program['start_date'] = start_date
-        program['end_date'] = end_date
+        midnight = datetime.datetime.combine(date, datetime.time())
+        program = self._program_for_resource(resource)
+        program['start_date'] = midnight + datetime.timedelta(seconds=self.day_timeline.start_seconds[index])
+        program['end_date'] = midnight + datetime.timedelta(seconds=self.day_timeline.end_seconds[index])
         program['eobd'] = eobd
         
         return program
@@ -321,35 +344,61 @@ class schedule_program_provider:
         day_index = date.isoweekday()
         if day_index == 7:
             day_index = 0;
-        if day_index >= len(self.list_schedule):
-            logger.info('_get_list_ids_for_date(); info; day_index out of range.')
-            return []
-        
-        day_schedule = self.list_schedule[day_index]
-        schedule = day_schedule.get('schedule', None)
-        if schedule == None:
-            logger.info('_get_list_ids_for_date(); info; missing schedule.')
-            return []
         
-        list_ids = []
-        for one_bracket in schedule:
-            start_time = datetime.datetime.strptime (one_bracket['start_time'], '%H:%M').time()
-            if start_time > date.time():
-                break
-            end_time = one_bracket.get('end_time', None)
-            if (end_time == None) or (datetime.datetime.strptime (end_time, '%H:%M').time() > date.time()):
-                list_ids = one_bracket.get('list_ids', [])
+        timeline = self.list_timelines.get(day_index, None)
+        if timeline == None:
+            if day_index >= len(self.list_schedule):
+                logger.info('_get_list_ids_for_date(); info; day_index out of range.')
+                return []
+            
+            schedule = self.list_schedule[day_index].get('schedule', None)
+            if schedule == None:
+                logger.info('_get_list_ids_for_date(); info; missing schedule.')
+                return []
+            
+            # Parse the day's brackets once.
+            timeline = bracket_timeline(schedule)
+            self.list_timelines[day_index] = timeline
         
+        list_ids = timeline.list_ids_at(seconds_since_midnight(date))
         if len(list_ids) == 0:
             logger.info('_get_list_ids_for_date(); info; did not find list_ids matching request.')
         
         return list_ids
         
     
+    # --------------------------------------------------------------------
+    # Where a list's rotation is saved, None if rotations are not saved.
+    # A compiled channel's lists are saved next to the compiled channel.
+    
+    def _rotation_state_path(self, list_id, list_path):
+        if not self.save_rotation:
+            return None
+        if list_path == None:
+            return os.path.splitext(self.compiled.path)[0] + '_' + list_id + '.uhfr'
+        return rotation_state_path(list_path)
+        
+    
+    # --------------------------------------------------------------------
+    # Saves the rotation of every list in use, call before exiting.
+    
+    def save_rotation_state(self):
+        for provider in self.list_program_providers.values():
+            if provider != None:
+                provider.save_rotation()
+        
+    
     # --------------------------------------------------------------------
     # BOGUS - not reviewed.
     
     def _lazily_allocate_list_provider(self, list_id):        
+        if self.compiled != None:
+            handles = self.compiled.list_resource_handles(list_id)
+            if handles == None:
+                logger.error ('_lazily_populate_list_provider(); error: missing list identifier.')
+                return None
+            return list_program_provider(None, handles, self.compiled, self._rotation_state_path(list_id, None))
+        
         list_descriptor = self.list_table.get(list_id, None)
         if list_descriptor == None:
             logger.error ('_lazily_populate_list_provider(); error: missing list identifier.')
@@ -359,7 +408,7 @@ class schedule_program_provider:
             logger.error ('_lazily_populate_list_provider(); error: missing list_path.')
             return None
         path = os.path.join(self.channel_dir, path)
-        provider = list_program_provider(path)
+        provider = list_program_provider(path, None, None, self._rotation_state_path(list_id, path))
         return provider
     
     # --------------------------------------------------------------------
@@ -374,6 +423,20 @@ class schedule_program_provider:
         return provider
         
     
+    # --------------------------------------------------------------------
+    # Returns the filler_sampler for the lists of a bracket, building it the
+    # first time the bracket is active.
+    
+    def _filler_sampler_for_list_ids(self, list_ids):
+        key = tuple(list_ids)
+        sampler = self.filler_samplers.get(key, None)
+        if sampler == None:
+            providers = [self._list_program_provider_for_id(one_id) for one_id in list_ids]
+            sampler = filler_sampler(list_ids, providers)
+            self.filler_samplers[key] = sampler
+        return sampler
+        
+    
     # --------------------------------------------------------------------
     # May return None in case of error. Will return "no program" if there is
     # nothing shorter than max_duration.
@@ -383,36 +446,17 @@ class schedule_program_provider:
         if self.list_schedule == None:
             return None
         
+        sampler = self._filler_sampler_for_list_ids(self._get_list_ids_for_date(date))
+        if sampler.total_count() == 0:
+            logger.error('_get_filler_program(); no list content, max_duration=' + str(max_duration))
+            program = self._no_program().copy()
+            return program
+        
+        # One draw, weighted by list length, over only the lists that have something short enough.
         filler_program = None
-        list_ids = list(self._get_list_ids_for_date(date))
-        
-        while filler_program == None:
-            # Get the total number of resources across the lists.
-            total_count = 0
-            for one_id in list_ids:
-                provider = self._list_program_provider_for_id(one_id)
-                if provider == None:
-                    continue
-                total_count = total_count + provider.program_count()
-            if total_count == 0:
-                logger.error('_get_filler_program(); no list content, max_duration=' + str(max_duration))
-                program = self._no_program().copy()
-                return program
-            
-            # Select a random index (in order to properly weight the lists based on length).
-            random_index = random.randint(0, total_count-1)
-            for list_index, one_id in enumerate(list_ids):
-                provider = self._list_program_provider_for_id(one_id)
-                if provider == None:
-                    continue
-                random_index = random_index - provider.program_count()
-                if random_index <= 0:
-                    filler_program = provider.program_to_show(max_duration)
-                    if filler_program == None:
-                        # No short, remove from list and try again.
-                        del list_ids[list_index]
-                    else:
-                        break
+        provider = sampler.provider_for_duration(max_duration, self.filler_random)
+        if provider != None:
+            filler_program = provider.program_to_show(max_duration)
         
         if filler_program == None:
             program = self._no_program().copy()
@@ -424,34 +468,345 @@ class schedule_program_provider:
         
     
     # --------------------------------------------------------------------
-    # May return None.
     # BOGUS - not reviewed.
     
-    def _get_resource_with_id(self, resource_id):
-        # Param check.
-        if resource_id == None:
-            logger.error('_get_resource_with_id(); param error, resource_id is None.')
-            return None
+    def _append_series_info(self, program):
+        series = self._resource_series(program)
+        if series != None:
+            program['series_title'] = series.get('title', None)
+            program['artwork_path'] = series.get('logo_path', None)        
         
-        # First try our resource table.
-        resource = self.resource_table.get(resource_id, None)
-        if resource == None:
-            logger.error('_get_resource_with_id(); missing resource_id: ' + resource_id)
+    
+    # --------------------------------------------------------------------
+    # Starts a background thread that loads the next day's schedule as soon
+    # as a day is first taken, so that neither looking past midnight nor the
+    # day change waits on the disk.
+    
+    def start_prefetching(self):
+        if self.prefetch_thread != None:
+            return
+        self.prefetch_stop.clear()
+        self.prefetch_thread = threading.Thread(target=self._prefetch_worker, daemon=True)
+        self.prefetch_thread.start()
+        if self.current_day != None:
+            self._request_prefetch(self.current_day + datetime.timedelta(days=1))
+        
+    
+    # --------------------------------------------------------------------
+    
+    def stop_prefetching(self):
+        if self.prefetch_thread == None:
+            return
+        self.prefetch_stop.set()
+        self.prefetch_wanted.set()
+        self.prefetch_thread.join()
+        self.prefetch_thread = None
+        
+    
+    # --------------------------------------------------------------------
+    # Builds the interval_index of the days the channel has a schedule for
+    # from the schedules' start dates and day counts (a schedule file's day
+    # count is read from its offset index). A day belongs to the latest
+    # schedule to start on or before it, as in _load_day_timeline(). No day
+    # is parsed and the schedule cache playback depends on is left alone.
+    
+    def _build_interval_index(self):
+        schedules = []
+        if self.compiled != None:
+            schedules = self.compiled.schedule_day_counts()
         else:
-            adjusted_duration = self._resource_adjusted_duration(resource)
-            resource['duration'] = adjusted_duration
+            for start_ordinal, path in zip(self.schedule_index.start_ordinals, self.schedule_index.paths):
+                day_count = self.schedule_index.day_count(path)
+                if day_count == None:
+                    schedule = self.schedule_cache.peek(os.path.join(self.channel_dir, path))
+                    if schedule == None:
+                        logger.error('_build_interval_index(); unable to load schedule: ' + path + '.')
+                        continue
+                    day_count = schedule.day_count()
+                    self.schedule_index.set_day_count(path, day_count)
+                schedules.append((start_ordinal, day_count))
         
-        return resource
+        index = interval_index()
+        for position, (start_ordinal, day_count) in enumerate(schedules):
+            end_ordinal = start_ordinal + day_count
+            if position + 1 < len(schedules):
+                end_ordinal = min(end_ordinal, schedules[position + 1][0])
+            index.add_days(start_ordinal, end_ordinal - start_ordinal)
+        index.finish()
+        logger.info('_build_interval_index(); indexed ' + str(index.day_count()) + ' days.')
+        return index
         
     
     # --------------------------------------------------------------------
-    # BOGUS - not reviewed.
+    # Returns a program (dictionary) for the slot at position in the
+    # timeline for day (a datetime, midnight).
     
-    def _append_series_info(self, program):
-        series = self._resource_series(program)
-        if series != None:
-            program['series_title'] = series.get('title', None)
-            program['artwork_path'] = series.get('logo_path', None)        
+    def _timeline_program(self, day, timeline, position):
+        program = self._program_for_resource(timeline.resources[position])
+        program['start_date'] = day + datetime.timedelta(seconds=timeline.start_seconds[position])
+        program['end_date'] = day + datetime.timedelta(seconds=timeline.end_seconds[position])
+        program['eobd'] = False
+        program['filler'] = False
+        self._append_series_info(program)
+        return program
+        
+    
+    # --------------------------------------------------------------------
+    # Returns a list of (day, timeline), day a datetime (midnight), for the
+    # days from first_date through last_date that have a schedule. Only
+    # those days are read, schedule files are not added to the cache.
+    
+    def _day_timelines_between(self, first_date, last_date):
+        index = self._interval_index_for_query()
+        schedules = {}
+        timelines = []
+        for date in index.covered_dates(first_date, last_date):
+            day = datetime.datetime.combine(date, datetime.time())
+            timeline = self._load_day_timeline(day, schedules)
+            if timeline != None:
+                timelines.append((day, timeline))
+        return timelines
+        
+    
+    # --------------------------------------------------------------------
+    
+    def _interval_index_for_query(self):
+        self._apply_pending_reload()
+        index = self.interval_index
+        if index == None:
+            index = self._build_interval_index()
+            self.interval_index = index
+        return index
+        
+    
+    # --------------------------------------------------------------------
+    # Returns the absolute path to the list file for list_id. May return None.
+    
+    def _list_path_for_id(self, list_table, list_id):
+        if list_table == None:
+            return None
+        list_descriptor = list_table.get(list_id, None)
+        if (list_descriptor == None) or (list_descriptor.get('list_path', None) == None):
+            return None
+        return os.path.join(self.channel_dir, list_descriptor['list_path'])
+        
+    
+    # --------------------------------------------------------------------
+    # Called on the broadcast thread before answering any request. Swaps in
+    # whatever prepare_reload() readied, which is only pointer assignment.
+    # A day taken since the reload was prepared has no replacement and is
+    # let go, to be loaded again as usual.
+    
+    def _apply_pending_reload(self):
+        with self.reload_lock:
+            update = self.pending_reload
+            self.pending_reload = None
+        if update == None:
+            return
+        
+        if update['compiled'] != None:
+            self.compiled = update['compiled']
+            self.list_program_providers = {}
+        
+        manifest = update['manifest']
+        if manifest != None:
+            self.schedule_descriptors = manifest.get('schedules', None)
+            self.schedule_index = update['schedule_index']
+            self.list_schedule = manifest.get('dotw_list_schedule', None)
+            self.series_table = manifest.get('series', None)
+            self.list_table = manifest.get('lists', None)
+            self.list_timelines = {}
+            bobd = manifest.get('beginning_of_broadcast_day', None) or '05:50'
+            self.bobd_time = datetime.datetime.strptime (bobd, '%H:%M').time()
+        
+        # Unchanged lists keep their providers (and so their shuffle state).
+        for list_id in update['dropped_list_ids']:
+            self.list_program_providers.pop(list_id, None)
+        self.list_program_providers.update(update['list_providers'])
+        self.filler_samplers = {}
+        self.planned_fillers = []
+        
+        if update['schedules_changed']:
+            self.interval_index = None
+            timelines = update['day_timelines']
+            self.day_timelines = {day: timelines[day] for day in self.day_timelines if day in timelines}
+            if (self.current_day != None) and (self.current_day.date() not in self.day_timelines):
+                self.current_day = None
+                self.day_timeline = None
+            elif self.current_day != None:
+                self.day_timeline = self.day_timelines[self.current_day.date()]
+            with self.prefetch_lock:
+                if self.prefetched_date in timelines:
+                    self.prefetched_timeline = timelines[self.prefetched_date]
+                else:
+                    self.prefetched_date = None
+                    self.prefetched_timeline = None
+        logger.info('_apply_pending_reload(); channel files reloaded.')
+        
+    
+    # --------------------------------------------------------------------
+    # Returns the absolute paths of every schedule and list file in use.
+    
+    def watched_paths(self):
+        if self.compiled != None:
+            return []
+        paths = []
+        for path in self.schedule_index.paths:
+            paths.append(os.path.join(self.channel_dir, path))
+        if self.list_table != None:
+            for list_id in self.list_table:
+                path = self._list_path_for_id(self.list_table, list_id)
+                if path != None:
+                    paths.append(path)
+        return paths
+        
+    
+    # --------------------------------------------------------------------
+    # Called (by channel_watcher) on its own thread with the paths of changed
+    # files and, if the manifest (or compiled channel) itself changed, the new
+    # manifest. Parses what changed, including new timelines for the days the
+    # provider holds, and leaves it for the broadcast thread to swap in. The
+    # program on air is never interrupted.
+    
+    def prepare_reload(self, changed_paths, manifest=None, compiled=None):
+        update = {'manifest': manifest, 'compiled': compiled, 'schedule_index': None,
+                'list_providers': {}, 'dropped_list_ids': set(), 'schedules_changed': False,
+                'day_timelines': {}}
+        
+        list_table = self.list_table
+        schedule_paths = [os.path.join(self.channel_dir, path) for path in self.schedule_index.paths]
+        if manifest != None:
+            update['schedule_index'] = schedule_index(manifest.get('schedules', None))
+            update['schedules_changed'] = True
+            list_table = manifest.get('lists', None) or {}
+            
+            # Lists that are gone or now point at a different file are dropped.
+            for list_id in list(self.list_program_providers.keys()):
+                if (compiled != None) or (self._list_path_for_id(list_table, list_id) != self._list_path_for_id(self.list_table, list_id)):
+                    update['dropped_list_ids'].add(list_id)
+        
+        for path in changed_paths:
+            if path in schedule_paths:
+                # Load the new version into the cache now, off the broadcast thread.
+                self.schedule_cache.schedule(path)
+                update['schedules_changed'] = True
+        
+        if compiled == None:
+            for list_id in list_table:
+                path = self._list_path_for_id(list_table, list_id)
+                if (path != None) and (path in changed_paths):
+                    logger.info('prepare_reload(); reloading list: ' + list_id + '.')
+                    update['list_providers'][list_id] = list_program_provider(path, None, None, self._rotation_state_path(list_id, path))
+        
+        if update['schedules_changed']:
+            update['day_timelines'] = self._reload_day_timelines(update)
+        
+        with self.reload_lock:
+            pending = self.pending_reload
+            if pending != None:
+                # Merge with a reload the broadcast thread has not yet applied.
+                if update['manifest'] == None:
+                    update['manifest'] = pending['manifest']
+                    update['schedule_index'] = pending['schedule_index']
+                if update['compiled'] == None:
+                    update['compiled'] = pending['compiled']
+                pending['list_providers'].update(update['list_providers'])
+                update['list_providers'] = pending['list_providers']
+                update['dropped_list_ids'] = (update['dropped_list_ids'] | pending['dropped_list_ids']) - set(update['list_providers'].keys())
+                if not update['schedules_changed']:
+                    update['day_timelines'] = pending['day_timelines']
+                update['schedules_changed'] = update['schedules_changed'] or pending['schedules_changed']
+            self.pending_reload = update
+        
+    
+    # --------------------------------------------------------------------
+    # Called from prepare_reload(). Returns a dictionary of date to timeline
+    # for the days the provider holds (and the day prefetched), read from the
+    # channel as it will be once update, and any reload still pending, is
+    # swapped in. Only the watcher thread replaces a pending reload, so what
+    # is read here cannot go stale before update is merged with it.
+    
+    def _reload_day_timelines(self, update):
+        compiled = update['compiled']
+        index = update['schedule_index']
+        with self.reload_lock:
+            pending = self.pending_reload
+            if pending != None:
+                if compiled == None:
+                    compiled = pending['compiled']
+                if index == None:
+                    index = pending['schedule_index']
+        if compiled == None:
+            compiled = self.compiled
+        if index == None:
+            index = self.schedule_index
+        
+        days = set(list(self.day_timelines))
+        with self.prefetch_lock:
+            if self.prefetched_date != None:
+                days.add(self.prefetched_date)
+        timelines = {}
+        for day in days:
+            timelines[day] = self._read_day_timeline(datetime.datetime.combine(day, datetime.time()), compiled, index)
+        return timelines
+        
+    
+    # --------------------------------------------------------------------
+    # Returns the scheduled program on the air at date (any date the channel
+    # has a schedule for) or "no program". Unlike program_to_show() it does
+    # not change the provider's current day and does not look for filler.
+    
+    def program_at(self, date):
+        # A program on the air may have started the day before.
+        for day, timeline in reversed(self._day_timelines_between(date.date() - datetime.timedelta(days=1), date.date())):
+            seconds = (date - day).total_seconds()
+            position = timeline.index_at(seconds)
+            while position >= 0:
+                if (timeline.resources[position] != None) and (timeline.end_seconds[position] > seconds):
+                    return self._timeline_program(day, timeline, position)
+                position = position - 1
+        return self._no_program().copy()
+        
+    
+    # --------------------------------------------------------------------
+    # Returns a list of the scheduled programs on the air at any time from
+    # start_date up to end_date, in order of start. Does not change the
+    # provider's current day.
+    
+    def programs_between(self, start_date, end_date):
+        programs = []
+        # A program on the air at start_date may have started the day before.
+        for day, timeline in self._day_timelines_between(start_date.date() - datetime.timedelta(days=1), end_date.date()):
+            for position in range(timeline.slot_count()):
+                if timeline.resources[position] == None:
+                    continue
+                if (day + datetime.timedelta(seconds=timeline.start_seconds[position]) < end_date) and (day + datetime.timedelta(seconds=timeline.end_seconds[position]) > start_date):
+                    programs.append(self._timeline_program(day, timeline, position))
+        return programs
+        
+    
+    # --------------------------------------------------------------------
+    # Returns a list of the programs scheduled to start on the day of date,
+    # in order. Does not change the provider's current day. May return None
+    # if there is no schedule for date. A caller walking several days passes
+    # the same schedules dictionary (see _load_day_timeline()) each time, so
+    # schedule files are read without filling the schedule cache.
+    
+    def scheduled_programs_for_day(self, date, schedules=None):
+        day = datetime.datetime.combine(date, datetime.time())
+        if not self._interval_index_for_query().covers(day):
+            # Not an error, a range of days may well run past the schedules.
+            logger.debug('scheduled_programs_for_day(); no schedule covers date: ' + str(day.date()) + '.')
+            return None
+        timeline = self._load_day_timeline(day, schedules)
+        if timeline == None:
+            return None
+        
+        programs = []
+        for index in range(timeline.slot_count()):
+            if timeline.resources[index] != None:
+                programs.append(self._timeline_program(day, timeline, index))
+        return programs
         
     
     # --------------------------------------------------------------------
@@ -465,6 +820,7 @@ class schedule_program_provider:
     # BOGUS - not reviewed.
     
     def program_to_show(self, date):
+        self._apply_pending_reload()
         success = self._validate_day_schedule(date)
         if success == False:
             return None
@@ -506,12 +862,22 @@ class schedule_program_provider:
             
             # See how much dead-time we have before the next show.
             if (start_date != None) and (eobd == False):
+                # Play the rest of the fillers planned for this gap, if they still fit.
+                filler_program = self._planned_filler_to_show(date, start_date)
+                if filler_program != None:
+                    return filler_program
+                
                 dead_time = (start_date - date).seconds
                 # Subtract the minimum time we want for title cards to be shown (for filler and for next broadcast).
                 dead_time = dead_time - (self.minimum_title_card_time * 2)
                 if dead_time > self.minimum_dead_time_to_fill:
-                    filler_program = self.filler_to_show(date, dead_time)
-                    if (filler_program != None) and (self.is_no_program(filler_program) == False):
+                    self.planned_fillers = self._filler_plan(date, dead_time)
+                    self.planned_fillers_before = start_date
+                    filler_program = self._planned_filler_to_show(date, start_date)
+                    if filler_program == None:
+                        # No unshown program fits, a single filler (the list may reshuffle).
+                        filler_program = self.filler_to_show(date, dead_time)
+                    if (filler_program != None) and (not self.is_no_program(filler_program)):
                         return filler_program
             
             # BOGUS: will this ever be true? Feels like only if "eobd" and that was returned earlier.
@@ -550,26 +916,24 @@ class schedule_program_provider:
     # BOGUS - not reviewed.
     
     def next_scheduled_program_to_show(self, date):
+        self._apply_pending_reload()
         success = self._validate_day_schedule(date)
         if success == False:
             return None
         
-        # Find the *next* program scheduled to be broadcast.
+        # Find the *next* program scheduled to be broadcast, a day at a time
+        # until there is one (or the end of the broadcast day).
         adjustedDate = date
-        program = None
-        eobd = False
-        while (program == None) and (eobd == False):
-            program = self._next_scheduled_program_for_datetime(date)
-            eobd = program.get('eobd', False)
-            if (self.is_no_program(program)) and (eobd == False):
-                # We're reached the end of the schedule and came up empty,
-                # advance to the next day.
-                adjustedDate = adjustedDate + datetime.timedelta(days=1)
-                adjustedDate = adjustedDate.replace(hour=0, minute=0, second=0, microsecond=0)
-                success = self._validate_day_schedule(adjustedDate)
-                if success == False:
-                    return None
-                program = self._next_scheduled_program_for_datetime(adjustedDate)
+        program = self._next_scheduled_program_for_datetime(date)
+        while (program != None) and self.is_no_program(program) and (not program.get('eobd', False)):
+            # We're reached the end of the schedule and came up empty,
+            # advance to the next day.
+            adjustedDate = adjustedDate + datetime.timedelta(days=1)
+            adjustedDate = adjustedDate.replace(hour=0, minute=0, second=0, microsecond=0)
+            success = self._validate_day_schedule(adjustedDate)
+            if success == False:
+                return None
+            program = self._next_scheduled_program_for_datetime(adjustedDate)
         
         if program == None:
             return None
@@ -583,6 +947,96 @@ class schedule_program_provider:
         return program
         
     
+    # --------------------------------------------------------------------
+    # Draws up to FILLER_PLAN_CANDIDATES programs no longer than dead_time
+    # from the bracket's lists (weighted as for a single filler, each list in
+    # its play order), then chooses the ones that best fill the gap. Returns
+    # the chosen programs, without dates, as a list of (program, list
+    # provider, index for take_program()). Nothing is marked as shown, a plan
+    # may yet be thrown away. May return an empty list.
+    
+    def _plan_fillers(self, date, dead_time):
+        if self.list_schedule == None:
+            return []
+        sampler = self._filler_sampler_for_list_ids(self._get_list_ids_for_date(date))
+        
+        candidates = []
+        next_positions = {}
+        draws = 0
+        while (len(candidates) < FILLER_PLAN_CANDIDATES) and (draws < FILLER_PLAN_CANDIDATES * 2):
+            draws = draws + 1
+            provider = sampler.provider_for_duration(dead_time, self.filler_random)
+            if provider == None:
+                break
+            start = next_positions.get(id(provider), 0)
+            if start < 0:
+                continue
+            position = provider.next_candidate(dead_time, start)
+            if position < 0:
+                # Nothing more (unshown) in this list that fits.
+                next_positions[id(provider)] = -1
+                continue
+            next_positions[id(provider)] = position + 1
+            candidates.append((provider, position, provider.candidate_duration(position)))
+        
+        # The first card is already allowed for in dead_time.
+        budget = dead_time + self.minimum_title_card_time
+        chosen = plan_gap([candidate[2] for candidate in candidates], self.minimum_title_card_time, budget)
+        
+        fillers = []
+        for index in chosen:
+            provider, position, duration = candidates[index]
+            program, program_index = provider.candidate_program(position)
+            fillers.append((program, provider, program_index))
+        return fillers
+        
+    
+    # --------------------------------------------------------------------
+    # Returns the next of the fillers planned for the gap before
+    # next_start_date, dated to begin (after its title card) at date, and
+    # marks it as shown in its list. May return None if there is none or it
+    # no longer fits.
+    
+    def _planned_filler_to_show(self, date, next_start_date):
+        if (len(self.planned_fillers) == 0) or (self.planned_fillers_before != next_start_date):
+            self.planned_fillers = []
+            return None
+        program, provider, program_index = self.planned_fillers.pop(0)
+        start_date = date + datetime.timedelta(seconds=self.minimum_title_card_time)
+        end_date = start_date + datetime.timedelta(seconds=program.get('duration', 0))
+        if end_date + datetime.timedelta(seconds=self.minimum_title_card_time) > next_start_date:
+            self.planned_fillers = []
+            return None
+        provider.take_program(program_index)
+        program['start_date'] = start_date
+        program['end_date'] = end_date
+        return program
+        
+    
+    # --------------------------------------------------------------------
+    # Returns the planned fillers (see _plan_fillers()) for dead_time (which,
+    # as for filler_to_show(), allows for one title card already), dated to
+    # play back to back, each after its own title card, from date. May return
+    # an empty list.
+    
+    def _filler_plan(self, date, dead_time):
+        self._apply_pending_reload()
+        fillers = self._plan_fillers(date, dead_time)
+        
+        start_date = date
+        for program, provider, program_index in fillers:
+            start_date = start_date + datetime.timedelta(seconds=self.minimum_title_card_time)
+            program['start_date'] = start_date
+            start_date = start_date + datetime.timedelta(seconds=program.get('duration', 0))
+            program['end_date'] = start_date
+            program['eobd'] = False
+            program['filler'] = True
+        if len(fillers) > 0:
+            logger.info('_filler_plan(); ' + str(len(fillers)) + ' fillers for ' + str(dead_time) + ' seconds, ' +
+                    str(round((date + datetime.timedelta(seconds=dead_time + self.minimum_title_card_time) - start_date).total_seconds())) + ' seconds unfilled.')
+        return fillers
+        
+    
     # --------------------------------------------------------------------
     # Caller should pass a dead_time that allows additional time to show
     # the title card as well.
@@ -590,6 +1044,7 @@ class schedule_program_provider:
     # than dead_time or in case of errors (like no lists, filler).
     
     def filler_to_show(self, date, dead_time):
+        self._apply_pending_reload()
         # Will return either a program (success) or None if error or no filler of specified length.
         program = self._get_filler_program(dead_time, date)
         if program == None:
@@ -609,4 +1064,42 @@ class schedule_program_provider:
         
         return program
         
+    
+    # --------------------------------------------------------------------
+    # Returns the programs that will follow a program ending at date, as a
+    # list of (start_date, program), for rendering their title cards ahead of
+    # time. If date falls in a gap the fillers for it are planned now (and
+    # program_to_show() at date plays them, marking each shown in its list
+    # only then), so their start dates are expected rather than exact. May
+    # return an empty list.
+    
+    def upcoming_programs(self, date):
+        self._apply_pending_reload()
+        if self._validate_day_schedule(date) == False:
+            return []
+        program = self._scheduled_program_for_datetime(date)
+        if (program == None) or (not self.is_no_program(program)):
+            # A program in progress at date is joined without a title card.
+            return []
+        next_program = self.next_scheduled_program_to_show(date)
+        if (next_program == None) or self.is_no_program(next_program):
+            return []
+        
+        start_date = next_program['start_date']
+        if (len(self.planned_fillers) == 0) or (self.planned_fillers_before != start_date):
+            self.planned_fillers = []
+            dead_time = (start_date - date).seconds - (self.minimum_title_card_time * 2)
+            if dead_time > self.minimum_dead_time_to_fill:
+                self.planned_fillers = self._filler_plan(date, dead_time)
+                self.planned_fillers_before = start_date
+        
+        upcoming = []
+        filler_date = date
+        for filler, provider, program_index in self.planned_fillers:
+            filler_date = filler_date + datetime.timedelta(seconds=self.minimum_title_card_time)
+            upcoming.append((filler_date, filler))
+            filler_date = filler_date + datetime.timedelta(seconds=filler.get('duration', 0))
+        upcoming.append((start_date, next_program))
+        return upcoming
+        
     
\ No newline at end of file
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+import datetime
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+TIMELINE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+# --------------------------------------------------------------------
+# Stands in for broadcast_timer (see broadcast_timer.py) on a virtual clock.
+# Waiting moves the clock straight to the deadline, so the broadcasts are
+# stepped through days of schedule in moments.
+
+class simulated_timer:
+    def __init__ (self, start_date):
+        self.date = start_date
+        self.reasons = set()
+        self.wait_count = 0
+
+
+    # --------------------------------------------------------------------
+
+    def now(self):
+        return self.date
+
+
+    # --------------------------------------------------------------------
+
+    def wake(self, reason):
+        self.reasons.add(reason)
+
+
+    # --------------------------------------------------------------------
+    # Returns the set of wake() reasons, the clock is not moved if there are
+    # any (as a real sleep would be cut short).
+
+    def wait(self, seconds):
+        return self.wait_until(self.date + datetime.timedelta(seconds=max(seconds, 0)))
+
+
+    # --------------------------------------------------------------------
+
+    def wait_until(self, date):
+        self.wait_count = self.wait_count + 1
+        if (len(self.reasons) == 0) and (date > self.date):
+            self.date = date
+        reasons = self.reasons
+        self.reasons = set()
+        return reasons
+
+
+# --------------------------------------------------------------------
+# What a simulated_card_cache hands out in place of a rendered card: what
+# the card says, not its pixels. title is None for a black card.
+
+class simulated_card:
+    def __init__ (self, wide, tall, title, start_time):
+        self.wide = wide
+        self.tall = tall
+        self.title = title
+        self.start_time = start_time
+
+
+# --------------------------------------------------------------------
+# Stands in for title_card_cache (see title_card_cache.py), nothing is
+# rendered.
+
+class simulated_card_cache:
+    def __init__ (self):
+        self.prerender_count = 0
+
+
+    # --------------------------------------------------------------------
+
+    def title_card(self, wide, tall, title, body, start_time, series_title, artwork_path):
+        return simulated_card(wide, tall, title, start_time)
+
+
+    # --------------------------------------------------------------------
+
+    def prerender_title_card(self, wide, tall, title, body, start_time, series_title, artwork_path):
+        self.prerender_count = self.prerender_count + 1
+
+
+    # --------------------------------------------------------------------
+
+    def black_background(self, wide, tall):
+        return simulated_card(wide, tall, None, None)
+
+
+# --------------------------------------------------------------------
+# Stands in for film_player (see mpv_player.py) without a display. Writes
+# what would have aired, and when by the timer's clock, to timeline (an open
+# text file), a line each:
+#     2022-09-27 06:00:00  card     <title> (<start time>)
+#     2022-09-27 06:00:30  film     <path> @<position>
+# 'missing' in place of 'film' for a film that does not exist (and so would
+# have failed to play), 'stop' when a film is stopped, 'black' for a cleared
+# card. Unless check_films, every film is taken to be there.
+
+class headless_player:
+    def __init__ (self, timer, timeline, check_films=True):
+        self.timer = timer
+        self.timeline = timeline
+        self.check_films = check_films
+        self.film_end_callback = None
+        self.film_exists = {}
+        self.card_count = 0
+        self.film_count = 0
+        self.missing_count = 0
+
+
+    # --------------------------------------------------------------------
+
+    def _record(self, kind, detail):
+        self.timeline.write(self.timer.now().strftime(TIMELINE_DATE_FORMAT) + '  ' + kind.ljust(7) + '  ' + detail + '\n')
+
+
+    # --------------------------------------------------------------------
+    # Films here never end on their own, the broadcasts' deadlines end them.
+
+    def on_film_end(self, callback):
+        self.film_end_callback = callback
+
+
+    # --------------------------------------------------------------------
+
+    def show_card(self, card):
+        if card.title == None:
+            self._record('black', '')
+        else:
+            self.card_count = self.card_count + 1
+            self._record('card', card.title + ' (' + str(card.start_time) + ')')
+        return True
+
+
+    # --------------------------------------------------------------------
+
+    def preroll_film(self, path, position):
+        pass
+
+
+    # --------------------------------------------------------------------
+    # Returns False, as the player would, if the film is missing.
+
+    def show_film(self, path, position, screen_x, screen_y, screen_wide, screen_tall):
+        exists = self.film_exists.get(path, None)
+        if not self.check_films:
+            exists = True
+        elif exists == None:
+            exists = os.path.exists(path)
+            self.film_exists[path] = exists
+        if not exists:
+            self.missing_count = self.missing_count + 1
+            self._record('missing', path + ' @' + str(position))
+            return False
+        self.film_count = self.film_count + 1
+        self._record('film', path + ' @' + str(position))
+        return True
+
+
+    # --------------------------------------------------------------------
+
+    def stop_film(self):
+        self._record('stop', '')
+        return True
+
+
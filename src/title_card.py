@@ -1,7 +1,11 @@
 #!/usr/bin/python
+import bisect
+import collections
 import logging
 import math
 import os
+import threading
+from artwork_cache import *
 from PIL import Image, ImageDraw, ImageFont
 
 
@@ -9,38 +13,128 @@ CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
 FONT_DIR = os.path.join(CURRENT_DIR, 'fonts')
 
 
+# Words are kept with their advance (width, including the space after) per
+# font, to guess where each line will break.
+MAX_CACHED_ADVANCES = 20000
+
+# Fonts (a face at a pixel size) kept loaded, three per card resolution.
+MAX_CACHED_FONTS = 12
+
+TITLE_FONT_FACE = 'OpenSans-SemiBold.ttf'
+BODY_FONT_FACE = 'OpenSans-Regular.ttf'
+SERIES_FONT_FACE = 'OpenSans-ExtraBold.ttf'
+
+
 logger = logging.getLogger(__name__)
-title_font = None
-body_font = None
-series_font = None
+fonts = collections.OrderedDict()
+fonts_lock = threading.Lock()
+word_advances = {}
+artwork_images = None
+
+
+# Has cards take their artwork from cache (an artwork_cache) rather than
+# scaling the original file each time.
+
+def use_artwork_cache(cache):
+    global artwork_images
+    artwork_images = cache
+
+
+# Returns the font file face (in FONT_DIR) at pixel size, loading it only
+# if it is not among those recently used.
+
+def _font(face, size):
+    key = (face, size)
+    with fonts_lock:
+        font = fonts.get(key, None)
+        if font != None:
+            fonts.move_to_end(key)
+            return font
+    font = ImageFont.truetype(os.path.join(FONT_DIR, face), size)
+    with fonts_lock:
+        fonts[key] = font
+        while len(fonts) > MAX_CACHED_FONTS:
+            fonts.popitem(last=False)
+    return font
+
+
+def _word_advances(font):
+    key = (font.path, font.size)
+    advances = word_advances.get(key, None)
+    if (advances == None) or (len(advances) > MAX_CACHED_ADVANCES):
+        advances = {}
+        word_advances[key] = advances
+    return advances
 
 
+def _text_size(text, font, draw):
+    bbox = draw.textbbox((0, 0), text, font=font)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+
+# Breaks text into lines no wider than max_width, as if adding a word at a
+# time and measuring the line with textbbox. The break is guessed from the
+# words' advances and then confirmed by measuring the line either side of
+# it, so a line costs a couple of measurements rather than one per word.
+# Like the word at a time version, the width and height totalled are those
+# of each line with the word that did not fit.
+
 def _text_wrap(text, font, draw, max_width, max_height):
     lines = []
     words = text.split()
     total_width = 0
     total_height = 0
     
-    # Wrap text by measuring width using textbbox.
-    current_line = ""
+    advances = _word_advances(font)
+    cumulative_advances = [0]
     for word in words:
-        test_line = current_line + word + " "
-        bbox = draw.textbbox((0, 0), test_line, font=font)
-        width = bbox[2] - bbox[0]
-        height = bbox[3] - bbox[1]
-        if width <= max_width:
-            current_line = test_line
+        advance = advances.get(word, None)
+        if advance == None:
+            advance = font.getlength(word + " ")
+            advances[word] = advance
+        cumulative_advances.append(cumulative_advances[-1] + advance)
+    
+    # The line is words[line_start:next_word], next_word the first to try adding.
+    line_start = 0
+    next_word = 0
+    width = 0
+    height = 0
+    while next_word < len(words):
+        sizes = {}
+        def fits(index):
+            if index not in sizes:
+                sizes[index] = _text_size(" ".join(words[line_start:index + 1]) + " ", font, draw)
+            return sizes[index][0] <= max_width
+        
+        # Index of the first word that does not fit (len(words) if they all do).
+        index = bisect.bisect_right(cumulative_advances, cumulative_advances[line_start] + max_width) - 1
+        index = min(max(index, next_word), len(words))
+        if (index < len(words)) and fits(index):
+            index = index + 1
+            while (index < len(words)) and fits(index):
+                index = index + 1
+        else:
+            while (index > next_word) and (not fits(index - 1)):
+                index = index - 1
+        
+        if index == len(words):
+            width, height = sizes[index - 1]
+            break
+        width, height = sizes[index]
+        if width > total_width:
+            total_width = width
+        total_height = total_height + height
+        if index > line_start:
+            lines.append(" ".join(words[line_start:index]) + " ")
         else:
-            if width > total_width:
-                total_width = width
-            total_height = total_height + height
-            lines.append(current_line)
-            current_line = word + " "
-    if current_line:
+            lines.append("")
+        line_start = index
+        next_word = index + 1
+    if line_start < len(words):
         if width > total_width:
             total_width = width
         total_height = total_height + height
-        lines.append(current_line)        
+        lines.append(" ".join(words[line_start:]) + " ")
     return lines, total_width, total_height
 
 
@@ -48,42 +142,68 @@ def _display_lines_of_text(x, y, line_spacing, lines, font, draw, fill):
     y_text = y
     for line in lines:
         draw.text((x, y_text), line, font=font, fill=fill)
-        bbox = draw.textbbox((0, 0), line, font=font)
         y_text += line_spacing
     
 
+def black_background_image(wide, tall):
+    return Image.new(mode="RGB", size=(wide, tall), color='black')
+    
+
 def set_black_background(wide, tall, image_url, fullscreen):
-    image = Image.new(mode="RGB", size=(wide, tall), color='black')
+    image = black_background_image(wide, tall)
     image.save(image_url)
     return image_url
     
 
 def set_title_card(wide, tall, image_url, title, body, start_time, series_title, thumbnail_url, fullscreen):
-    global title_font
-    global body_font
-    global series_font
+    image = title_card_image(wide, tall, title, body, start_time, series_title, thumbnail_url)
+    image.save(image_url)
+    return image_url
+    
+
+# Returns the card's (leading, trailing) padding, wider on the left to
+# leave room for a thumbnail.
+
+def _side_padding(wide, thumbnail_url):
+    if thumbnail_url == None:
+        return math.ceil(wide / 6), math.ceil(wide / 6)
+    return math.ceil(wide / 2.7), math.ceil(wide / 16)
+    
+
+# Draws the start time at the foot of a card made by title_card_image()
+# with start_time None. Everything else on the card is the same whatever
+# the time, so a card can be rendered once and shown at any time.
+
+def draw_title_card_time(image, start_time, thumbnail_url):
+    wide, tall = image.size
+    body_text_height = math.ceil(tall / 20)
+    body_font = _font(BODY_FONT_FACE, body_text_height)
+    leading_padding, trailing_padding = _side_padding(wide, thumbnail_url)
+    max_width = wide - leading_padding - trailing_padding
+    bottom_padding = math.ceil(tall / 12)
+    max_height = tall - math.ceil(tall / 12) - bottom_padding
     
-    # Set up fonts.
+    image_draw = ImageDraw.Draw(image)
+    time_text, time_width, time_height = _text_wrap(start_time, body_font, image_draw, max_width, max_height)
+    _display_lines_of_text(leading_padding, tall - bottom_padding - time_height, body_text_height + 6, time_text, body_font, image_draw, 'white')
+    
+
+# Returns the title card as an (RGB) image, see set_title_card(). With
+# start_time None the time is left off, see draw_title_card_time().
+
+def title_card_image(wide, tall, title, body, start_time, series_title, thumbnail_url):
+    # Set up fonts, sized for the card.
     title_text_height = math.ceil(tall / 16)        
-    if title_font == None:
-        title_font = ImageFont.truetype(os.path.join(FONT_DIR, 'OpenSans-SemiBold.ttf'), title_text_height)
+    title_font = _font(TITLE_FONT_FACE, title_text_height)
     
     body_text_height = math.ceil(tall / 20)
-    if body_font == None:
-        body_font = ImageFont.truetype(os.path.join(FONT_DIR, 'OpenSans-Regular.ttf'), body_text_height)
+    body_font = _font(BODY_FONT_FACE, body_text_height)
     
     series_text_height = math.ceil(tall / 20)        
-    if series_font == None:
-        series_font = ImageFont.truetype(os.path.join(FONT_DIR, 'OpenSans-ExtraBold.ttf'), series_text_height)
+    series_font = _font(SERIES_FONT_FACE, series_text_height)
     
     # Calculate padding.
-    if thumbnail_url == None:
-        leading_padding = math.ceil(wide / 6)
-        trailing_padding = math.ceil(wide / 6)
-    else:
-        leading_padding = math.ceil(wide / 2.7)
-        trailing_padding = math.ceil(wide / 16)
-    
+    leading_padding, trailing_padding = _side_padding(wide, thumbnail_url)
     max_width = wide - leading_padding - trailing_padding
     
     top_padding = math.ceil(tall / 12)
@@ -100,7 +220,6 @@ def set_title_card(wide, tall, image_url, title, body, start_time, series_title,
         series_text, series_width, series_height = _text_wrap(series_title, series_font, image_draw, max_width, max_height)
     title_text, title_width, title_height = _text_wrap(title, title_font, image_draw, max_width, max_height)
     body_text, body_width, body_height = _text_wrap(body, body_font, image_draw, max_width, max_height)
-    time_text, time_width, time_height = _text_wrap(start_time, body_font, image_draw, max_width, max_height)
 
     # Draw text.
     if series_title != None:
@@ -118,22 +237,21 @@ def set_title_card(wide, tall, image_url, title, body, start_time, series_title,
     text_y = text_y + title_height + title_body_padding
     _display_lines_of_text(leading_padding, text_y, body_text_height + 6, body_text, body_font, image_draw, 'white')
     
-    text_y = top_padding + max_height - time_height
-    _display_lines_of_text(leading_padding, text_y, body_text_height + 6, time_text, body_font, image_draw, 'white')
+    # The time sits at the foot of the card whatever the banner.
+    if start_time != None:
+        draw_title_card_time(image, start_time, thumbnail_url)
     
     if thumbnail_url != None:
-        try:
-            thumbnail = Image.open(thumbnail_url)
-            max_thumbnail_size = (wide / 4, wide / 4)
-            thumbnail.thumbnail(max_thumbnail_size)
+        max_thumbnail_size = (wide / 4, wide / 4)
+        if artwork_images != None:
+            thumbnail = artwork_images.artwork(thumbnail_url, max_thumbnail_size)
+        else:
+            thumbnail = load_artwork(thumbnail_url, max_thumbnail_size)
+        if thumbnail != None:
             offset = (math.ceil(wide / 16), math.ceil(tall / 8))
             image.paste(thumbnail, offset)
-        except IOError:
-            logger.error('set_title_card(); error: IOError for file: ' + thumbnail_url)
     
-    # Save image.
-    image.save(image_url)
-    return image_url
+    return image
     
 
 if __name__ == '__main__':
@@ -0,0 +1,307 @@
+#!/usr/bin/python
+import collections
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from PIL import Image
+from title_card import *
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when title_card.py changes how cards look, so old renders are not used.
+CARD_STYLE_VERSION = 2
+
+# Cards kept in memory, with their start times drawn on and ready to show:
+# the one up and the ones coming next.
+MEMORY_CARD_COUNT = 4
+
+CARD_FILE_EXTENSION = '.png'
+
+
+# --------------------------------------------------------------------
+# A rendered card: wide x tall pixels, 4 bytes each (blue, green, red,
+# alpha), the layout the player's overlays take.
+
+class rendered_card:
+    def __init__ (self, wide, tall, pixels):
+        self.wide = wide
+        self.tall = tall
+        self.pixels = pixels
+
+
+# --------------------------------------------------------------------
+
+def rendered_card_from_image(image):
+    wide, tall = image.size
+    return rendered_card(wide, tall, bytearray(image.convert('RGBA').tobytes('raw', 'BGRA')))
+
+
+# --------------------------------------------------------------------
+# Rendered title cards, stored on disk without their start time and named
+# for a hash of everything else that goes into the card, so a card is
+# rendered once however often (and whenever) it is shown (cache_dir/
+# <hash>.png, a card being mostly black compresses to a small fraction of
+# its pixels, sparing the SD card). Cards for programs coming up are made
+# ahead of time on a worker thread (prerender_title_card()): read back or
+# rendered, the start time drawn on (see draw_title_card_time() in
+# title_card.py) and kept in memory as a rendered_card, ready to hand
+# out. title_card() makes the card on the spot only if it was not
+# foreseen. The least recently shown cards are removed from disk once the
+# cache grows past max_bytes, the cards on disk and their sizes are kept
+# track of here rather than listed each time.
+
+class title_card_cache:
+    def __init__ (self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.cards = collections.OrderedDict()
+        self.disk_cards = collections.OrderedDict()
+        self.disk_bytes = 0
+        self.black_cards = {}
+        self.render_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.requested = set()
+        self.thread = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError:
+            logger.error('title_card_cache(); error: unable to create directory: ' + cache_dir)
+        self._scan()
+
+
+    # --------------------------------------------------------------------
+    # Finds the cards already on disk, the oldest written taken as the least
+    # recently shown. Cards stored as raw pixels (by earlier versions) are
+    # removed.
+
+    def _scan(self):
+        cards = []
+        try:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(CARD_FILE_EXTENSION):
+                    stat = entry.stat()
+                    cards.append((stat.st_mtime, entry.name[:-len(CARD_FILE_EXTENSION)], stat.st_size))
+                elif entry.name.endswith('.bgra'):
+                    os.remove(entry.path)
+        except OSError:
+            logger.error('_scan(); error: unable to read directory: ' + self.cache_dir)
+        cards.sort()
+        for mtime, key, size in cards:
+            self.disk_cards[key] = size
+            self.disk_bytes = self.disk_bytes + size
+
+
+    # --------------------------------------------------------------------
+    # Returns the artwork's (path, size, mtime_ns) so a changed image makes
+    # a new card.
+
+    def _artwork_signature(self, artwork_path):
+        if (artwork_path == None) or (artwork_path == ''):
+            return artwork_path
+        try:
+            stat = os.stat(artwork_path)
+        except OSError:
+            return [artwork_path, None, None]
+        return [artwork_path, stat.st_size, stat.st_mtime_ns]
+
+
+    # --------------------------------------------------------------------
+
+    def _card_key(self, wide, tall, title, body, series_title, artwork_path):
+        key_fields = [CARD_STYLE_VERSION, wide, tall, title, body, series_title, self._artwork_signature(artwork_path)]
+        return hashlib.sha1(json.dumps(key_fields).encode('utf-8')).hexdigest()
+
+
+    # --------------------------------------------------------------------
+
+    def _card_path(self, key):
+        return os.path.join(self.cache_dir, key + CARD_FILE_EXTENSION)
+
+
+    # --------------------------------------------------------------------
+
+    def _remember(self, card_key, card):
+        with self.lock:
+            self.cards[card_key] = card
+            self.cards.move_to_end(card_key)
+            while len(self.cards) > MEMORY_CARD_COUNT:
+                self.cards.popitem(last=False)
+
+
+    # --------------------------------------------------------------------
+    # Returns the card's image (without its start time) from disk, marking
+    # it recently used (here, the file is left alone). May return None if it
+    # has not been rendered.
+
+    def _stored_card(self, key, wide, tall):
+        with self.lock:
+            if key in self.disk_cards:
+                self.disk_cards.move_to_end(key)
+
+        path = self._card_path(key)
+        try:
+            with Image.open(path) as card_file:
+                image = card_file.convert('RGB')
+        except (IOError, ValueError):
+            return None
+        if image.size != (wide, tall):
+            logger.error('_stored_card(); error: card is the wrong size: ' + path)
+            return None
+        return image
+
+
+    # --------------------------------------------------------------------
+    # Writes to a temporary file and renames it into place, so a partly
+    # written card is never read.
+
+    def _save(self, key, image):
+        path = self._card_path(key)
+        temp_path = path + '.tmp'
+        try:
+            image.save(temp_path, 'PNG')
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except OSError:
+            logger.error('_save(); error: unable to write card: ' + path)
+            return
+        with self.lock:
+            self.disk_bytes = self.disk_bytes - self.disk_cards.pop(key, 0) + size
+            self.disk_cards[key] = size
+        self._evict()
+
+
+    # --------------------------------------------------------------------
+    # Makes the card keyed card_key (the card's key and start time): its
+    # image is read back from disk or rendered (and saved), then the start
+    # time is drawn on. Returns the rendered_card, also kept in memory.
+
+    def _render(self, card_key, arguments):
+        key, start_time = card_key
+        with self.render_lock:
+            with self.lock:
+                card = self.cards.get(card_key, None)
+            if card != None:
+                return card
+            image = None
+            if os.path.exists(self._card_path(key)):
+                image = self._stored_card(key, arguments[0], arguments[1])
+            if image == None:
+                wide, tall, title, body, series_title, artwork_path = arguments
+                image = title_card_image(wide, tall, title, body, None, series_title, artwork_path)
+                self._save(key, image)
+            card = self._with_time(image, start_time, arguments[5])
+            self._remember(card_key, card)
+        return card
+
+
+    # --------------------------------------------------------------------
+    # Removes the least recently shown cards until the cache fits max_bytes.
+
+    def _evict(self):
+        while True:
+            with self.lock:
+                if (self.disk_bytes <= self.max_bytes) or (len(self.disk_cards) <= 1):
+                    return
+                key, size = self.disk_cards.popitem(last=False)
+                self.disk_bytes = self.disk_bytes - size
+            try:
+                os.remove(self._card_path(key))
+            except OSError:
+                logger.error('_evict(); error: unable to remove card: ' + self._card_path(key))
+
+
+    # --------------------------------------------------------------------
+    # Returns the rendered_card, making it now if it was not made ahead of
+    # time.
+
+    def _card(self, arguments, card_key):
+        with self.lock:
+            card = self.cards.get(card_key, None)
+            if card != None:
+                self.cards.move_to_end(card_key)
+            if card_key[0] in self.disk_cards:
+                self.disk_cards.move_to_end(card_key[0])
+        if card != None:
+            return card
+        logger.info('_card(); card not rendered ahead of time, rendering now.')
+        return self._render(card_key, arguments)
+
+
+    # --------------------------------------------------------------------
+    # Queues the card for the worker thread to make.
+
+    def _prerender(self, arguments, card_key):
+        with self.lock:
+            if (card_key in self.cards) or (card_key in self.requested):
+                return
+            self.requested.add(card_key)
+            if (self.thread == None) or (not self.thread.is_alive()):
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.requests.put((arguments, card_key))
+
+
+    # --------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            arguments, card_key = self.requests.get()
+            try:
+                self._render(card_key, arguments)
+            except Exception as err:
+                logger.error('_run(); exception rendering card: ' + str(err))
+            with self.lock:
+                self.requested.discard(card_key)
+
+
+    # --------------------------------------------------------------------
+    # Returns a rendered_card of the card's image with start_time drawn on
+    # (onto image itself, already saved without it).
+
+    def _with_time(self, image, start_time, artwork_path):
+        if (start_time != None) and (start_time != ''):
+            draw_title_card_time(image, start_time, artwork_path)
+        return rendered_card_from_image(image)
+
+
+    # --------------------------------------------------------------------
+    # Returns the card's key in memory: the key of its image on disk and the
+    # start time drawn on it.
+
+    def _time_card_key(self, arguments, start_time):
+        return (self._card_key(*arguments), start_time or '')
+
+
+    # --------------------------------------------------------------------
+    # Returns a rendered_card, see title_card_image() in title_card.py.
+
+    def title_card(self, wide, tall, title, body, start_time, series_title, artwork_path):
+        arguments = (wide, tall, title, body, series_title, artwork_path)
+        return self._card(arguments, self._time_card_key(arguments, start_time))
+
+
+    # --------------------------------------------------------------------
+
+    def prerender_title_card(self, wide, tall, title, body, start_time, series_title, artwork_path):
+        arguments = (wide, tall, title, body, series_title, artwork_path)
+        self._prerender(arguments, self._time_card_key(arguments, start_time))
+
+
+    # --------------------------------------------------------------------
+
+    # Returns a black rendered_card, made once per size and never stored.
+
+    def black_background(self, wide, tall):
+        card = self.black_cards.get((wide, tall), None)
+        if card == None:
+            card = rendered_card(wide, tall, bytearray(b'\x00\x00\x00\xff') * (wide * tall))
+            self.black_cards[(wide, tall)] = card
+        return card
+
+
@@ -3,11 +3,19 @@ import datetime
 import json
 import logging
 import logging.handlers
-from mpv_player import *
+import queue
+import random
+import sys
+import threading
+import time
+from broadcast_timer import *
+from channel_watcher import *
+from compiled_channel import *
+from keyframe_index import *
 from list_program_provider import *
 from schedule_program_provider import *
-from time import sleep
-from title_card import *
+from simulation import *
+from title_card_cache import *
 from typing import Dict, List, Union
 
 
@@ -45,6 +53,25 @@ END_BROADCAST_STATE = 3
 MINIMUM_TITLE_CARD_DURATION = 30
 MINIMUM_DEAD_TIME_TO_FILL = 210
 
+SCHEDULE_CACHE_SIZE = 4
+CHANNEL_POLL_INTERVAL = 30
+RETRY_INTERVAL = 1
+KEYFRAME_CACHE_FILE_NAME = 'keyframes.uhfk'
+# Seconds a film may take to show its first frame before it is given up on
+# (technical difficulties), from the start and joined part way through.
+# The player logs each load's time to first frame.
+FILM_LOAD_TIMEOUT = 20
+FILM_JOIN_TIMEOUT = 60
+TITLE_CARD_CACHE_DIR = 'title_cards'
+# Cards are stored as PNGs, 20-200KB each at 1080p: room for several hundred.
+TITLE_CARD_CACHE_SIZE = 64 * 1024 * 1024
+ARTWORK_CACHE_DIR = 'artwork'
+SIMULATION_DAYS = 7
+SIMULATION_SEED = 0
+# False to simulate as though every film were there (a copy of a channel's
+# files without its media).
+SIMULATION_CHECK_FILMS = True
+
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
 # CHANNEL_FILE_PATH = os.path.join('/media/pi/UHF/_schedules/manifest.json')
 CHANNEL_FILE_PATH = os.path.join('/media/calhoun/UHF/_schedules/manifest.json')
@@ -58,6 +85,9 @@ screen_wide = SCREEN_WIDE
 screen_tall = SCREEN_TALL
 channel_dir = None
 channel_manifest = None
+channel_compiled = None
+card_cache = None
+artwork_images = None
 
 
 # --------------------------------------------------------------------
@@ -82,27 +112,84 @@ def resource_adjusted_duration(resource):
     
 
 # --------------------------------------------------------------------
+# One channel on one output: the channel's directory, the screen it is
+# shown on (screen_index, None for the default) and the player showing it,
+# a film_player unless another (a headless_player) is given.
+
+class channel_output:
+    def __init__ (self, channel_dir, screen_index, screen_x, screen_y, screen_wide, screen_tall, player=None):
+        self.channel_dir = channel_dir
+        self.screen_index = screen_index
+        self.screen_x = screen_x
+        self.screen_y = screen_y
+        self.screen_wide = screen_wide
+        self.screen_tall = screen_tall
+        self.player = player
+        if self.player == None:
+            # Only a channel on air needs mpv (simulate runs without it).
+            from mpv_player import film_player
+            self.player = film_player(keyframe_cache(os.path.join(channel_dir, KEYFRAME_CACHE_FILE_NAME)), screen_index,
+                    FILM_LOAD_TIMEOUT, FILM_JOIN_TIMEOUT)
+    
 
-def show_title_card(player, title, description, time_string, series_title, artwork_path):
-    global screen_wide
-    global screen_tall
-    card_url = set_title_card(screen_wide, screen_tall, "TITLE_CARD.bmp", title,
-            description, time_string, series_title, artwork_path, DEBUG is False)
-    player.show_image(card_url)
+# --------------------------------------------------------------------
+
+def show_title_card(output, title, description, time_string, series_title, artwork_path):
+    global card_cache
+    card = card_cache.title_card(output.screen_wide, output.screen_tall, title, description, time_string, series_title, artwork_path)
+    output.player.show_card(card)
     
 
 # --------------------------------------------------------------------
 
-def clear_title_card(player):
-    global screen_wide
-    global screen_tall
-    card_url = set_black_background(screen_wide, screen_tall, 'BLACK_SCREEN.bmp', DEBUG is False)
-    player.show_image(card_url)
+def clear_title_card(output):
+    global card_cache
+    card = card_cache.black_background(output.screen_wide, output.screen_tall)
+    output.player.show_card(card)
+    
+
+# --------------------------------------------------------------------
+# Returns the title card text for program, beginning at start_date: (title,
+# description, time string, series title, artwork path).
+
+def program_card(output, program, start_date):
+    title = program.get('title', "No Title")
+    description = program.get('description', "No description.")
+    year = program.get('year', None)
+    if year is not None:
+        description = description + ' (' + str(year) + ')'
+    time_string = "Show begins at " + start_date.strftime('%-I:%M %p')
+    artwork_path = program.get('artwork_path', None)
+    if artwork_path is not None:
+        artwork_path = os.path.join(output.channel_dir, artwork_path)
+    return title, description, time_string, None, artwork_path
     
 
 # --------------------------------------------------------------------
+# Has the title cards for whatever follows the program ending at end_date
+# rendered in the background, so they are ready when needed.
 
-def show_technical_difficulties_card(player, title, start_date, screen_wide, screen_tall):
+def prerender_upcoming_cards(output, provider, end_date):
+    global card_cache
+    for start_date, program in provider.upcoming_programs(end_date):
+        card_cache.prerender_title_card(output.screen_wide, output.screen_tall, *program_card(output, program, start_date))
+    
+
+# --------------------------------------------------------------------
+# Has the player open the program's film while its title card is up, so it
+# starts the moment show_film() is called.
+
+def preroll_program(output, program):
+    path = program.get('path', None)
+    if path is None:
+        return
+    output.player.preroll_film(os.path.join(output.channel_dir, path), program.get('start_offset', 0))
+    
+
+# --------------------------------------------------------------------
+
+def show_technical_difficulties_card(output, title, start_date):
+    global card_cache
     description = 'The scheduled program cannot be shown. Enjoy instead this short, \"' + title + '\", until the next scheduled program begins.'
     series_title = 'We Are Having Technical Difficulties'
     artwork_path = os.path.join(CURRENT_DIR, 'tv_color_bars.jpg')
@@ -110,38 +197,48 @@ def show_technical_difficulties_card(player, title, start_date, screen_wide, scr
     if start_date is not None:
         time_string = "Short begins at " + start_date.strftime('%-I:%M %p')
     
-    card_url = set_title_card (screen_wide, screen_tall, 'TITLE_CARD.bmp', 'Please Stand By...', description,
-            time_string, series_title, artwork_path,DEBUG is False)
-    player.show_image(card_url)
+    card = card_cache.title_card(output.screen_wide, output.screen_tall, 'Please Stand By...', description,
+            time_string, series_title, artwork_path)
+    output.player.show_card(card)
     
 
 # --------------------------------------------------------------------
 
-def show_eobd_card(player, date, screen_wide, screen_tall):
-    card_url = set_title_card(screen_wide, screen_tall,
-            "TITLE_CARD.bmp",
-            'End of the Day\'s Schedule',
+def eobd_card(date):
+    return ('End of the Day\'s Schedule',
             'Our schedule of programs will resume broadcast at ' + date.strftime("%-I:%M %p") + '.',
             'Goodnight!', 
             '', 
-            os.path.join(CURRENT_DIR, 'end_of_programming.jpg'),
-            DEBUG is False)
-    player.show_image (card_url)
+            os.path.join(CURRENT_DIR, 'end_of_programming.jpg'))
+    
+
+# --------------------------------------------------------------------
+
+def show_eobd_card(output, date):
+    global card_cache
+    card = card_cache.title_card(output.screen_wide, output.screen_tall, *eobd_card(date))
+    output.player.show_card(card)
     
 
 # --------------------------------------------------------------------
 
-def get_filler(provider, current_end_date):
-    now = datetime.datetime.now()
+def get_filler(provider, current_end_date, now):
     next_program = provider.next_scheduled_program_to_show(now)
     logger.info('get_filler(); next_scheduled_program_to_show: ' + str(next_program) + '.')
+    if next_program == None:
+        # Nothing more scheduled (or an error), no way to know how long to fill.
+        return {'program': None, 'eobd': False}
 
     # How many seconds do we have between now and either the end of the broadcast day or
     # when the next program is to begin?
-    if next_program['eobd']:
-        duration = (current_end_date - now).total_seconds()
+    eobd = next_program.get('eobd', False)
+    if eobd:
+        end_date = current_end_date
     else:
-        duration = (next_program['start_date'] - now).total_seconds()
+        end_date = next_program.get('start_date', None)
+    if end_date == None:
+        return {'program': None, 'eobd': eobd}
+    duration = (end_date - now).total_seconds()
 
     # Allow for time to show the title card - both for the filler and the broadcast to follow.
     duration = math.floor(duration - (MINIMUM_TITLE_CARD_DURATION * 2))
@@ -154,37 +251,112 @@ def get_filler(provider, current_end_date):
     else:
         program = None
     
-    return {'program': program, 'eobd': next_program['eobd']}
+    return {'program': program, 'eobd': eobd}
     
 
 # --------------------------------------------------------------------
+# Returns the next beginning of the broadcast day after date.
 
-def run_broadcast(provider, bobd_time, screen_x, screen_y, screen_wide, screen_tall):
-    state = SEEKING_PROGRAM_STATE
+def next_bobd_date(date, bobd_time):
+    bobd_date = datetime.datetime.combine(date.date(), bobd_time)
+    if bobd_date <= date:
+        bobd_date = bobd_date + datetime.timedelta(days=1)
+    return bobd_date
+    
+
+# --------------------------------------------------------------------
+# The broadcast state-machine for a schedule. Rather than polling, it is
+# stepped (see run_channels()) at the next time something can happen: the
+# program waited on starts, the program playing ends, the broadcast day
+# begins, or it is woken early (the channel reloaded, the player finished a
+# film). step() returns when it next wants to be stepped, None when the
+# schedule is exhausted. Without a channel_file_path the channel's files are
+# not watched for edits.
+
+class schedule_broadcast:
+    def __init__ (self, output, provider, bobd_time, channel_file_path=None):
+        self.output = output
+        self.provider = provider
+        self.bobd_time = bobd_time
+        self.channel_file_path = channel_file_path
+        self.watcher = None
+        self.timer = None
+        self.state = SEEKING_PROGRAM_STATE
+        self.program = None
+        self.start_date = None
+        self.end_date = None
+        self.deadline = None
     
-    # Create a player.
-    player = film_player()
-    clear_title_card(player)
+    # --------------------------------------------------------------------
+    # timer is woken with (self, reason) tuples, its clock is the broadcast's.
     
-    while True:
-        sleep(1)
+    def start(self, timer):
+        self.timer = timer
+        self.output.player.on_film_end(lambda: timer.wake((self, 'film_end')))
         
-        now = datetime.datetime.now()
-#       now = datetime.datetime.strptime('Sep 27 2022  6:00AM', '%b %d %Y %I:%M%p')
+        # Pick up edits to the channel's files without restarting.
+        # A reload wakes the broadcast in case it is waiting on a changed program.
+        if self.channel_file_path != None:
+            self.watcher = channel_watcher(self.provider, self.channel_file_path, CHANNEL_POLL_INTERVAL, lambda: timer.wake((self, 'reload')))
+            self.watcher.start()
+        
+        clear_title_card(self.output)
+        card_cache.prerender_title_card(self.output.screen_wide, self.output.screen_tall, *eobd_card(self.bobd_time))
+        self.deadline = timer.now()
+        return self.deadline
+    
+    # --------------------------------------------------------------------
+    
+    def stop(self):
+        clear_title_card(self.output)
+        if self.watcher != None:
+            self.watcher.stop()
+        self.provider.stop_prefetching()
+        self.provider.save_rotation_state()
+    
+    # --------------------------------------------------------------------
+    # reasons is the set of reasons the broadcast was woken early (if it was).
+    
+    def step(self, reasons):
+        output = self.output
+        provider = self.provider
+        player = output.player
+        state = self.state
+        program = self.program
+        start_date = self.start_date
+        end_date = self.end_date
+        
+        now = self.timer.now()
+        eobd_shown = False
+        was_seeking = (state == SEEKING_PROGRAM_STATE)
+        was_playing = (state == PLAYING_PROGRAM_STATE)
+        
+        if ('reload' in reasons) and (state == WAITING_FOR_START_STATE):
+            # The schedule may have changed under the title card, look again.
+            logger.info('step(); channel reloaded, seeking program again.')
+            state = SEEKING_PROGRAM_STATE
+        if ('film_end' in reasons) and (state == PLAYING_PROGRAM_STATE) and (now < end_date):
+            logger.info('step(); film ended ' + str(round((end_date - now).total_seconds())) + ' seconds early.')
         
         if state == SEEKING_PROGRAM_STATE:
             program = provider.program_to_show(now)
-            logger.debug('run_broadcast(); program_to_show: ' + str(program) + '.')
+            logger.debug('step(); program_to_show: ' + str(program) + '.')
 			
+            # See if there is no schedule for today.
+            if program is None:
+                logger.info('step(); no schedule for today, exiting.')
+                return None
+            
             # See if "not-a-program" was returned.
             if provider.is_no_program(program):
                 # See if it is the end of the broadcast day (eobd).
                 eobd = program.get('eobd', False)
                 if eobd:
-                    show_eobd_card(player, bobd_time, screen_wide, screen_tall)
+                    show_eobd_card(output, self.bobd_time)
+                    eobd_shown = True
                 else:
-                    logger.info('run_broadcast(); no more programs scheduled for broadcast, exiting.')
-                    break
+                    logger.info('step(); no more programs scheduled for broadcast, exiting.')
+                    return None
             else:
                 # We have a program to show.
                 start_date = program.get('start_date', None)
@@ -195,37 +367,28 @@ def run_broadcast(provider, bobd_time, screen_x, screen_y, screen_wide, screen_t
                     # If the start date-time is in the future, put up a title card.
                     # We will wait until it is time to begin the program.
                     # Clear EOBD card, display title card, wait for program to start.
-                    clear_title_card(player)
-                    
-                    title = program.get('title', "No Title")
-                    description = program.get('description', "No description.")
-                    year = program.get('year', None)
-                    if year is not None:
-                        description = description + ' (' + str(year) + ')'
-                    time_string = "Show begins at " + start_date.strftime('%-I:%M %p')
-                    artwork_path = program.get('artwork_path', None)
-                    if artwork_path is not None:
-                        artwork_path = os.path.join(channel_dir, artwork_path)
-                    show_title_card(player, title, description, time_string, None, artwork_path)
+                    clear_title_card(output)
+                    show_title_card(output, *program_card(output, program, start_date))
+                    preroll_program(output, program)
                     state = WAITING_FOR_START_STATE
                 else:
                     # Program has already begun, we will show the program - in progress.
                     # Clear title card.
-                    clear_title_card(player)
+                    clear_title_card(output)
                     path = program.get('path', None)
-                    path = os.path.join(channel_dir, path)
+                    path = os.path.join(output.channel_dir, path)
                     title = program.get('title', "No Title")
-                    logger.info('run_broadcast(); resuming program : ' + title + '.')
+                    logger.info('step(); resuming program : ' + title + '.')
                     position = program.get('start_offset', 0)
-                    success = player.show_film(path, position, screen_x, screen_y, screen_wide, screen_tall)
+                    success = player.show_film(path, position, output.screen_x, output.screen_y, output.screen_wide, output.screen_tall)
                     if success:
                         end_date = program.get('end_date', None)
                         state = PLAYING_PROGRAM_STATE
                     else:
-                        logger.error('run_broadcast(); failed to play program, duration seconds=' + str(program.get('duration', 0)) + '.')
+                        logger.error('step(); failed to play program, duration seconds=' + str(program.get('duration', 0)) + '.')
                         # Problem, show_film failed. It's probably a bad (or missing?) file.
                         # Get some filler to show until enough time has elapsed to get to the next program.
-                        filler_dict = get_filler(provider, end_date)
+                        filler_dict = get_filler(provider, end_date, now)
                         program = filler_dict.get('program', None)
 #                         next_program = provider.next_scheduled_program_to_show(now)
 #                         logger.info('run_broadcast(); next_scheduled_program_to_show: ' + str(next_program) + '.')
@@ -241,44 +404,47 @@ def run_broadcast(provider, bobd_time, screen_x, screen_y, screen_wide, screen_t
 #                             logger.info('run_broadcast(); filler_to_show: ' + str(program) + '.')
 #                         else:
 #                             program = None
-                        if program is not None:
+                        if (program is not None) and (not provider.is_no_program(program)):
                             title = program.get('title', "No Title")
-                            start_date = program.get('start_date', None) #Not sure why 'start_date' was missing but it was.
-                            show_technical_difficulties_card(player, title, start_date, screen_wide, screen_tall)
+                            start_date = program.get('start_date', None)
+                            show_technical_difficulties_card(output, title, start_date)
+                            preroll_program(output, program)
                             state = WAITING_FOR_START_STATE
                         elif filler_dict.get('eobd', False):
-                            show_eobd_card(player, bobd_time, screen_wide, screen_tall)
+                            show_eobd_card(output, self.bobd_time)
+                            eobd_shown = True
         elif state == WAITING_FOR_START_STATE:
             # BOGUS: start_date is sometimes NoneType, see why (fix), error is:
             # "TypeError: '>=' not supported between instances of 'datetime.datetime' and 'NoneType'"
             if start_date is None: # BOGUS, added this line and next to work around error mentioned.
-                logger.error('run_broadcast(); error, start_date is NONE.')
-            elif datetime.datetime.now() >= start_date:
+                logger.error('step(); error, start_date is NONE.')
+            elif self.timer.now() >= start_date:
                 # Clear title card, show film in progress.
-                clear_title_card(player)
+                clear_title_card(output)
                 path = program['path']
-                path = os.path.join(channel_dir, path)
+                path = os.path.join(output.channel_dir, path)
                 title = program.get('title', 'No Title')
                 if program.get('filler', False):
-                    logger.info('run_broadcast(); broadcasting filler : ' + title + '.')
+                    logger.info('step(); broadcasting filler : ' + title + '.')
                 else:
-                    logger.info('run_broadcast(); broadcasting program : ' + title + '.')
+                    logger.info('step(); broadcasting program : ' + title + '.')
                 position = program.get('start_offset', 0)
-                success = player.show_film(path, position, screen_x, screen_y, screen_wide, screen_tall)
+                success = player.show_film(path, position, output.screen_x, output.screen_y, output.screen_wide, output.screen_tall)
                 if not success:
-                    logger.error('run_broadcast(); failed to play program, duration seconds=' + str(program.get('duration', 0)) + '.')
+                    logger.error('step(); failed to play program, duration seconds=' + str(program.get('duration', 0)) + '.')
                     
                     # Try to find a filler program for now.
-                    filler_dict = get_filler(provider, end_date)
+                    filler_dict = get_filler(provider, end_date, now)
                     program = filler_dict.get('program', None)
                     if (program is not None) and (not provider.is_no_program(program)):
                         title = program.get('title', "No Title")
                         start_date = program['start_date']
                         end_date = program['end_date']
-                        show_technical_difficulties_card(player, title, start_date, screen_wide, screen_tall)
+                        show_technical_difficulties_card(output, title, start_date)
+                        preroll_program(output, program)
                         state = WAITING_FOR_START_STATE
                     else:
-                        end_date = datetime.datetime.now()
+                        end_date = self.timer.now()
                         state = SEEKING_PROGRAM_STATE
 #                         if filler_dict.get('eobd', False):
 #                                 show_eobd_card(player, bobd_time, screen_wide, screen_tall)
@@ -286,17 +452,320 @@ def run_broadcast(provider, bobd_time, screen_x, screen_y, screen_wide, screen_t
                 else:
                     state = PLAYING_PROGRAM_STATE
         elif state == PLAYING_PROGRAM_STATE:
-                if datetime.datetime.now() > end_date:
+                if self.timer.now() >= end_date:
                     player.stop_film()
                     state = SEEKING_PROGRAM_STATE
+        
+        # While a program plays, get the cards for what follows it ready.
+        if (state == PLAYING_PROGRAM_STATE) and (not was_playing):
+            prerender_upcoming_cards(output, provider, end_date)
+        
+        # Step again at the next deadline.
+        deadline = self.deadline
+        if (state == WAITING_FOR_START_STATE) and (start_date is not None):
+            deadline = start_date
+        elif state == PLAYING_PROGRAM_STATE:
+            deadline = end_date
+        elif state == SEEKING_PROGRAM_STATE:
+            if eobd_shown:
+                deadline = next_bobd_date(now, self.bobd_time)
+            elif was_seeking:
+                # Nothing could be shown, try again shortly.
+                deadline = now + datetime.timedelta(seconds=RETRY_INTERVAL)
+            else:
+                # A program just ended, look for the next one right away.
+                deadline = now
+        else:
+            deadline = now + datetime.timedelta(seconds=RETRY_INTERVAL)
+        
+        self.state = state
+        self.program = program
+        self.start_date = start_date
+        self.end_date = end_date
+        self.deadline = deadline
+        return deadline
     
-    clear_title_card(player)
+
+# --------------------------------------------------------------------
+# The broadcast state-machine for a "list" (basically a playlist in JSON
+# format). It shuffles the resource list and plays through all the content,
+# then re-shuffles and repeats forever. Stepped like a schedule_broadcast.
+
+class list_broadcast:
+    def __init__ (self, output, film_provider):
+        self.output = output
+        self.film_provider = film_provider
+        self.state = SEEKING_PROGRAM_STATE
+        self.program_dict = None
+        self.start_date = None
+        self.end_date = None
+        self.timer = None
+    
+    # --------------------------------------------------------------------
+    
+    def start(self, timer):
+        self.timer = timer
+        self.output.player.on_film_end(lambda: timer.wake((self, 'film_end')))
+        return timer.now()
+    
+    # --------------------------------------------------------------------
+    
+    def stop(self):
+        self.film_provider.save_rotation()
+        clear_title_card(self.output)
+    
+    # --------------------------------------------------------------------
+    
+    def step(self, reasons):
+        output = self.output
+        player = output.player
+        
+        if self.state == SEEKING_PROGRAM_STATE:
+            self.program_dict = self.film_provider.program_to_show(None)
+            if self.program_dict is None:
+                logger.error('step(); no program to show, exiting.')
+                return None
+            else:
+                self.start_date = self.timer.now() + datetime.timedelta(seconds=30)
+                self.end_date = self.start_date + datetime.timedelta(seconds=self.program_dict.get('duration', 0))
+                
+                # Display title card, wait for program to start.
+                show_title_card(output, *program_card(output, self.program_dict, self.start_date))
+                preroll_program(output, self.program_dict)
+                
+                # Wait for program to start.
+                self.state = WAITING_FOR_START_STATE
+        elif self.state == WAITING_FOR_START_STATE:
+            if self.timer.now() >= self.start_date:
+                # Clear title card, show film.
+                clear_title_card(output)
+                path = self.program_dict.get('path', None)
+                if path is None:
+                    logger.error('step(); program missing path, exiting.')
+                    return None
+                path = os.path.join(output.channel_dir, path)
+                title = self.program_dict.get('title', "No Title")
+                logger.info('step(); showing program : ' + title + '.')
+                position = self.program_dict.get('start_offset', 0)
+                success = player.show_film(path, position, output.screen_x, output.screen_y, output.screen_wide, output.screen_tall)
+                if not success:
+                    self.end_date = self.timer.now()
+                    self.state = SEEKING_PROGRAM_STATE
+                else:
+                    self.state = PLAYING_PROGRAM_STATE
+        elif self.state == PLAYING_PROGRAM_STATE:
+                if self.timer.now() >= self.end_date:
+                    player.stop_film()
+                    self.state = SEEKING_PROGRAM_STATE
+        
+        # Step again at the next deadline.
+        if self.state == WAITING_FOR_START_STATE:
+            return self.start_date
+        elif self.state == PLAYING_PROGRAM_STATE:
+            return self.end_date
+        return self.timer.now()
+    
+
+# --------------------------------------------------------------------
+# Steps one broadcast on a thread of its own, so a slow step (a film slow to
+# open, a title card rendered on the spot) holds up only its own channel.
+# Each step's deadline is handed back by waking the timer with (broadcast,
+# 'stepped'). A broadcast that is done (or that finish() is called on) is
+# stopped on the worker too.
+
+class broadcast_worker:
+    def __init__ (self, broadcast, timer):
+        self.broadcast = broadcast
+        self.timer = timer
+        self.requests = queue.Queue()
+        self.deadline = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    # --------------------------------------------------------------------
+    
+    def _run(self):
+        while True:
+            reasons = self.requests.get()
+            if reasons is None:
+                break
+            try:
+                deadline = self.broadcast.step(reasons)
+            except Exception as err:
+                logger.exception('_run(); exception stepping broadcast, stopping it: ' + str(err))
+                deadline = None
+            self.deadline = deadline
+            self.timer.wake((self.broadcast, 'stepped'))
+            if deadline is None:
+                break
+        self.broadcast.stop()
+    
+    # --------------------------------------------------------------------
+    # reasons is the set of reasons the broadcast was woken early.
+    
+    def step(self, reasons):
+        self.requests.put(reasons)
+    
+    # --------------------------------------------------------------------
+    # Stops the broadcast (after any step under way) and waits for it.
+    
+    def finish(self):
+        self.requests.put(None)
+        self.thread.join()
+    
+
+# --------------------------------------------------------------------
+# Drives any number of broadcasts (schedule_broadcast, list_broadcast): sleeps
+# until the earliest of their deadlines (or until one is woken early) and
+# steps those that are due. Returns when every broadcast has finished, or
+# when the next deadline is past end_date (if given). timer, a
+# broadcast_timer by default, is the clock the broadcasts run on. With
+# workers each broadcast is stepped on its own broadcast_worker and this
+# thread only keeps time, otherwise they are stepped here one after another
+# (as a simulation on a virtual clock needs).
+
+def run_channels(broadcasts, timer=None, end_date=None, workers=True):
+    if timer is None:
+        timer = broadcast_timer()
+    deadlines = {}
+    for broadcast in broadcasts:
+        deadlines[broadcast] = broadcast.start(timer)
+    if workers:
+        _run_channel_workers(deadlines, timer, end_date)
+        return
+    
+    while len(deadlines) > 0:
+        if (end_date != None) and (min(deadlines.values()) > end_date):
+            break
+        woken = {}
+        for broadcast, reason in timer.wait_until(min(deadlines.values())):
+            woken.setdefault(broadcast, set()).add(reason)
+        
+        now = timer.now()
+        for broadcast in list(deadlines.keys()):
+            if (deadlines[broadcast] > now) and (broadcast not in woken):
+                continue
+            deadline = broadcast.step(woken.get(broadcast, set()))
+            if deadline is None:
+                broadcast.stop()
+                del deadlines[broadcast]
+            else:
+                deadlines[broadcast] = deadline
+    
+    for broadcast in deadlines.keys():
+        broadcast.stop()
+    
+
+# --------------------------------------------------------------------
+# run_channels() with a broadcast_worker per broadcast. A broadcast being
+# stepped has no deadline until its worker hands one back, reasons it is
+# woken for meanwhile are kept for its next step.
+
+def _run_channel_workers(deadlines, timer, end_date):
+    workers = {}
+    for broadcast in deadlines.keys():
+        workers[broadcast] = broadcast_worker(broadcast, timer)
+    busy = set()
+    woken = {}
+    
+    while len(deadlines) > 0:
+        idle_deadlines = [deadline for broadcast, deadline in deadlines.items() if broadcast not in busy]
+        if len(idle_deadlines) > 0:
+            if (end_date != None) and (len(busy) == 0) and (min(idle_deadlines) > end_date):
+                break
+            reasons = timer.wait_until(min(idle_deadlines))
+        else:
+            reasons = timer.wait(MAX_SLEEP)
+        
+        for broadcast, reason in reasons:
+            if broadcast not in deadlines:
+                continue
+            if reason == 'stepped':
+                busy.discard(broadcast)
+                deadline = workers[broadcast].deadline
+                if deadline is None:
+                    # The worker has stopped the broadcast.
+                    workers.pop(broadcast).thread.join()
+                    del deadlines[broadcast]
+                    woken.pop(broadcast, None)
+                else:
+                    deadlines[broadcast] = deadline
+            else:
+                woken.setdefault(broadcast, set()).add(reason)
+        
+        now = timer.now()
+        for broadcast in list(deadlines.keys()):
+            if broadcast in busy:
+                continue
+            if (deadlines[broadcast] > now) and (broadcast not in woken):
+                continue
+            busy.add(broadcast)
+            workers[broadcast].step(woken.pop(broadcast, set()))
+    
+    for worker in workers.values():
+        worker.finish()
+    
+
+# --------------------------------------------------------------------
+
+def warm_artwork(output, series_table):
+    global artwork_images
+    paths = [os.path.join(CURRENT_DIR, 'tv_color_bars.jpg'), os.path.join(CURRENT_DIR, 'end_of_programming.jpg')]
+    if series_table is not None:
+        for series in series_table.values():
+            logo_path = series.get('logo_path', None)
+            if logo_path is not None:
+                paths.append(os.path.join(output.channel_dir, logo_path))
+    artwork_images.warm(paths, (output.screen_wide / 4, output.screen_wide / 4))
+    
+
+# --------------------------------------------------------------------
+# Returns a schedule_broadcast for the channel (manifest, and compiled, if
+# it is compiled) at channel_file_path, shown on output. catalog, if given,
+# is the resource_catalog shared with other channels. A channel that is not
+# live (a simulation) is not watched, prefetched or warmed, and leaves the
+# saved rotations alone. random_seed seeds the filler draws.
+
+def open_schedule_channel(channel_file_path, manifest, compiled, output, catalog=None, live=True, random_seed=None):
+    # Create a program provider for the schedule.
+    schedule_descriptors = manifest.get('schedules', None)
+    list_schedule = manifest.get('dotw_list_schedule', None)
+    series_table = manifest.get('series', None)
+    list_table = manifest.get('lists', None)
+    bobd = manifest.get('beginning_of_broadcast_day', None) or '05:50'
+    bobd_time = datetime.datetime.strptime (bobd, '%H:%M').time()
+    provider = schedule_program_provider(output.channel_dir, schedule_descriptors, list_schedule, series_table, list_table, bobd_time, MINIMUM_TITLE_CARD_DURATION, MINIMUM_DEAD_TIME_TO_FILL, compiled, SCHEDULE_CACHE_SIZE, catalog, live, random_seed)
+    if not live:
+        return schedule_broadcast(output, provider, bobd_time)
+    
+    # Get the series logos (and the cards' own artwork) scaled ahead of the first cards.
+    warm_artwork(output, series_table)
+    
+    # Load tomorrow's schedule in the background, well ahead of midnight.
+    provider.start_prefetching()
+    return schedule_broadcast(output, provider, bobd_time, channel_file_path)
+    
+
+# --------------------------------------------------------------------
+# Returns a list_broadcast for the list (compiled, if it is compiled) at
+# path, shown on output. See open_schedule_channel() for live.
+
+def open_list_channel(path, compiled, output, live=True):
+    state_path = None
+    if live:
+        state_path = rotation_state_path(path)
+    
+    # Create a film provider, in this case for a list of films.
+    if compiled != None:
+        film_provider = list_program_provider(None, compiled.list_resource_handles(compiled.first_list_id()), compiled, state_path)
+    else:
+        film_provider = list_program_provider(path, None, None, state_path)
+    return list_broadcast(output, film_provider)
     
 
 # --------------------------------------------------------------------
 # This is the outer function/loop when displaying content from a "schedule".
-# It loops once every day, calls the schedule state-machine in run_broadcast_day()
-# above. It runs until it cannot find a schedule for the current day.
+# It runs until it cannot find a schedule for the current day.
 
 def run_uhf_schedule():
     global screen_x
@@ -305,91 +774,122 @@ def run_uhf_schedule():
     global screen_tall
     global channel_dir
     global channel_manifest
+    global channel_compiled
     
-    # Create a program provider for the schedule.
-    schedule_descriptors = channel_manifest.get('schedules', None)
-    list_schedule = channel_manifest.get('dotw_list_schedule', None)
-    series_table = channel_manifest.get('series', None)
-    list_table = channel_manifest.get('lists', None)
-    bobd = channel_manifest.get('beginning_of_broadcast_day', '05:50')
-    bobd_time = datetime.datetime.strptime (bobd, '%H:%M').time()
-    provider = schedule_program_provider(channel_dir, schedule_descriptors, list_schedule, series_table, list_table, bobd_time, MINIMUM_TITLE_CARD_DURATION, MINIMUM_DEAD_TIME_TO_FILL)
-    
-    # Show programs until the schedule is exhausted.
-    run_broadcast(provider, bobd_time, screen_x, screen_y, screen_wide, screen_tall)
+    output = channel_output(channel_dir, None, screen_x, screen_y, screen_wide, screen_tall)
+    run_channels([open_schedule_channel(CHANNEL_FILE_PATH, channel_manifest, channel_compiled, output)])
     
 
 # --------------------------------------------------------------------
-# This is the primary function/loop when displaying content from a "list"
-# (basically a playlist in JSON format). It shuffles the resource list
-# and plays through all the content, then re-shuffles and repeats forever.
+# This is the primary function/loop when displaying content from a "list".
 
 def run_uhf_list(path):
     global channel_dir
+    global channel_compiled
     global screen_x
     global screen_y
     global screen_wide
     global screen_tall
     
-    # Create a film provider, in this case for a list of films.
-    film_provider = list_program_provider(path)
-    
-    # Create a player.
-    player = film_player()
+    output = channel_output(channel_dir, None, screen_x, screen_y, screen_wide, screen_tall)
+    run_channels([open_list_channel(path, channel_compiled, output)])
     
-    state = SEEKING_PROGRAM_STATE
+
+# --------------------------------------------------------------------
+# Broadcasts several channels (schedules or lists, each a manifest or
+# compiled channel file) from this one process, channel n on screen n.
+# The channels share the title card cache and renderer, the artwork cache
+# and, for schedules read from JSON, one resource catalog.
+
+def run_uhf_channels(paths):
+    global screen_x
+    global screen_y
+    global screen_wide
+    global screen_tall
     
-    while True:
-        sleep(1)
-        
-        if state == SEEKING_PROGRAM_STATE:
-            program_dict = film_provider.program_to_show(None)
-            if program_dict is None:
-                logger.error('run_uhf_list(); no program to show, exiting.')
-                break
-            else:
-                start_date = datetime.datetime.now() + datetime.timedelta(seconds=30)
-                end_date = start_date + datetime.timedelta(seconds=program_dict.get('duration', 0))
-                
-                # Display title card, wait for program to start.
-                title = program_dict.get('title', "No Title")
-                description = program_dict.get('description', "No description.")
-                year = program_dict.get('year', None)
-                if year is not None:
-                    description = description + ' (' + str(year) + ')'
-                time_string = "Show begins at " + start_date.strftime('%-I:%M %p')
-                artwork_path = program_dict.get('artwork_path', None)
-                if artwork_path is not None:
-                    artwork_path = os.path.join(channel_dir, artwork_path)
-                show_title_card(player, title, description, time_string, None, artwork_path)
-                
-                # Wait for program to start.
-                state = WAITING_FOR_START_STATE
-        elif state == WAITING_FOR_START_STATE:
-            if datetime.datetime.now() >= start_date:
-                # Clear title card, show film.
-                clear_title_card(player)
-                path = program_dict.get('path', None)
-                if path is None:
-                    logger.error('run_uhf_list(); program missing path, exiting.')
-                    break
-                path = os.path.join(channel_dir, path)
-                title = program_dict.get('title', "No Title")
-                logger.info('run_uhf_list(); showing program : ' + title + '.')
-                position = program_dict.get('start_offset', 0)
-                success = player.show_film(path, position, screen_x, screen_y, screen_wide, screen_tall)
-                if not success:
-                    end_date = datetime.datetime.now()
-                    state = SEEKING_PROGRAM_STATE
-                else:
-                    state = PLAYING_PROGRAM_STATE
-        elif state == PLAYING_PROGRAM_STATE:
-                if datetime.datetime.now() > end_date:
-                    player.stop_film()
-                    state = SEEKING_PROGRAM_STATE
+    catalog = resource_catalog()
+    broadcasts = []
+    for screen_index, path in enumerate(paths):
+        compiled = None
+        if path.endswith('.uhfc'):
+            compiled, manifest = load_compiled_channel(path)
+        else:
+            manifest = load_channel_manifest(path)
+        if manifest is None:
+            logger.error('run_uhf_channels(); unable to open the channel manifest, skipping: ' + path)
+            continue
         
-    # Exiting.
-    clear_title_card(player)
+        output = channel_output(os.path.dirname(path), screen_index, screen_x, screen_y, screen_wide, screen_tall)
+        version = manifest.get('version', None)
+        if version == 'UHF Channel - v1':
+            broadcasts.append(open_schedule_channel(path, manifest, compiled, output, catalog))
+        elif version == 'UHF List - v1':
+            broadcasts.append(open_list_channel(path, compiled, output))
+        else:
+            logger.error('run_uhf_channels(); unsupported channel file, skipping: ' + path)
+    
+    run_channels(broadcasts)
+    
+
+# --------------------------------------------------------------------
+# Replays days of the channel (manifest or compiled channel) at path from
+# start_date on a virtual clock, with nothing shown or rendered, and writes
+# what would have aired to timeline_path (see headless_player in
+# simulation.py). Shuffles are seeded, so the same channel gives the same
+# timeline. Logs how long it took.
+
+def run_uhf_simulation(path, start_date, days, timeline_path):
+    global screen_x
+    global screen_y
+    global screen_wide
+    global screen_tall
+    global card_cache
+    
+    compiled = None
+    if path.endswith('.uhfc'):
+        compiled, manifest = load_compiled_channel(path)
+    else:
+        manifest = load_channel_manifest(path)
+    if manifest is None:
+        logger.error('run_uhf_simulation(); unable to open the channel manifest: ' + path)
+        return
+    
+    random.seed(SIMULATION_SEED)
+    card_cache = simulated_card_cache()
+    timer = simulated_timer(start_date)
+    end_date = start_date + datetime.timedelta(days=days)
+    started = time.monotonic()
+    with open(timeline_path, 'w') as timeline:
+        player = headless_player(timer, timeline, SIMULATION_CHECK_FILMS)
+        output = channel_output(os.path.dirname(path), None, screen_x, screen_y, screen_wide, screen_tall, player)
+        version = manifest.get('version', None)
+        if version == 'UHF Channel - v1':
+            broadcast = open_schedule_channel(path, manifest, compiled, output, None, False, SIMULATION_SEED)
+        elif version == 'UHF List - v1':
+            broadcast = open_list_channel(path, compiled, output, False)
+        else:
+            logger.error('run_uhf_simulation(); unsupported channel file: ' + path)
+            return
+        run_channels([broadcast], timer, end_date, False)
+    elapsed = time.monotonic() - started
+    
+    simulated_days = (timer.now() - start_date).total_seconds() / (24 * 60 * 60)
+    logger.info('run_uhf_simulation(); ' + str(round(simulated_days, 2)) + ' days in ' + str(round(elapsed, 3)) + ' seconds (' +
+            str(round(simulated_days / max(elapsed, 0.001), 1)) + ' days per second), steps=' + str(timer.wait_count) +
+            ', films=' + str(player.film_count) + ', missing=' + str(player.missing_count) + ', cards=' + str(player.card_count) +
+            ', prerendered=' + str(card_cache.prerender_count) + ', timeline=' + timeline_path + '.')
+    
+
+# --------------------------------------------------------------------
+# Loads a compiled channel (see compiled_channel.py), returns it along with
+# a small manifest dictionary describing it. May return (None, None).
+
+def load_compiled_channel(path):
+    compiled = compiled_channel(path)
+    if not compiled.is_valid():
+        logger.error('load_compiled_channel(); unable to open compiled channel: ' + path)
+        return None, None
+    return compiled, compiled.manifest()
     
 
 # --------------------------------------------------------------------
@@ -401,6 +901,35 @@ def main():
     global screen_tall
     global channel_dir
     global channel_manifest
+    global channel_compiled
+    global card_cache
+    global artwork_images
+    
+    # "uhf.py compile manifest.json [output.uhfc]" compiles the channel and exits.
+    if (len(sys.argv) > 1) and (sys.argv[1] == 'compile'):
+        manifest_path = CHANNEL_FILE_PATH
+        if len(sys.argv) > 2:
+            manifest_path = sys.argv[2]
+        output_path = os.path.splitext(manifest_path)[0] + '.uhfc'
+        if len(sys.argv) > 3:
+            output_path = sys.argv[3]
+        compile_channel(manifest_path, output_path)
+        return
+    
+    # "uhf.py simulate manifest.json [YYYY-MM-DD [days [timeline.txt]]]" replays the
+    # channel on a virtual clock, see run_uhf_simulation().
+    if (len(sys.argv) > 2) and (sys.argv[1] == 'simulate'):
+        start_date = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        if len(sys.argv) > 3:
+            start_date = datetime.datetime.strptime(sys.argv[3], '%Y-%m-%d')
+        days = SIMULATION_DAYS
+        if len(sys.argv) > 4:
+            days = float(sys.argv[4])
+        timeline_path = os.path.splitext(os.path.basename(sys.argv[2]))[0] + '_timeline.txt'
+        if len(sys.argv) > 5:
+            timeline_path = sys.argv[5]
+        run_uhf_simulation(sys.argv[2], start_date, days, timeline_path)
+        return
     
     logger.info('main(); starting.')
     
@@ -411,8 +940,20 @@ def main():
         screen_wide = DEBUG_SCREEN_WIDE
         screen_tall = DEBUG_SCREEN_TALL
     
-    # Load the channel manifest. Get enclosing directory.
-    channel_manifest = load_channel_manifest(CHANNEL_FILE_PATH)
+    card_cache = title_card_cache(TITLE_CARD_CACHE_DIR, TITLE_CARD_CACHE_SIZE)
+    artwork_images = artwork_cache(ARTWORK_CACHE_DIR)
+    use_artwork_cache(artwork_images)
+    
+    # "uhf.py supervise a.json b.uhfc ..." broadcasts each channel on its own screen.
+    if (len(sys.argv) > 2) and (sys.argv[1] == 'supervise'):
+        run_uhf_channels(sys.argv[2:])
+        return
+    
+    # Load the channel manifest (or compiled channel). Get enclosing directory.
+    if CHANNEL_FILE_PATH.endswith('.uhfc'):
+        channel_compiled, channel_manifest = load_compiled_channel(CHANNEL_FILE_PATH)
+    else:
+        channel_manifest = load_channel_manifest(CHANNEL_FILE_PATH)
     if channel_manifest is None:
         logger.error('main(); unable to open the channel manifest, exiting.')
         return
@@ -434,4 +975,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
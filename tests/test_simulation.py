@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SAMPLE_MANIFEST = os.path.join(PACKAGE_DIR, 'sample_channel', 'schedules', 'manifest.json')
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'src'))
+
+
+# --------------------------------------------------------------------
+# Replays the sample channel on the simulation's virtual clock. The sample
+# channel has no media, so every film takes the technical-difficulties path.
+
+class simulation_test(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        # uhf.py logs to 'uhf_log' in the working directory.
+        self.previous_dir = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        import uhf
+        self.uhf = uhf
+
+
+    # --------------------------------------------------------------------
+
+    def tearDown(self):
+        os.chdir(self.previous_dir)
+        self.temp_dir.cleanup()
+
+
+    # --------------------------------------------------------------------
+    # A failed program with nothing after it that day once ended the replay
+    # (2022-09-16 22:30, KeyError: 'start_date' in get_filler()).
+
+    def test_week_with_films_missing(self):
+        self.uhf.SIMULATION_CHECK_FILMS = True
+        timeline_path = os.path.join(self.temp_dir.name, 'timeline.txt')
+        start_date = datetime.datetime(2022, 9, 10)
+        self.uhf.run_uhf_simulation(SAMPLE_MANIFEST, start_date, 7, timeline_path)
+
+        with open(timeline_path, 'r') as timeline:
+            lines = timeline.readlines()
+        self.assertTrue(any(' missing ' in line for line in lines))
+        self.assertFalse(any(' film ' in line for line in lines))
+        last_date = datetime.datetime.strptime(lines[-1][:19], '%Y-%m-%d %H:%M:%S')
+        self.assertGreater(last_date, datetime.datetime(2022, 9, 16, 22, 30))
+
+
+if __name__ == '__main__':
+    unittest.main()